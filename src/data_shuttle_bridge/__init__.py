@@ -1,28 +1,67 @@
 # SQL
 from data_shuttle_bridge.sql.ids import (
     KSortedID,
+    IdLayout,
+    IdLayoutMismatch,
+    IdGeneratorRegistry,
+    get_generator_registry,
     set_id_generator,
     get_id_generator,
     clear_id_generator,
 )
 from data_shuttle_bridge.sql.mixins import SyncRowSQLModelMixin, SyncRowSAMixin
-from data_shuttle_bridge.sql.changelog import ChangeLog, SyncState
+from data_shuttle_bridge.sql.changelog import (
+    ChangeLog,
+    SyncState,
+    SyncAck,
+    ChangeLogArchive,
+)
+from data_shuttle_bridge.sql.compaction import (
+    record_ack,
+    compact_change_log,
+    ChangeLogCompactor,
+)
 from data_shuttle_bridge.sql.wiring import (
     attach_change_hooks,
     attach_change_hooks_for_models,
+    configure_change_buffer,
     set_current_node_id,
     get_current_node_id,
 )
+from data_shuttle_bridge.sql.triggers import (
+    install_change_triggers,
+    uninstall_change_triggers,
+    enable_trigger_capture,
+    trigger_ddl,
+    drop_trigger_ddl,
+)
 from data_shuttle_bridge.sql.sync import SyncEngine, ConflictPolicy
+from data_shuttle_bridge.sql.batching import AdaptiveBatchSize
 from data_shuttle_bridge.sql.blueprints import sync_blueprint
-from data_shuttle_bridge.sql.transport import InMemoryPeerTransport, HttpPeerTransport
+from data_shuttle_bridge.sql.codecs import Codec, register_codec
+from data_shuttle_bridge.sql.columnar import ColumnarBatch
+from data_shuttle_bridge.sql.async_sync import AsyncSyncEngine
+from data_shuttle_bridge.sql.transport import (
+    InMemoryPeerTransport,
+    HttpPeerTransport,
+    AsyncPeerTransport,
+    AsyncInMemoryPeerTransport,
+    AsyncHttpPeerTransport,
+)
 from data_shuttle_bridge.sql.registry import (
     NodeRegistry,
+    IdLayoutRecord,
+    NodeIdAllocator,
     node_registry_blueprint,
     allocate_node_id,
+    ensure_id_layout,
 )
 from data_shuttle_bridge.sql.nodeid import ClientNodeManager
-from data_shuttle_bridge.sql.schema import build_schema
+from data_shuttle_bridge.sql.schema import (
+    CompiledSchema,
+    SchemaCycleError,
+    build_schema,
+)
 from data_shuttle_bridge.sql.tenancy import (
     tenant_sync_blueprint_db_per_tenant,
     attach_change_hooks_mt_for_models,
@@ -53,6 +92,10 @@ from data_shuttle_bridge.file_backup.pipeline.chunking import (
 __all__ = [
     # SQL
     "KSortedID",
+    "IdLayout",
+    "IdLayoutMismatch",
+    "IdGeneratorRegistry",
+    "get_generator_registry",
     "set_id_generator",
     "get_id_generator",
     "clear_id_generator",
@@ -60,20 +103,44 @@ __all__ = [
     "SyncRowSAMixin",
     "ChangeLog",
     "SyncState",
+    "SyncAck",
+    "ChangeLogArchive",
+    "record_ack",
+    "compact_change_log",
+    "ChangeLogCompactor",
     "attach_change_hooks",
     "attach_change_hooks_for_models",
+    "configure_change_buffer",
+    "install_change_triggers",
+    "uninstall_change_triggers",
+    "enable_trigger_capture",
+    "trigger_ddl",
+    "drop_trigger_ddl",
     "set_current_node_id",
     "get_current_node_id",
     "SyncEngine",
     "ConflictPolicy",
+    "AdaptiveBatchSize",
     "sync_blueprint",
+    "Codec",
+    "register_codec",
+    "ColumnarBatch",
     "InMemoryPeerTransport",
     "HttpPeerTransport",
+    "AsyncSyncEngine",
+    "AsyncPeerTransport",
+    "AsyncInMemoryPeerTransport",
+    "AsyncHttpPeerTransport",
     "NodeRegistry",
     "node_registry_blueprint",
     "allocate_node_id",
+    "IdLayoutRecord",
+    "NodeIdAllocator",
+    "ensure_id_layout",
     "ClientNodeManager",
     "build_schema",
+    "CompiledSchema",
+    "SchemaCycleError",
     "tenant_sync_blueprint_db_per_tenant",
     "attach_change_hooks_mt_for_models",
     "SyncEngineMT",
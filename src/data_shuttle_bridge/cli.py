@@ -23,8 +23,82 @@ def cmd_node_init(args: argparse.Namespace) -> int:
 
 def cmd_node_show(args: argparse.Namespace) -> int:
     mgr = ClientNodeManager()
+    layout = mgr.id_layout
     print(f"device_key={mgr.device_key}")
     print(f"node_id={mgr.node_id}")
+    print(
+        f"id_layout={layout.timestamp_bits}:{layout.node_bits}:{layout.sequence_bits}"
+    )
+    return 0
+
+
+def cmd_node_bench_ids(args: argparse.Namespace) -> int:
+    import time
+
+    from data_shuttle_bridge.sql.ids import IdLayout, KSortedID
+
+    specs = args.layout or ["41:10:12", "41:13:9", "41:16:6"]
+    try:
+        layouts = [IdLayout.parse(spec) for spec in specs]
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        return 2
+    print("layout     max_nodes  ceiling/s   call/s      reserve/s   years")
+    for layout in layouts:
+        rates = []
+        for use_reserve in (False, True):
+            gen = KSortedID(node_id=layout.max_node, layout=layout)
+            count = 0
+            deadline = time.perf_counter() + args.seconds
+            started = time.perf_counter()
+            while time.perf_counter() < deadline:
+                if use_reserve:
+                    count += len(gen.reserve(layout.ids_per_ms))
+                else:
+                    for _ in range(1000):
+                        gen()
+                    count += 1000
+            rates.append(count / (time.perf_counter() - started))
+        spec = f"{layout.timestamp_bits}:{layout.node_bits}:{layout.sequence_bits}"
+        print(
+            f"{spec:<10} {layout.max_node + 1:<10} {layout.ids_per_ms * 1000:<11} "
+            f"{rates[0]:<11.0f} {rates[1]:<11.0f} {layout.lifetime_years:.0f}"
+        )
+    return 0
+
+
+def cmd_changelog_compact(args: argparse.Namespace) -> int:
+    db_url = args.db or os.environ.get("LOCALFIRST_DB")
+    if not db_url:
+        print("Provide database via --db or LOCALFIRST_DB env var.", file=sys.stderr)
+        return 2
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from data_shuttle_bridge.sql.compaction import compact_change_log
+
+    engine = create_engine(db_url)
+    with Session(engine) as sess:
+        removed = compact_change_log(sess, peer_ids=args.peer, archive=args.archive)
+        sess.commit()
+    print(f"removed={removed}")
+    return 0
+
+
+def cmd_node_upgrade_registry(args: argparse.Namespace) -> int:
+    db_url = args.db or os.environ.get("LOCALFIRST_DB")
+    if not db_url:
+        print("Provide database via --db or LOCALFIRST_DB env var.", file=sys.stderr)
+        return 2
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from data_shuttle_bridge.sql.registry import upgrade_node_registry
+
+    engine = create_engine(db_url)
+    with Session(engine) as sess:
+        added = upgrade_node_registry(sess)
+    print(f"added={','.join(added) or '-'}")
     return 0
 
 
@@ -39,7 +113,7 @@ def main(argv=None):
     sub_node = p_init.add_subparsers(dest="node_cmd", required=True)
 
     p_node_init = sub_node.add_parser(
-        "init", help="Lease or reuse a unique node_id from the server"
+        "init", help="Lease a unique node_id from the server, or renew the saved one"
     )
     p_node_init.add_argument(
         "--server", help="Server base URL (e.g., http://127.0.0.1:5001)"
@@ -49,6 +123,51 @@ def main(argv=None):
     p_node_show = sub_node.add_parser("show", help="Show local device_key and node_id")
     p_node_show.set_defaults(func=cmd_node_show)
 
+    p_bench_ids = sub_node.add_parser(
+        "bench-ids", help="Measure the per-node id rate of id layouts"
+    )
+    p_bench_ids.add_argument(
+        "--layout",
+        action="append",
+        help="timestamp:node:sequence bits, e.g. 41:16:6 (repeatable)",
+    )
+    p_bench_ids.add_argument(
+        "--seconds", type=float, default=1.0, help="Run time per layout and mode"
+    )
+    p_bench_ids.set_defaults(func=cmd_node_bench_ids)
+
+    p_upgrade = sub_node.add_parser(
+        "upgrade-registry",
+        help="Add node_registry columns missing from tables created by older releases",
+    )
+    p_upgrade.add_argument(
+        "--db", help="Database URL (e.g., sqlite:///remote_server.db)"
+    )
+    p_upgrade.set_defaults(func=cmd_node_upgrade_registry)
+
+    # Change log commands
+    p_changelog = sub.add_parser("changelog", help="Change log maintenance commands")
+    sub_changelog = p_changelog.add_subparsers(dest="changelog_cmd", required=True)
+
+    p_compact = sub_changelog.add_parser(
+        "compact", help="Remove change_log entries acknowledged by every peer"
+    )
+    p_compact.add_argument(
+        "--db", help="Database URL (e.g., sqlite:///remote_server.db)"
+    )
+    p_compact.add_argument(
+        "--peer",
+        action="append",
+        help="Peer id that must have acknowledged an entry (repeatable); "
+        "defaults to every registered node and every peer with a stored ack",
+    )
+    p_compact.add_argument(
+        "--archive",
+        action="store_true",
+        help="Copy removed entries to change_log_archive",
+    )
+    p_compact.set_defaults(func=cmd_changelog_compact)
+
     # Backup commands
     add_backup_commands(sub)
 
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Iterable, List, Mapping, Tuple
+
+from sqlmodel import Session
+
+from data_shuttle_bridge.sql.changelog import SyncState
+from data_shuttle_bridge.sql.columnar import ColumnarBatch
+from data_shuttle_bridge.sql.payloads import TableSchema
+from data_shuttle_bridge.sql.schema import CompiledSchema
+from data_shuttle_bridge.sql.sync import ConflictPolicy, SyncEngine
+from data_shuttle_bridge.sql.transport import send_ack
+from data_shuttle_bridge.sql.typing_ import ChangeBatch, ChangePayload, batch_last_id
+from data_shuttle_bridge.sql.wiring import set_current_node_id
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    from data_shuttle_bridge.sql.transport import AsyncPeerTransport
+
+
+class AsyncSyncEngine:
+    """
+    asyncio variant of SyncEngine built on an AsyncSession.
+
+    Speaks the same pull/push/ack protocol through an AsyncPeerTransport. The
+    database work itself is SyncEngine's, run on the session's greenlet via
+    ``AsyncSession.run_sync``, so both engines apply changes identically. Use
+    ``sqlmodel.ext.asyncio.session.AsyncSession`` (or any AsyncSession whose
+    ``sync_session_class`` is ``sqlmodel.Session``).
+
+    Each engine needs its own session; many engines can sync concurrently on
+    one event loop, e.g. with ``asyncio.gather``.
+    """
+
+    def __init__(
+        self,
+        session: "AsyncSession",
+        peer_id: str,
+        schema: Mapping[str, TableSchema],
+        policy: ConflictPolicy = ConflictPolicy.LWW,
+        parent_first_order: Iterable[str] | None = None,
+        node_id: str | None = None,
+        bulk_apply: bool = False,
+        coalesce: bool = False,
+    ):
+        self.sess = session
+        self.peer_id = peer_id
+        self.schema = CompiledSchema.of(schema)
+        self.policy = policy
+        self.node_id = node_id
+        self.bulk_apply = bulk_apply
+        self.coalesce = coalesce
+        self.order = (
+            list(parent_first_order) if parent_first_order else self.schema.order
+        )
+
+    def _engine(self, sess: Session) -> SyncEngine:
+        return SyncEngine(
+            session=sess,
+            peer_id=self.peer_id,
+            schema=self.schema,
+            policy=self.policy,
+            parent_first_order=self.order,
+            node_id=self.node_id,
+            bulk_apply=self.bulk_apply,
+            coalesce=self.coalesce,
+        )
+
+    async def local_changes_since(
+        self, since_id: int, limit: int = 1000
+    ) -> ChangeBatch:
+        return await self.sess.run_sync(
+            lambda s: self._engine(s).local_changes_since(since_id, limit=limit)
+        )
+
+    async def remote_changes_since(
+        self, since_id: int, limit: int = 1000, exclude_node_id: str | None = None
+    ) -> ChangeBatch:
+        return await self.sess.run_sync(
+            lambda s: self._engine(s).remote_changes_since(
+                since_id, limit=limit, exclude_node_id=exclude_node_id
+            )
+        )
+
+    async def apply_remote_changes(self, changes: Iterable[ChangePayload]):
+        if not isinstance(changes, ColumnarBatch):
+            changes = list(changes)
+        await self.sess.run_sync(
+            lambda s: self._engine(s).apply_remote_changes(changes)
+        )
+
+    def _watermarks(self, sess: Session) -> Tuple[int, int]:
+        st = self._engine(sess)._ensure_state()
+        return st.last_pulled_change_id, st.last_pushed_change_id
+
+    def _set_watermark(
+        self, sess: Session, pulled: int | None = None, pushed: int | None = None
+    ) -> None:
+        st = sess.get(SyncState, self.peer_id)
+        if pulled is not None:
+            st.last_pulled_change_id = pulled
+        if pushed is not None:
+            st.last_pushed_change_id = pushed
+        sess.add(st)
+
+    async def pull_then_push(
+        self, peer_transport: "AsyncPeerTransport", batch: int = 1000
+    ) -> Tuple[int, int]:
+        # Context-local, so concurrent tasks each log under their own node_id
+        set_current_node_id(self.node_id)
+        try:
+            since_pull, since_push = await self.sess.run_sync(self._watermarks)
+            pulled = 0
+            while True:
+                remote_changes = await peer_transport.get_changes_since(
+                    since_pull, limit=batch, exclude_node_id=self.node_id
+                )
+                last_id = batch_last_id(remote_changes)
+                if last_id is None or last_id <= since_pull:
+                    break
+                if remote_changes:
+                    await self.apply_remote_changes(remote_changes)
+                    await self.sess.commit()
+                since_pull = last_id
+                await self.sess.run_sync(self._set_watermark, pulled=since_pull)
+                await self.sess.commit()
+                await send_ack(peer_transport, since_pull, self.node_id)
+                pulled += len(remote_changes)
+            pushed = 0
+            while True:
+                out: List[ChangePayload] = await self.local_changes_since(
+                    since_push, limit=batch
+                )
+                last_id = batch_last_id(out)
+                if last_id is None:
+                    break
+                if out:
+                    await peer_transport.apply_changes(out)
+                since_push = last_id
+                await self.sess.run_sync(self._set_watermark, pushed=since_push)
+                await self.sess.commit()
+                pushed += len(out)
+            return pulled, pushed
+        finally:
+            set_current_node_id(None)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import json
+import threading
+from typing import Sequence
+
+from data_shuttle_bridge.sql.typing_ import ChangePayload
+
+
+def estimate_payload_bytes(changes: Sequence[ChangePayload], sample: int = 32) -> int:
+    """
+    Serialized size of a batch. Uses ``changes.nbytes`` when the transport
+    recorded it, otherwise extrapolates from JSON-encoding a sample of rows.
+    """
+    nbytes = getattr(changes, "nbytes", None)
+    if nbytes is not None:
+        return nbytes
+    if not changes:
+        return 0
+    step = max(1, len(changes) // sample)
+    picked = changes[::step][:sample]
+    size = len(json.dumps(list(picked), default=str))
+    return size * len(changes) // len(picked)
+
+
+class AdaptiveBatchSize:
+    """
+    Grows or shrinks a batch limit toward a target per-batch duration.
+
+    After each batch, ``observe`` is fed the row count, the wall time the batch
+    took end to end (round trip plus apply or serialize) and its serialized
+    size. Per-row time and bytes are smoothed, and the next limit is the row
+    count that should take ``target_seconds``, capped so a batch stays under
+    ``max_bytes`` and within ``min_size..max_size``. Growth per step is limited
+    to ``max_growth``; shrinking is immediate. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        initial: int = 1000,
+        min_size: int = 50,
+        max_size: int = 20000,
+        target_seconds: float = 0.5,
+        max_bytes: int = 8 * 1024 * 1024,
+        smoothing: float = 0.5,
+        max_growth: float = 2.0,
+    ):
+        if not (0 < min_size <= max_size):
+            raise ValueError("require 0 < min_size <= max_size")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.smoothing = smoothing
+        self.max_growth = max_growth
+        self._size = min(max(initial, min_size), max_size)
+        self._sec_per_row: float | None = None
+        self._bytes_per_row: float | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _smooth(self, old: float | None, new: float) -> float:
+        if old is None:
+            return new
+        return self.smoothing * new + (1 - self.smoothing) * old
+
+    def observe(self, rows: int, seconds: float, nbytes: int | None = None) -> int:
+        """Record one batch and return the next limit."""
+        if rows <= 0:
+            return self._size
+        with self._lock:
+            self._sec_per_row = self._smooth(self._sec_per_row, seconds / rows)
+            if nbytes is not None:
+                self._bytes_per_row = self._smooth(self._bytes_per_row, nbytes / rows)
+            ideal = float(self.max_size)
+            if self._sec_per_row > 0:
+                ideal = self.target_seconds / self._sec_per_row
+            if self._bytes_per_row:
+                ideal = min(ideal, self.max_bytes / self._bytes_per_row)
+            ideal = min(ideal, self._size * self.max_growth)
+            self._size = int(min(max(ideal, self.min_size), self.max_size))
+            return self._size
+
+    def copy(self) -> "AdaptiveBatchSize":
+        """A fresh controller with the same settings, starting at the current size."""
+        return AdaptiveBatchSize(
+            initial=self._size,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            target_seconds=self.target_seconds,
+            max_bytes=self.max_bytes,
+            smoothing=self.smoothing,
+            max_growth=self.max_growth,
+        )
@@ -1,36 +1,305 @@
-from flask import Blueprint, request, jsonify
+from typing import Any
 
-from data_shuttle_bridge.sql.typing_ import ChangePayload
+from flask import Blueprint, Response, abort, request, jsonify, stream_with_context
+
+from data_shuttle_bridge.sql.codecs import JSON, NDJSON, get_codec, negotiate
+from data_shuttle_bridge.sql.columnar import (
+    COLUMNAR,
+    changes_from_wire,
+    changes_to_wire,
+)
+from data_shuttle_bridge.sql.compression import (
+    DEFAULT_LEVEL,
+    DEFAULT_MAX_BODY_BYTES,
+    DEFAULT_MIN_BYTES,
+    IDENTITY,
+    SUPPORTED_ENCODINGS,
+    BodyTooLarge,
+    UnsupportedEncoding,
+    choose_encoding,
+    compress_chunks,
+    decompress_stream,
+    inflate_chunks,
+    iter_lines,
+    iter_stream,
+    maybe_compress,
+    normalize_encoding,
+)
+from data_shuttle_bridge.sql.compaction import record_ack, record_peer_seen
+from data_shuttle_bridge.sql.notify import get_change_notifier
 from data_shuttle_bridge.sql.sync import SyncEngine
+from data_shuttle_bridge.sql.typing_ import ChangeStream
+
+# Streamed responses are written in pieces of about this size
+STREAM_FLUSH_BYTES = 64 * 1024
+
+
+def encode_response(
+    payload: Any,
+    compress_min_bytes: int = DEFAULT_MIN_BYTES,
+    compress_level: int = DEFAULT_LEVEL,
+) -> Response:
+    """
+    Encode a sync response with the codec the client's Accept header prefers,
+    compressed per Accept-Encoding once it reaches ``compress_min_bytes``.
+    """
+    codec = negotiate(request.headers.get("Accept"))
+    body, encoding = maybe_compress(
+        codec.encode(payload),
+        choose_encoding(request.headers.get("Accept-Encoding")),
+        min_bytes=compress_min_bytes,
+        level=compress_level,
+    )
+    resp = Response(body, mimetype=codec.content_type)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    resp.headers["Vary"] = "Accept, Accept-Encoding"
+    # Advertise what pushed bodies may be compressed with
+    resp.headers["Accept-Encoding"] = ", ".join(SUPPORTED_ENCODINGS)
+    return resp
+
+
+def wants_ndjson() -> bool:
+    """Whether the client explicitly accepts a streamed NDJSON response."""
+    return any(m == NDJSON and q > 0 for m, q in request.accept_mimetypes)
+
+
+def ndjson_response(
+    stream: ChangeStream, compress_level: int = DEFAULT_LEVEL
+) -> Response:
+    """
+    Stream changes as newline-delimited JSON, one change per line, followed
+    by a ``{"last_id": ...}`` trailer line. Rows are serialized as the
+    stream yields them, so the batch is never held whole. Compressed
+    incrementally when the client accepts gzip/deflate.
+    """
+    codec = get_codec(JSON)
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+
+    def lines():
+        buf = bytearray()
+        for change in stream:
+            buf += codec.encode(change)
+            buf += b"\n"
+            if len(buf) >= STREAM_FLUSH_BYTES:
+                yield bytes(buf)
+                buf.clear()
+        buf += codec.encode({"last_id": stream.last_id})
+        buf += b"\n"
+        yield bytes(buf)
+
+    body = lines()
+    if encoding:
+        body = compress_chunks(body, encoding, compress_level)
+    resp = Response(stream_with_context(body), mimetype=NDJSON)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    resp.headers["Vary"] = "Accept, Accept-Encoding"
+    resp.headers["Accept-Encoding"] = ", ".join(SUPPORTED_ENCODINGS)
+    return resp
+
+
+def decode_request(max_bytes: int | None = None) -> Any:
+    """
+    Decode a sync request body by its Content-Type (JSON when unknown).
+
+    gzip/deflate bodies are inflated from the request stream as they are read.
+    Other encodings are rejected with 415, bodies inflating past ``max_bytes``
+    with 413.
+    """
+    encoding = normalize_encoding(request.headers.get("Content-Encoding"))
+    if encoding == IDENTITY and max_bytes is None:
+        data = request.get_data()
+    else:
+        try:
+            data = decompress_stream(
+                iter_stream(request.stream), encoding, max_size=max_bytes
+            )
+        except UnsupportedEncoding:
+            abort(415)
+        except BodyTooLarge:
+            abort(413)
+    if not data:
+        return {}
+    return get_codec(request.content_type).decode(data) or {}
+
+
+def wants_columnar() -> bool:
+    """Whether the client asked for the columnar batch layout (``?layout=columnar``)."""
+    return request.args.get("layout") == COLUMNAR
+
+
+def apply_ndjson_request(
+    eng,
+    apply_batch: int = 500,
+    commit_every: int = 0,
+    max_bytes: int | None = None,
+) -> dict:
+    """
+    Apply a streamed NDJSON push (one change per line, optionally a
+    ``{"last_id": ...}`` trailer) while it is still being received.
+
+    The body is inflated and parsed incrementally and applied in sub-batches
+    of ``apply_batch`` changes (each ends with a flush). With
+    ``commit_every`` the transaction is committed whenever that many changes
+    have been applied since the last commit; otherwise once at the end. A
+    client re-sends from its own watermark after a failure, so changes from a
+    committed checkpoint may be applied twice, which the conflict policy
+    absorbs.
+    """
+    encoding = normalize_encoding(request.headers.get("Content-Encoding"))
+    if encoding != IDENTITY and encoding not in SUPPORTED_ENCODINGS:
+        abort(415)
+    codec = get_codec(JSON)
+    applied = uncommitted = 0
+    last_id = None
+    pending: list = []
 
+    def apply_pending() -> None:
+        nonlocal applied, uncommitted
+        eng.apply_remote_changes(pending)
+        applied += len(pending)
+        uncommitted += len(pending)
+        pending.clear()
+        if commit_every and uncommitted >= commit_every:
+            eng.sess.commit()
+            uncommitted = 0
 
-def sync_blueprint(engine_factory):
+    body = inflate_chunks(iter_stream(request.stream), encoding, max_size=max_bytes)
+    try:
+        for line in iter_lines(body):
+            if not line.strip():
+                continue
+            try:
+                record = codec.decode(line)
+            except ValueError:
+                abort(400)
+            if "table" not in record:
+                last_id = record.get("last_id")
+                continue
+            pending.append(record)
+            if len(pending) >= apply_batch:
+                apply_pending()
+    except BodyTooLarge:
+        abort(413)
+    if pending:
+        apply_pending()
+    eng.sess.commit()
+    return {"ok": True, "applied": applied, "last_id": last_id}
+
+
+def note_peer_seen(eng) -> None:
+    """Record that the pulling peer (``exclude_node_id``) is live; see record_peer_seen."""
+    node_id = request.args.get("exclude_node_id")
+    if node_id and record_peer_seen(eng.sess, node_id):
+        eng.sess.commit()
+
+
+def wait_response(eng, max_wait: float = 30.0, poll_interval: float = 5.0) -> Response:
+    """
+    Long-poll for /sync/wait: answer ``{"changes": true}`` as soon as the
+    change log has an entry above ``since_id`` not made by
+    ``exclude_node_id``, or ``{"changes": false}`` after ``timeout`` seconds
+    (capped at ``max_wait``). Wakes on in-process commits via the change
+    notifier, and re-checks every ``poll_interval`` seconds for writes from
+    other processes. Each waiting request occupies a worker thread.
+    """
+    since_id = int(request.args.get("since_id", "0"))
+    exclude_node_id = request.args.get("exclude_node_id")
+    timeout = min(float(request.args.get("timeout", max_wait)), max_wait)
+
+    def check() -> bool:
+        found = eng.has_changes_since(since_id, exclude_node_id)
+        # Don't hold a read transaction open while waiting
+        eng.sess.rollback()
+        return found
+
+    changed = get_change_notifier().wait_until(check, timeout, poll_interval)
+    return jsonify({"changes": changed})
+
+
+def sync_blueprint(
+    engine_factory,
+    compress_min_bytes: int = DEFAULT_MIN_BYTES,
+    compress_level: int = DEFAULT_LEVEL,
+    apply_batch: int = 500,
+    commit_every: int = 0,
+    max_wait: float = 30.0,
+    wait_poll_interval: float = 5.0,
+    max_body_bytes: int | None = DEFAULT_MAX_BODY_BYTES,
+):
+    """
+    Sync endpoints for one database. Pull responses are compressed (gzip or
+    deflate, as negotiated) when at least ``compress_min_bytes`` long; set it
+    to a huge value to disable compression. Clients that accept
+    ``application/x-ndjson`` get /sync/changes streamed from a server-side
+    cursor instead. NDJSON pushes to /sync/apply are applied as they arrive,
+    ``apply_batch`` changes at a time (see ``apply_ndjson_request``).
+    /sync/wait long-polls for new changes for up to ``max_wait`` seconds
+    (see ``wait_response``). Pushes inflating past ``max_body_bytes`` are
+    rejected with 413 (None disables the limit). Pulls and long-polls from a
+    node that has acked before refresh its ``sync_ack.acked_at``, which
+    keeps its node id lease alive (see NodeIdAllocator).
+    """
     bp = Blueprint("sync", __name__)
 
     @bp.get("/sync/changes")
     def get_changes():
         eng: SyncEngine = engine_factory()
+        note_peer_seen(eng)
         since_id = int(request.args.get("since_id", "0"))
         limit = int(request.args.get("limit", "1000"))
         exclude_node_id = request.args.get("exclude_node_id")
+        if wants_ndjson():
+            return ndjson_response(
+                eng.stream_remote_changes_since(
+                    since_id, limit=limit, exclude_node_id=exclude_node_id
+                ),
+                compress_level=compress_level,
+            )
         changes = eng.remote_changes_since(
             since_id,
             limit=limit,
             exclude_node_id=exclude_node_id,
+            columnar=wants_columnar(),
+        )
+        return encode_response(
+            changes_to_wire(changes),
+            compress_min_bytes=compress_min_bytes,
+            compress_level=compress_level,
         )
-        return jsonify({"changes": changes})
 
     @bp.post("/sync/apply")
     def apply():
         eng: SyncEngine = engine_factory()
-        payload = request.get_json(force=True) or {}
-        changes: list[ChangePayload] = payload.get("changes", [])
-        eng.apply_remote_changes(changes)
+        if request.mimetype == NDJSON:
+            return jsonify(
+                apply_ndjson_request(
+                    eng,
+                    apply_batch=apply_batch,
+                    commit_every=commit_every,
+                    max_bytes=max_body_bytes,
+                )
+            )
+        eng.apply_remote_changes(changes_from_wire(decode_request(max_body_bytes)))
         eng.sess.commit()
         return jsonify({"ok": True})
 
+    @bp.get("/sync/wait")
+    def wait():
+        eng: SyncEngine = engine_factory()
+        note_peer_seen(eng)
+        return wait_response(eng, max_wait=max_wait, poll_interval=wait_poll_interval)
+
     @bp.post("/sync/ack")
     def ack():
-        return jsonify({"ok": True})
+        payload = request.get_json(force=True) or {}
+        if not payload.get("node_id"):
+            return jsonify({"error": "node_id is required"}), 400
+        eng: SyncEngine = engine_factory()
+        last_seen = int(payload.get("last_seen", 0))
+        stored = record_ack(eng.sess, str(payload["node_id"]), last_seen)
+        eng.sess.commit()
+        return jsonify({"ok": True, "last_ack": stored})
 
     return bp
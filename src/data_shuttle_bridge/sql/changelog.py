@@ -84,3 +84,81 @@ class SyncState(SQLModel, table=True):
     )
 
     __table_args__ = (UniqueConstraint("peer_id", name="uq_syncstate_peer"),)
+
+
+class SyncAck(SQLModel, table=True):
+    """Highest change id each peer has acknowledged pulling from this node."""
+
+    __tablename__ = "sync_ack"
+
+    peer_id: str = Field(
+        sa_column=SQLModelColumn(String(64), primary_key=True, nullable=False)
+    )
+    last_ack_change_id: int = Field(
+        default=0,
+        sa_column=SQLModelColumn(
+            BigInteger,
+            nullable=False,
+        ),
+    )
+    acked_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=SQLModelColumn(
+            DateTime(timezone=True),
+            server_default=func.now(),
+            onupdate=func.now(),
+            nullable=True,
+        ),
+    )
+
+
+class ChangeLogArchive(SQLModel, table=True):
+    """Change log entries removed by compaction, kept for auditing."""
+
+    __tablename__ = "change_log_archive"
+
+    id: int = Field(primary_key=True)
+    table: str = Field(
+        sa_column=SQLModelColumn(
+            String(64),
+            nullable=False,
+        )
+    )
+    pk: int = Field(
+        sa_column=SQLModelColumn(
+            BigInteger,
+            nullable=False,
+        )
+    )
+    op: str = Field(
+        sa_column=SQLModelColumn(
+            String(1),
+            nullable=False,
+        )
+    )
+    version: int = Field(
+        sa_column=SQLModelColumn(
+            Integer,
+            nullable=False,
+        )
+    )
+    node_id: Optional[str] = Field(
+        default=None,
+        sa_column=SQLModelColumn(
+            String(64),
+            nullable=True,
+        ),
+    )
+    at: Optional[datetime] = Field(
+        default=None,
+        sa_column=SQLModelColumn(
+            DateTime(timezone=True),
+            nullable=True,
+        ),
+    )
+    summary: Optional[Dict[str, Any]] = Field(
+        default=None,
+        sa_column=SQLModelColumn(
+            JSON,
+        ),
+    )
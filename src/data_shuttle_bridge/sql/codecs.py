@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import base64
+import json
+import struct
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, List
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# Newline-delimited JSON, used for streamed /sync/changes responses
+NDJSON = "application/x-ndjson"
+
+
+def _json_default(o: Any) -> Any:
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return str(o)
+    if isinstance(o, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(o)).decode("ascii")
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class Codec:
+    """Encodes sync request/response bodies for one media type."""
+
+    content_type: str = ""
+
+    def encode(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """Stdlib JSON. Datetimes travel as ISO strings."""
+
+    content_type = JSON
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, default=_json_default, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """Same wire format as JsonCodec, encoded and parsed with ``orjson``."""
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+
+    def encode(self, obj: Any) -> bytes:
+        return self._orjson.dumps(
+            obj, default=_json_default, option=self._orjson.OPT_NON_STR_KEYS
+        )
+
+    def decode(self, data: bytes) -> Any:
+        return self._orjson.loads(data)
+
+
+# MessagePack extension type codes
+_EXT_DATETIME = 1
+_EXT_DATE = 2
+_EXT_DECIMAL = 3
+_NAIVE = -32768
+_EPOCH = datetime(1970, 1, 1)
+
+
+class MsgpackCodec(Codec):
+    """
+    Binary MessagePack encoding. Requires ``msgpack``.
+
+    Integers (int64) and bytes are native. Datetimes are an extension type of
+    epoch microseconds plus a UTC offset in minutes (or a naive marker), dates
+    are day ordinals, and Decimals their string form.
+    """
+
+    content_type = MSGPACK
+
+    def __init__(self):
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def _default(self, o: Any) -> Any:
+        if isinstance(o, datetime):
+            offset = o.utcoffset()
+            naive = o.replace(tzinfo=None)
+            if offset is not None:
+                naive -= offset
+            micros = (naive - _EPOCH) // timedelta(microseconds=1)
+            minutes = _NAIVE if offset is None else int(offset.total_seconds() // 60)
+            return self._msgpack.ExtType(
+                _EXT_DATETIME, struct.pack(">qh", micros, minutes)
+            )
+        if isinstance(o, date):
+            return self._msgpack.ExtType(_EXT_DATE, struct.pack(">i", o.toordinal()))
+        if isinstance(o, Decimal):
+            return self._msgpack.ExtType(_EXT_DECIMAL, str(o).encode("ascii"))
+        raise TypeError(f"Object of type {type(o).__name__} is not serializable")
+
+    @staticmethod
+    def _ext_hook(code: int, data: bytes) -> Any:
+        if code == _EXT_DATETIME:
+            micros, minutes = struct.unpack(">qh", data)
+            value = _EPOCH + timedelta(microseconds=micros)
+            if minutes == _NAIVE:
+                return value
+            tz = timezone(timedelta(minutes=minutes))
+            return value.replace(tzinfo=timezone.utc).astimezone(tz)
+        if code == _EXT_DATE:
+            return date.fromordinal(struct.unpack(">i", data)[0])
+        if code == _EXT_DECIMAL:
+            return Decimal(data.decode("ascii"))
+        raise ValueError(f"unknown msgpack extension type {code}")
+
+    def encode(self, obj: Any) -> bytes:
+        return self._msgpack.packb(obj, default=self._default, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        return self._msgpack.unpackb(
+            data, ext_hook=self._ext_hook, raw=False, strict_map_key=False
+        )
+
+
+_codecs: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec, *aliases: str) -> None:
+    """Register a codec under its content type and any alias media types."""
+    for media_type in (codec.content_type, *aliases):
+        _codecs[media_type.lower()] = codec
+
+
+def get_codec(content_type: str | None) -> Codec:
+    """Codec for a Content-Type header value, falling back to JSON."""
+    if content_type:
+        media_type = content_type.split(";", 1)[0].strip().lower()
+        if media_type in _codecs:
+            return _codecs[media_type]
+    return _codecs[JSON]
+
+
+def available_content_types() -> List[str]:
+    return list(_codecs)
+
+
+def negotiate(accept: str | None) -> Codec:
+    """Pick the registered codec the client prefers by Accept header q-values."""
+    best: Codec | None = None
+    best_q = 0.0
+    for part in (accept or "").split(","):
+        fields = part.strip().split(";")
+        media_type = fields[0].strip().lower()
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in _codecs and q > best_q:
+            best, best_q = _codecs[media_type], q
+    return best or _codecs[JSON]
+
+
+def _register_defaults() -> None:
+    try:
+        register_codec(OrjsonCodec())
+    except ImportError:
+        register_codec(JsonCodec())
+    try:
+        register_codec(MsgpackCodec(), "application/x-msgpack")
+    except ImportError:
+        pass
+
+
+_register_defaults()
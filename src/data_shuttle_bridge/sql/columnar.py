@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+from bisect import bisect_right
+from typing import Any, Dict, Iterator, List, Sequence, Tuple, overload
+
+from data_shuttle_bridge.sql.typing_ import ChangeBatch, ChangePayload, batch_last_id
+
+COLUMNAR = "columnar"
+
+# (pk, op, version, data, partial) as consumed by SyncEngine's apply paths
+ChangeItem = Tuple[int, str, int, Dict[str, Any] | None, bool]
+
+# (pk, op, version, columns, values, partial): a change's row image as
+# parallel column names and values, as read by the bulk apply path
+ValueItem = Tuple[int, str, int, Sequence[str] | None, Sequence[Any] | None, bool]
+
+
+class TableBlock:
+    """
+    One table's changes in columnar form.
+
+    ``columns`` is sent once; each change contributes one entry to the
+    parallel ``ids``/``pks``/``ops``/``versions``/``at`` arrays and a
+    positional value list to ``rows`` (None when there is no row image).
+    Partial updates carry only some columns: ``masks`` then holds, per change,
+    the indexes into ``columns`` its values correspond to (None for full rows).
+    """
+
+    __slots__ = (
+        "table",
+        "columns",
+        "ids",
+        "pks",
+        "ops",
+        "versions",
+        "at",
+        "rows",
+        "masks",
+    )
+
+    def __init__(self, table: str, columns: Sequence[str]):
+        self.table = table
+        self.columns: List[str] = list(columns)
+        self.ids: List[int] = []
+        self.pks: List[int] = []
+        self.ops: List[str] = []
+        self.versions: List[int] = []
+        self.at: List[str | None] = []
+        self.rows: List[List[Any] | None] = []
+        self.masks: List[List[int] | None] | None = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def append(
+        self,
+        id: int,
+        pk: int,
+        op: str,
+        version: int,
+        at: str | None,
+        values: List[Any] | None,
+        mask: List[int] | None = None,
+    ) -> None:
+        if mask is not None and self.masks is None:
+            self.masks = [None] * len(self.ids)
+        self.ids.append(id)
+        self.pks.append(pk)
+        self.ops.append(op)
+        self.versions.append(version)
+        self.at.append(at)
+        self.rows.append(values)
+        if self.masks is not None:
+            self.masks.append(mask)
+
+    def data(self, i: int) -> Dict[str, Any] | None:
+        values = self.rows[i]
+        if values is None:
+            return None
+        mask = self.masks[i] if self.masks is not None else None
+        if mask is None:
+            return dict(zip(self.columns, values))
+        return {self.columns[j]: v for j, v in zip(mask, values)}
+
+    def is_partial(self, i: int) -> bool:
+        return self.masks is not None and self.masks[i] is not None
+
+    def items(self) -> Iterator[ChangeItem]:
+        for i in range(len(self.ids)):
+            yield (
+                self.pks[i],
+                self.ops[i],
+                self.versions[i],
+                self.data(i),
+                self.is_partial(i),
+            )
+
+    def value_items(self) -> Iterator[ValueItem]:
+        """Like ``items`` but leaves each row as positional values (no dicts)."""
+        columns = self.columns
+        masks = self.masks
+        for i, values in enumerate(self.rows):
+            mask = masks[i] if masks is not None else None
+            cols = columns if mask is None else [columns[j] for j in mask]
+            yield (
+                self.pks[i],
+                self.ops[i],
+                self.versions[i],
+                cols if values is not None else None,
+                values,
+                mask is not None,
+            )
+
+    def change(self, i: int) -> ChangePayload:
+        cp: ChangePayload = {
+            "id": self.ids[i],
+            "table": self.table,
+            "pk": self.pks[i],
+            "op": self.ops[i],  # type: ignore
+            "version": self.versions[i],
+            "data": self.data(i),
+            "at": self.at[i],
+        }
+        if self.is_partial(i):
+            cp["partial"] = True
+        return cp
+
+    def to_wire(self) -> Dict[str, Any]:
+        out = {
+            "table": self.table,
+            "columns": self.columns,
+            "ids": self.ids,
+            "pks": self.pks,
+            "ops": "".join(self.ops),
+            "versions": self.versions,
+            "at": self.at,
+            "rows": self.rows,
+        }
+        if self.masks is not None:
+            out["masks"] = self.masks
+        return out
+
+    @classmethod
+    def from_wire(cls, d: Dict[str, Any]) -> "TableBlock":
+        block = cls(d["table"], d["columns"])
+        block.ids = list(d["ids"])
+        block.pks = list(d["pks"])
+        block.ops = list(d["ops"])
+        block.versions = list(d["versions"])
+        block.at = list(d.get("at") or [None] * len(block.ids))
+        block.rows = list(d["rows"])
+        masks = d.get("masks")
+        block.masks = list(masks) if masks is not None else None
+        return block
+
+
+class ColumnarBatch(Sequence[ChangePayload]):
+    """
+    A batch of changes grouped into one TableBlock per table.
+
+    Works as a read-only sequence of ChangePayload dicts (built on access) so
+    existing code keeps working, but SyncEngine.apply_remote_changes reads the
+    blocks directly. Changes of one table keep their change-id order; the
+    engine applies tables parent-first, as it does for row batches.
+    """
+
+    def __init__(
+        self,
+        blocks: Sequence[TableBlock] = (),
+        last_id: int | None = None,
+        nbytes: int | None = None,
+    ):
+        self.blocks: List[TableBlock] = list(blocks)
+        self._by_table: Dict[str, TableBlock] = {b.table: b for b in self.blocks}
+        if last_id is None:
+            last_id = max((max(b.ids) for b in self.blocks if b.ids), default=None)
+        self.last_id = last_id
+        self.nbytes = nbytes
+
+    def block(self, table: str, columns: Sequence[str]) -> TableBlock:
+        """The block for ``table``, created with ``columns`` on first use."""
+        b = self._by_table.get(table)
+        if b is None:
+            b = self._by_table[table] = TableBlock(table, columns)
+            self.blocks.append(b)
+        return b
+
+    def __len__(self) -> int:
+        return sum(len(b) for b in self.blocks)
+
+    def _locate(self, i: int) -> Tuple[TableBlock, int]:
+        offsets: List[int] = []
+        total = 0
+        for b in self.blocks:
+            offsets.append(total)
+            total += len(b)
+        if i < 0:
+            i += total
+        if not 0 <= i < total:
+            raise IndexError("ColumnarBatch index out of range")
+        k = bisect_right(offsets, i) - 1
+        while len(self.blocks[k]) == 0 or i - offsets[k] >= len(self.blocks[k]):
+            k += 1
+        return self.blocks[k], i - offsets[k]
+
+    @overload
+    def __getitem__(self, i: int) -> ChangePayload: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> List[ChangePayload]: ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        block, j = self._locate(i)
+        return block.change(j)
+
+    def __iter__(self) -> Iterator[ChangePayload]:
+        for b in self.blocks:
+            for j in range(len(b)):
+                yield b.change(j)
+
+    def to_wire(self) -> Dict[str, Any]:
+        return {
+            "format": COLUMNAR,
+            "last_id": self.last_id,
+            "tables": [b.to_wire() for b in self.blocks],
+        }
+
+    @classmethod
+    def from_wire(cls, d: Dict[str, Any], nbytes: int | None = None) -> "ColumnarBatch":
+        return cls(
+            [TableBlock.from_wire(t) for t in d.get("tables", [])],
+            last_id=d.get("last_id"),
+            nbytes=nbytes,
+        )
+
+    @classmethod
+    def from_changes(
+        cls, changes: Sequence[ChangePayload], last_id: int | None = None
+    ) -> "ColumnarBatch":
+        """Convert a row-layout batch (e.g. for an InMemory transport)."""
+        batch = cls(last_id=last_id)
+        for cp in changes:
+            data = cp["data"]
+            block = batch.block(cp["table"], list(data) if data else [])
+            values, mask = None, None
+            if data is not None:
+                index = {c: j for j, c in enumerate(block.columns)}
+                for c in data:
+                    if c not in index:
+                        index[c] = len(block.columns)
+                        block.columns.append(c)
+                if cp.get("partial") or list(data) != block.columns:
+                    mask = [index[c] for c in data]
+                values = list(data.values())
+            block.append(
+                cp["id"], cp["pk"], cp["op"], cp["version"], cp["at"], values, mask
+            )
+        if batch.last_id is None:
+            batch.last_id = getattr(changes, "last_id", None) or max(
+                (cp["id"] for cp in changes), default=None
+            )
+        return batch
+
+
+def is_columnar(payload: Any) -> bool:
+    return isinstance(payload, dict) and payload.get("format") == COLUMNAR
+
+
+def changes_from_wire(
+    payload: Dict[str, Any], nbytes: int | None = None
+) -> Sequence[ChangePayload]:
+    """Changes from a decoded /sync/changes or /sync/apply body, either layout."""
+    if is_columnar(payload):
+        return ColumnarBatch.from_wire(payload, nbytes=nbytes)
+    return ChangeBatch(
+        payload.get("changes", []), last_id=payload.get("last_id"), nbytes=nbytes
+    )
+
+
+def changes_to_wire(changes: Sequence[ChangePayload]) -> Dict[str, Any]:
+    """Body for /sync/changes or /sync/apply in the batch's own layout."""
+    if isinstance(changes, ColumnarBatch):
+        return changes.to_wire()
+    return {"changes": list(changes), "last_id": batch_last_id(changes)}
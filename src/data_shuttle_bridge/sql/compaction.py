@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Set
+
+from sqlalchemy import (
+    and_,
+    bindparam,
+    column,
+    delete,
+    exists,
+    func,
+    insert,
+    inspect,
+    not_,
+    table,
+    update,
+)
+from sqlalchemy import select as sa_select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from data_shuttle_bridge.sql.changelog import ChangeLog, ChangeLogArchive, SyncAck
+from data_shuttle_bridge.sql.wiring import CHANGED_FIELDS_KEY
+
+# How stale a peer's acked_at may get before sync traffic refreshes it
+PEER_SEEN_INTERVAL = timedelta(minutes=5)
+
+
+def record_ack(sess: Session, peer_id: str, last_seen_change_id: int) -> int:
+    """
+    Persist a peer's acknowledged watermark. Acks never move backwards, but
+    every ack refreshes ``acked_at``.
+
+    Returns the stored watermark. The caller is responsible for committing.
+    """
+    ack = sess.get(SyncAck, peer_id)
+    now = datetime.now(timezone.utc)
+    if ack is None:
+        try:
+            with sess.begin_nested():
+                sess.add(
+                    SyncAck(
+                        peer_id=peer_id,
+                        last_ack_change_id=last_seen_change_id,
+                        acked_at=now,
+                    )
+                )
+            return last_seen_change_id
+        except IntegrityError:
+            # A concurrent first ack from the same peer won; update its row
+            ack = sess.get(SyncAck, peer_id, populate_existing=True)
+            if ack is None:
+                raise
+    if last_seen_change_id > ack.last_ack_change_id:
+        ack.last_ack_change_id = last_seen_change_id
+    ack.acked_at = now
+    return ack.last_ack_change_id
+
+
+def record_peer_seen(sess: Session, peer_id: str) -> bool:
+    """
+    Refresh ``acked_at`` of a peer that has acked before, at most once per
+    PEER_SEEN_INTERVAL, so peers that sync without new changes still count
+    as live (node leases consult it). Returns whether anything was written;
+    the caller is responsible for committing.
+    """
+    ack = sess.get(SyncAck, peer_id)
+    if ack is None:
+        return False
+    now = datetime.now(timezone.utc)
+    seen = ack.acked_at
+    if seen is not None:
+        if seen.tzinfo is None:
+            seen = seen.replace(tzinfo=timezone.utc)
+        if now - seen < PEER_SEEN_INTERVAL:
+            return False
+    ack.acked_at = now
+    return True
+
+
+def registered_peers(sess: Session) -> Set[str]:
+    """
+    Peers that must acknowledge an entry before it is compacted: every node
+    leased in node_registry (when this database has one) and every peer with
+    a stored ack.
+    """
+    peers = set(sess.execute(sa_select(SyncAck.peer_id)).scalars())
+    if inspect(sess.connection()).has_table("node_registry"):
+        registry = table("node_registry", column("node_id"))
+        peers.update(
+            str(n) for n in sess.execute(sa_select(registry.c.node_id)).scalars()
+        )
+    return peers
+
+
+def acknowledged_watermark(sess: Session, peer_ids: Iterable[str] | None = None) -> int:
+    """
+    Highest change id acknowledged by every peer in ``peer_ids`` (default:
+    ``registered_peers``). Peers that never acked count as 0; with no peers
+    at all nothing is acknowledged.
+    """
+    wanted = list(peer_ids) if peer_ids is not None else sorted(registered_peers(sess))
+    if not wanted:
+        return 0
+    acks = dict(
+        sess.execute(
+            sa_select(SyncAck.peer_id, SyncAck.last_ack_change_id).where(
+                SyncAck.peer_id.in_(wanted)
+            )
+        ).all()
+    )
+    return min(acks.get(p, 0) for p in wanted)
+
+
+def compact_change_log(
+    sess: Session,
+    peer_ids: Iterable[str] | None = None,
+    archive: bool = False,
+) -> int:
+    """
+    Remove change_log entries that every peer has acknowledged.
+
+    The newest entry per (table, pk) is always kept so peers that join later
+    still receive every live row (and every tombstone). With ``archive=True``
+    the removed rows are copied to ``change_log_archive`` first.
+
+    Returns the number of entries removed. The caller is responsible for
+    committing.
+    """
+    watermark = acknowledged_watermark(sess, peer_ids)
+    if watermark <= 0:
+        return 0
+    cl = ChangeLog.__table__
+    newest = sa_select(func.max(cl.c.id)).group_by(cl.c.table, cl.c.pk)
+    doomed = and_(cl.c.id <= watermark, not_(cl.c.id.in_(newest)))
+    if archive:
+        columns = ["id", "table", "pk", "op", "version", "node_id", "at", "summary"]
+        sess.execute(
+            insert(ChangeLogArchive.__table__).from_select(
+                columns, sa_select(*(cl.c[c] for c in columns)).where(doomed)
+            )
+        )
+    _promote_survivors(sess, watermark, not_(doomed))
+    result = sess.execute(delete(cl).where(doomed))
+    return result.rowcount or 0
+
+
+def _promote_survivors(sess: Session, watermark: int, kept) -> None:
+    """
+    Drop the changed-field list from updates whose earlier entries are about
+    to be compacted away. A peer that joins later sees only the survivor, so
+    it must ship the full row rather than a column delta.
+    """
+    cl = ChangeLog.__table__
+    older = cl.alias("older")
+    survivors = sess.execute(
+        sa_select(cl.c.id, cl.c.summary).where(
+            kept,
+            cl.c.op == "U",
+            exists().where(
+                older.c.table == cl.c.table,
+                older.c.pk == cl.c.pk,
+                older.c.id < cl.c.id,
+                older.c.id <= watermark,
+            ),
+        )
+    ).all()
+    params = [
+        {
+            "_id": id_,
+            "summary": {k: v for k, v in summary.items() if k != CHANGED_FIELDS_KEY},
+        }
+        for id_, summary in survivors
+        if summary and CHANGED_FIELDS_KEY in summary
+    ]
+    if params:
+        sess.execute(update(cl).where(cl.c.id == bindparam("_id")), params)
+
+
+class ChangeLogCompactor:
+    """
+    Background thread that periodically runs ``compact_change_log``.
+
+    - session_factory() -> Session, a fresh session per run
+    - interval: seconds between runs
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        interval: float = 3600.0,
+        peer_ids: Iterable[str] | None = None,
+        archive: bool = False,
+    ):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.peer_ids = list(peer_ids) if peer_ids is not None else None
+        self.archive = archive
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> int:
+        with self.session_factory() as sess:
+            removed = compact_change_log(
+                sess, peer_ids=self.peer_ids, archive=self.archive
+            )
+            sess.commit()
+            return removed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                import sys
+
+                print(f"WARNING: change_log compaction failed: {e}", file=sys.stderr)
+
+    def start(self) -> "ChangeLogCompactor":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="change-log-compactor", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import zlib
+from typing import BinaryIO, Iterable, Iterator
+
+GZIP = "gzip"
+DEFLATE = "deflate"
+IDENTITY = "identity"
+
+SUPPORTED_ENCODINGS = (GZIP, DEFLATE)
+
+# Bodies smaller than this are sent as-is; headers cost more than they save
+DEFAULT_MIN_BYTES = 1024
+DEFAULT_LEVEL = 6
+
+# Largest request body a sync endpoint accepts, measured after inflating
+DEFAULT_MAX_BODY_BYTES = 64 * 1024 * 1024
+
+_CHUNK = 64 * 1024
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+def _wbits(encoding: str) -> int:
+    if encoding == GZIP:
+        return 16 + zlib.MAX_WBITS
+    if encoding == DEFLATE:
+        return zlib.MAX_WBITS
+    raise UnsupportedEncoding(encoding)
+
+
+def normalize_encoding(content_encoding: str | None) -> str:
+    """Lower-cased Content-Encoding value, ``identity`` when absent."""
+    value = (content_encoding or "").strip().lower()
+    if value in ("", IDENTITY):
+        return IDENTITY
+    if value == "x-gzip":
+        return GZIP
+    return value
+
+
+def compress(data: bytes, encoding: str, level: int = DEFAULT_LEVEL) -> bytes:
+    """Compress ``data`` for a gzip or deflate (zlib-wrapped) Content-Encoding."""
+    c = zlib.compressobj(level, zlib.DEFLATED, _wbits(encoding))
+    return c.compress(data) + c.flush()
+
+
+def decompress(data: bytes, encoding: str, max_size: int | None = None) -> bytes:
+    return decompress_stream([data], encoding, max_size=max_size)
+
+
+def decompress_stream(
+    chunks: Iterable[bytes], encoding: str, max_size: int | None = None
+) -> bytes:
+    """
+    Inflate a body chunk by chunk, so the compressed form is never held whole.
+
+    ``max_size`` bounds the inflated size (guards against decompression bombs);
+    exceeding it raises BodyTooLarge.
+    """
+    return b"".join(inflate_chunks(chunks, encoding, max_size=max_size))
+
+
+def inflate_chunks(
+    chunks: Iterable[bytes], encoding: str, max_size: int | None = None
+) -> Iterator[bytes]:
+    """Incremental form of decompress_stream, yielding inflated pieces."""
+    encoding = normalize_encoding(encoding)
+    d = zlib.decompressobj(_wbits(encoding)) if encoding != IDENTITY else None
+    total = 0
+    for chunk in chunks:
+        while chunk:
+            if d is None:
+                out, chunk = chunk, b""
+            else:
+                limit = 0 if max_size is None else max_size - total + 1
+                out = d.decompress(chunk, limit)
+                chunk = d.unconsumed_tail
+            total += len(out)
+            if max_size is not None and total > max_size:
+                raise BodyTooLarge("request body too large")
+            if out:
+                yield out
+    if d is not None:
+        out = d.flush()
+        total += len(out)
+        if max_size is not None and total > max_size:
+            raise BodyTooLarge("request body too large")
+        if out:
+            yield out
+
+
+def compress_chunks(
+    chunks: Iterable[bytes], encoding: str, level: int = DEFAULT_LEVEL
+) -> Iterator[bytes]:
+    """
+    Compress a streamed body. Each chunk is sync-flushed so the receiver can
+    decode everything sent so far.
+    """
+    c = zlib.compressobj(level, zlib.DEFLATED, _wbits(encoding))
+    for chunk in chunks:
+        out = c.compress(chunk) + c.flush(zlib.Z_SYNC_FLUSH)
+        if out:
+            yield out
+    yield c.flush()
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Split a chunked body into lines (without the trailing newline)."""
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        yield from lines
+    if pending:
+        yield pending
+
+
+def iter_stream(stream: BinaryIO, chunk_size: int = _CHUNK) -> Iterable[bytes]:
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def choose_encoding(accept_encoding: str | None) -> str | None:
+    """Preferred supported encoding from an Accept-Encoding header, or None."""
+    best: str | None = None
+    best_q = 0.0
+    for part in (accept_encoding or "").split(","):
+        fields = part.strip().split(";")
+        name = normalize_encoding(fields[0])
+        q = 1.0
+        for param in fields[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name == "*":
+            name = GZIP
+        if name in SUPPORTED_ENCODINGS and q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def maybe_compress(
+    data: bytes,
+    encoding: str | None,
+    min_bytes: int = DEFAULT_MIN_BYTES,
+    level: int = DEFAULT_LEVEL,
+) -> tuple[bytes, str | None]:
+    """
+    Compress ``data`` when an encoding is given and the body is at least
+    ``min_bytes``. Returns the body and the Content-Encoding to send (or None).
+    """
+    if encoding is None or len(data) < min_bytes:
+        return data, None
+    return compress(data, encoding, level), encoding
@@ -1,25 +1,141 @@
 import threading
 import time
-from typing import Final, Optional, Callable
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Final, Optional, Callable, Tuple, Hashable
 
 EPOCH_MS: Final[int] = 1735689600000  # January 1, 2025
 TIMESTAMP_BITS = 41
 NODE_BITS = 10
 SEQUENCE_BITS = 12
 
+# Ids stay positive signed 64-bit integers
+ID_BITS = 63
+
 MAX_NODE = (1 << NODE_BITS) - 1
 MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
 
 NODE_SHIFT = SEQUENCE_BITS
 TIME_SHIFT = SEQUENCE_BITS + NODE_BITS
 
+
+class IdLayoutMismatch(ValueError):
+    """Two parties of one deployment use different id layouts."""
+
+
+@dataclass(frozen=True)
+class IdLayout:
+    """
+    How a KSortedID splits its 63 bits: timestamp, node id, sequence.
+
+    The default 41/10/12 allows 1024 nodes at 4096 ids per millisecond
+    each, for about 69 years after ``epoch_ms``. More node bits trade per-node
+    throughput for fleet size, e.g. ``IdLayout(node_bits=16, sequence_bits=6)``
+    gives 65536 nodes at 64 ids per millisecond.
+
+    Ids are only unique among generators sharing one layout: the same
+    integer decodes to different nodes under different splits. A deployment
+    picks one layout; the node registry persists it and hands it to
+    clients, and both refuse to mix layouts (IdLayoutMismatch).
+    """
+
+    timestamp_bits: int = TIMESTAMP_BITS
+    node_bits: int = NODE_BITS
+    sequence_bits: int = SEQUENCE_BITS
+    epoch_ms: int = EPOCH_MS
+
+    def __post_init__(self):
+        bits = (self.timestamp_bits, self.node_bits, self.sequence_bits)
+        if min(bits) < 1:
+            raise ValueError(f"id layout fields need at least one bit: {bits}")
+        if sum(bits) != ID_BITS:
+            raise ValueError(f"id layout bits must add up to {ID_BITS}: {bits}")
+
+    @property
+    def max_node(self) -> int:
+        return (1 << self.node_bits) - 1
+
+    @property
+    def max_sequence(self) -> int:
+        return (1 << self.sequence_bits) - 1
+
+    @property
+    def max_timestamp(self) -> int:
+        return (1 << self.timestamp_bits) - 1
+
+    @property
+    def node_shift(self) -> int:
+        return self.sequence_bits
+
+    @property
+    def time_shift(self) -> int:
+        return self.sequence_bits + self.node_bits
+
+    @property
+    def ids_per_ms(self) -> int:
+        """Ceiling on the ids a single node can issue per millisecond."""
+        return 1 << self.sequence_bits
+
+    @property
+    def lifetime_years(self) -> float:
+        return (1 << self.timestamp_bits) / (1000 * 3600 * 24 * 365.25)
+
+    def compose(self, ms: int, node_id: int, sequence: int) -> int:
+        return (ms << self.time_shift) | (node_id << self.node_shift) | sequence
+
+    def decompose(self, id_: int) -> Tuple[int, int, int]:
+        """(milliseconds since epoch_ms, node id, sequence) of an id."""
+        return (
+            id_ >> self.time_shift,
+            (id_ >> self.node_shift) & self.max_node,
+            id_ & self.max_sequence,
+        )
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "timestamp_bits": self.timestamp_bits,
+            "node_bits": self.node_bits,
+            "sequence_bits": self.sequence_bits,
+            "epoch_ms": self.epoch_ms,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "IdLayout":
+        return cls(**{k: int(v) for k, v in data.items() if k in _LAYOUT_FIELDS})
+
+    @classmethod
+    def parse(cls, spec: str) -> "IdLayout":
+        """Layout from ``"timestamp:node:sequence"`` bits, e.g. ``"41:16:6"``."""
+        try:
+            ts, node, seq = (int(x) for x in spec.split(":"))
+        except ValueError:
+            raise ValueError(f"expected timestamp:node:sequence bits, got {spec!r}")
+        return cls(timestamp_bits=ts, node_bits=node, sequence_bits=seq)
+
+    def check_compatible(self, other: "IdLayout") -> None:
+        """Raise IdLayoutMismatch unless ids of both layouts can't collide."""
+        if other != self:
+            raise IdLayoutMismatch(
+                f"id layout {other.to_dict()} differs from {self.to_dict()}; "
+                "ids from different layouts can collide"
+            )
+
+
+_LAYOUT_FIELDS = ("timestamp_bits", "node_bits", "sequence_bits", "epoch_ms")
+
+DEFAULT_LAYOUT: Final[IdLayout] = IdLayout()
+
+
 # Thread-local storage for ID generators to support multitenancy
 _local = threading.local()
 _default_id_generator: Optional[Callable[[], int]] = None
 _registry_lock = threading.Lock()
 
 
-def set_id_generator(node_id: int | str) -> None:
+def set_id_generator(
+    node_id: int | str, block_size: int = 1, layout: IdLayout = DEFAULT_LAYOUT
+) -> None:
     """
     Set the ID generator for this thread/request context.
 
@@ -28,18 +144,28 @@ def set_id_generator(node_id: int | str) -> None:
 
     This should be called once during application startup, after getting the node_id.
 
+    The thread is bound to the process-wide generator of ``node_id`` (see
+    IdGeneratorRegistry), so every thread and request of one node shares a
+    single sequence state.
+
     Args:
         node_id: The node identifier (int or string). If string, will be converted to int hash.
+        block_size: Ids each thread reserves at a time (see KSortedID). The
+            default of 1 takes the generator's lock for every id. Applies when
+            the node's generator is created.
+        layout: The deployment's IdLayout (see ClientNodeManager.id_layout).
     """
     # Convert string node_id to int if necessary
     if isinstance(node_id, str):
-        # Use hash of string, then mod by MAX_NODE to fit in valid range
-        node_id_int = abs(hash(node_id)) % (MAX_NODE + 1)
+        # Use hash of string, then mod by the node range to fit the layout
+        node_id_int = abs(hash(node_id)) % (layout.max_node + 1)
     else:
         node_id_int = node_id
 
-    # Store in thread-local storage
-    _local.id_generator = KSortedID(node_id=node_id_int)
+    # Bind this thread to the node's shared generator
+    _local.id_generator = _generators.get(
+        node_id_int, block_size=block_size, layout=layout
+    )
 
 
 def get_id_generator() -> Callable[[], int]:
@@ -53,11 +179,10 @@ def get_id_generator() -> Callable[[], int]:
     if hasattr(_local, "id_generator") and _local.id_generator is not None:
         return _local.id_generator
 
-    # Fall back to default (for single-tenant cases)
-    global _default_id_generator
-    with _registry_lock:
-        if _default_id_generator is not None:
-            return _default_id_generator
+    # Fall back to default (for single-tenant cases); reading the global is
+    # atomic, so no lock is needed
+    if _default_id_generator is not None:
+        return _default_id_generator
 
     raise RuntimeError(
         "ID generator not initialized. Call set_id_generator(node_id) first."
@@ -73,32 +198,149 @@ def clear_id_generator() -> None:
 
 
 class KSortedID:
-    def __init__(self, node_id: int):
-        if not (0 <= node_id <= MAX_NODE):
-            raise ValueError("node_id out of range 0..1023")
+    """
+    K-sorted 64-bit ids: milliseconds since the epoch, node id, sequence,
+    packed per ``layout`` (41/10/12 bits by default).
+
+    Up to ``layout.ids_per_ms`` ids per millisecond (4096 by default); when
+    a millisecond's sequence runs out the generator sleeps until the next
+    one. ``reserve(n)`` takes a block of consecutive ids in one locked step.
+    With ``block_size > 1`` each thread serves ids from its own reserved
+    block without locking; ids are then monotone per thread and only
+    roughly ordered across threads, since a block keeps the timestamp it was
+    reserved at.
+    """
+
+    def __init__(
+        self, node_id: int, block_size: int = 1, layout: IdLayout = DEFAULT_LAYOUT
+    ):
+        if not (0 <= node_id <= layout.max_node):
+            raise ValueError(f"node_id out of range 0..{layout.max_node}")
+        if not (1 <= block_size <= layout.ids_per_ms):
+            raise ValueError(f"block_size out of range 1..{layout.ids_per_ms}")
         self.node_id = node_id
+        self.block_size = block_size
+        self.layout = layout
+        self._epoch_ms = layout.epoch_ms
+        self._max_sequence = layout.max_sequence
+        self._time_shift = layout.time_shift
+        self._node_bits = node_id << layout.node_shift
         self._lock = threading.Lock()
         self._last_ms = -1
+        # Next unused sequence number within _last_ms
         self._seq = 0
+        self._blocks = threading.local()
 
     def _now_ms(self) -> int:
-        return int(time.time() * 1000)
+        return time.time_ns() // 1_000_000
+
+    def _tick(self) -> int:
+        # Caller holds the lock. Returns the millisecond to issue ids from,
+        # with at least one sequence number left in it.
+        ms = self._now_ms() - self._epoch_ms
+        if ms < 0:
+            time.sleep((-ms) / 1000.0)
+            ms = 0
+        if ms > self._last_ms:
+            if ms > self.layout.max_timestamp:
+                raise RuntimeError("id layout timestamp bits exhausted")
+            self._last_ms = ms
+            self._seq = 0
+        elif self._seq > self._max_sequence:
+            # Sequence exhausted (or the clock stepped back): sleep, don't spin
+            while ms <= self._last_ms:
+                time.sleep((self._last_ms + 1 - ms) / 1000.0)
+                ms = self._now_ms() - self._epoch_ms
+            self._last_ms = ms
+            self._seq = 0
+        # A clock that stepped back keeps issuing from _last_ms, so ids never
+        # go backwards
+        return self._last_ms
+
+    def reserve(self, n: int) -> range:
+        """
+        Reserve up to ``n`` consecutive ids in one locked step.
+
+        The block never spans a millisecond, so it may hold fewer than ``n``
+        ids (at most ``layout.ids_per_ms``); reserve again for the rest.
+        Blocks are monotone: every id of a later block is greater than every
+        id of an earlier one.
+        """
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        with self._lock:
+            ms = self._tick()
+            seq = self._seq
+            count = min(n, self._max_sequence + 1 - seq)
+            self._seq = seq + count
+        start = (ms << self._time_shift) | self._node_bits | seq
+        return range(start, start + count)
 
     def __call__(self) -> int:
+        if self.block_size > 1:
+            block = getattr(self._blocks, "ids", None)
+            if block is not None:
+                next_id = next(block, None)
+                if next_id is not None:
+                    return next_id
+            block = self._blocks.ids = iter(self.reserve(self.block_size))
+            return next(block)
         with self._lock:
-            ms = self._now_ms() - EPOCH_MS
-            if ms < 0:
-                time.sleep((-ms) / 1000.0)
-                ms = 0
-            if ms == self._last_ms:
-                self._seq = (self._seq + 1) & MAX_SEQUENCE
-                if self._seq == 0:
-                    while True:
-                        cur = self._now_ms() - EPOCH_MS
-                        if cur > ms:
-                            ms = cur
-                            break
-            else:
-                self._seq = 0
-            self._last_ms = ms
-            return (ms << TIME_SHIFT) | (self.node_id << NODE_SHIFT) | self._seq
+            ms = self._tick()
+            seq = self._seq
+            self._seq = seq + 1
+        return (ms << self._time_shift) | self._node_bits | seq
+
+
+class IdGeneratorRegistry:
+    """
+    Process-wide KSortedID generators keyed by node id and layout.
+
+    A node always gets the same generator while anything still holds it
+    (a thread bound by set_id_generator, a caller's reference), so its ids
+    come from one sequence state. The ``max_idle`` most recently used
+    generators are also kept alive when unreferenced; older idle ones are
+    dropped. A generator created again for a dropped node skips the current
+    millisecond, so it can't repeat an id its predecessor just issued.
+    """
+
+    def __init__(self, max_idle: int = 1024):
+        self.max_idle = max_idle
+        self._lock = _registry_lock
+        self._recent: "OrderedDict[Hashable, KSortedID]" = OrderedDict()
+        self._live: "weakref.WeakValueDictionary[Hashable, KSortedID]" = (
+            weakref.WeakValueDictionary()
+        )
+
+    def get(
+        self, node_id: int, block_size: int = 1, layout: IdLayout = DEFAULT_LAYOUT
+    ) -> KSortedID:
+        key = (node_id, layout)
+        with self._lock:
+            gen = self._live.get(key)
+            if gen is None:
+                gen = KSortedID(node_id, block_size=block_size, layout=layout)
+                with gen._lock:
+                    gen._last_ms = gen._now_ms() - layout.epoch_ms
+                    gen._seq = layout.max_sequence + 1
+                self._live[key] = gen
+            self._recent[key] = gen
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.max_idle:
+                self._recent.popitem(last=False)
+            return gen
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def clear(self) -> None:
+        """Drop the idle generators; ones still referenced stay registered."""
+        with self._lock:
+            self._recent.clear()
+
+
+_generators = IdGeneratorRegistry()
+
+
+def get_generator_registry() -> IdGeneratorRegistry:
+    return _generators
@@ -2,7 +2,9 @@ import json
 import os
 import uuid
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, Optional
+
+from data_shuttle_bridge.sql.ids import DEFAULT_LAYOUT, IdLayout
 
 DEFAULT_CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".localfirst_sync")
 DEFAULT_CONFIG_PATH = os.path.join(DEFAULT_CONFIG_DIR, "config.json")
@@ -12,6 +14,7 @@ DEFAULT_CONFIG_PATH = os.path.join(DEFAULT_CONFIG_DIR, "config.json")
 class ClientNodeConfig:
     device_key: str
     node_id: Optional[int] = None
+    id_layout: Optional[Dict[str, int]] = None
 
 
 class ClientNodeManager:
@@ -26,6 +29,7 @@ class ClientNodeManager:
             return ClientNodeConfig(
                 device_key=data.get("device_key") or str(uuid.uuid4()),
                 node_id=data.get("node_id"),
+                id_layout=data.get("id_layout"),
             )
         os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
         cfg = ClientNodeConfig(device_key=str(uuid.uuid4()), node_id=None)
@@ -35,7 +39,13 @@ class ClientNodeManager:
     def _save(self, cfg: ClientNodeConfig) -> None:
         with open(self.config_path, "w", encoding="utf-8") as f:
             json.dump(
-                {"device_key": cfg.device_key, "node_id": cfg.node_id}, f, indent=2
+                {
+                    "device_key": cfg.device_key,
+                    "node_id": cfg.node_id,
+                    "id_layout": cfg.id_layout,
+                },
+                f,
+                indent=2,
             )
 
     @property
@@ -46,16 +56,68 @@ class ClientNodeManager:
     def node_id(self) -> Optional[int]:
         return self._cfg.node_id
 
+    @property
+    def id_layout(self) -> IdLayout:
+        """The id layout leased with the node id (the default before a lease)."""
+        if self._cfg.id_layout is None:
+            return DEFAULT_LAYOUT
+        return IdLayout.from_dict(self._cfg.id_layout)
+
     def ensure_node_id(self, server_base_url: str, session=None) -> int:
-        if self._cfg.node_id is not None:
-            return self._cfg.node_id
+        """
+        This device's node id. A saved id is used only after renewing its
+        lease; if the server reclaimed it (another device may hold it now)
+        a new id is leased. When the server is unreachable the saved id is
+        kept, since leases only expire after the server's TTL.
+        """
         import requests
 
         sess = session or requests.Session()
+        if self._cfg.node_id is not None:
+            try:
+                if self.renew_lease(server_base_url, session=sess):
+                    return self._cfg.node_id
+            except (requests.ConnectionError, requests.Timeout):
+                return self._cfg.node_id
         url = server_base_url.rstrip("/") + "/node/register"
         r = sess.post(url, json={"device_key": self._cfg.device_key}, timeout=10)
         r.raise_for_status()
-        node_id = int(r.json()["node_id"])
+        data = r.json()
+        node_id = int(data["node_id"])
+        if data.get("id_layout") is not None:
+            layout = IdLayout.from_dict(data["id_layout"])
+            if self._cfg.id_layout is not None:
+                # A device must not switch deployments' id layouts
+                self.id_layout.check_compatible(layout)
+            self._cfg.id_layout = layout.to_dict()
         self._cfg.node_id = node_id
         self._save(self._cfg)
         return node_id
+
+    def renew_lease(self, server_base_url: str, session=None) -> bool:
+        """
+        Keep the node id's lease alive on servers that reclaim idle leases
+        (ensure_node_id calls this). Returns False, and forgets the node id,
+        if the lease was already reclaimed; the next ensure_node_id leases a
+        new one. Servers without ``/node/renew`` never reclaim, so a 404
+        counts as renewed.
+        """
+        if self._cfg.node_id is None:
+            return False
+        import requests
+
+        sess = session or requests.Session()
+        url = server_base_url.rstrip("/") + "/node/renew"
+        r = sess.post(
+            url,
+            json={"device_key": self._cfg.device_key, "node_id": self._cfg.node_id},
+            timeout=10,
+        )
+        if r.status_code == 409:
+            self._cfg.node_id = None
+            self._save(self._cfg)
+            return False
+        if r.status_code == 404:
+            return True
+        r.raise_for_status()
+        return True
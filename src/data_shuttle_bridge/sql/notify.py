@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+
+_PENDING_KEY = "data_shuttle_bridge.change_logged"
+
+
+class ChangeNotifier:
+    """
+    In-process broadcast of committed change_log writes.
+
+    Waiters take the current ``sequence`` before checking the database, then
+    ``wait`` for it to move. The sequence moves when a transaction that wrote
+    change_log entries commits, so a waiter never sleeps through a commit
+    that happened after its check. Writes from other processes are not seen;
+    callers should still re-check the database now and then.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._sequence = 0
+
+    @property
+    def sequence(self) -> int:
+        return self._sequence
+
+    def notify(self) -> None:
+        with self._cond:
+            self._sequence += 1
+            self._cond.notify_all()
+
+    def wait(self, sequence: int, timeout: float | None = None) -> bool:
+        """Block until the sequence differs from ``sequence``; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._sequence != sequence, timeout)
+
+    def wait_until(
+        self, check: Callable[[], bool], timeout: float, poll_interval: float = 5.0
+    ) -> bool:
+        """
+        Long-poll: return True as soon as ``check()`` does, False once
+        ``timeout`` seconds pass. ``check`` runs initially, after every
+        notification and at least every ``poll_interval`` seconds (to catch
+        writes made by other processes).
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            sequence = self._sequence
+            if check():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.wait(sequence, min(remaining, poll_interval))
+
+
+_notifier = ChangeNotifier()
+
+
+def get_change_notifier() -> ChangeNotifier:
+    return _notifier
+
+
+def mark_change_logged(connection: Connection) -> None:
+    """Record that the connection's transaction wrote change_log entries."""
+    connection.info[_PENDING_KEY] = True
+
+
+# Engine "commit" fires before the DBAPI commit, so the flag moves to the
+# thread and the notification waits for the first sign on that thread that
+# the commit went through: the Session's after_commit, the connection going
+# back to the pool (engine.begin() blocks, Session.close) or the next
+# transaction beginning (a Core connection kept open).
+_committing = threading.local()
+
+
+@event.listens_for(Engine, "commit")
+def _on_commit(conn: Connection) -> None:
+    if conn.info.pop(_PENDING_KEY, False):
+        _committing.pending = True
+
+
+@event.listens_for(Engine, "rollback")
+def _on_rollback(conn: Connection) -> None:
+    conn.info.pop(_PENDING_KEY, None)
+
+
+def _notify_committed(*args) -> None:
+    if getattr(_committing, "pending", False):
+        _committing.pending = False
+        _notifier.notify()
+
+
+event.listen(Session, "after_commit", _notify_committed)
+event.listen(Engine, "begin", _notify_committed)
+event.listen(Pool, "checkin", _notify_committed)
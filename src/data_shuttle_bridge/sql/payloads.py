@@ -1,38 +1,210 @@
-from typing import Dict, Any, Iterable, Type, Set
-from datetime import datetime
+import base64
+import enum
+import functools
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Set,
+    Type,
+)
+
+from sqlalchemy import types as sqltypes
+
+Converter = Callable[[Any], Any]
+
+
+def _parser(python_type: type, parse: Converter) -> Converter:
+    # Binary codecs (msgpack) deliver native values; text codecs deliver strings
+    def decode(v: Any) -> Any:
+        return v if isinstance(v, python_type) else parse(v)
+
+    return decode
+
+
+def _decode_decimal(v: Any) -> Decimal:
+    return v if isinstance(v, Decimal) else Decimal(str(v))
+
+
+def _decode_bytes(v: Any) -> bytes:
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return bytes(v)
+    return base64.b64decode(v)
+
+
+def _encode_time(v: Any) -> Any:
+    # Neither wire codec carries datetime.time, so times travel as ISO strings
+    return v.isoformat() if isinstance(v, time) else v
+
+
+def _enum_converters(enum_class: Type[enum.Enum]) -> tuple[Converter, Converter]:
+    # Members travel by name, as SQLAlchemy's Enum stores them; values are
+    # accepted too so payloads from value-persisting peers still decode
+    lookup: Dict[Any, enum.Enum] = {m.value: m for m in enum_class}
+    lookup.update((m.name, m) for m in enum_class)
+
+    def encode(v: Any) -> Any:
+        return v.name if isinstance(v, enum.Enum) else v
+
+    def decode(v: Any) -> Any:
+        return lookup.get(v, v)
+
+    return encode, decode
+
+
+def column_converters(
+    column_type: sqltypes.TypeEngine,
+) -> tuple[Converter | None, Converter | None]:
+    """
+    (encoder, decoder) for values of a column type, or None where values pass
+    through unchanged. Encoders turn attribute values into what the wire
+    codecs carry; decoders undo the codec's text forms (ISO strings, decimal
+    strings, base64) so only columns of that type are ever parsed.
+    """
+    if isinstance(column_type, sqltypes.TypeDecorator):
+        column_type = column_type.impl_instance
+    if isinstance(column_type, sqltypes.Enum) and column_type.enum_class is not None:
+        return _enum_converters(column_type.enum_class)
+    if isinstance(column_type, sqltypes.DateTime):
+        return None, _parser(datetime, datetime.fromisoformat)
+    if isinstance(column_type, sqltypes.Date):
+        return None, _parser(date, date.fromisoformat)
+    if isinstance(column_type, sqltypes.Time):
+        return _encode_time, _parser(time, time.fromisoformat)
+    if isinstance(column_type, sqltypes.Numeric) and column_type.asdecimal:
+        return None, _decode_decimal
+    if isinstance(
+        column_type, (sqltypes.LargeBinary, sqltypes.BINARY, sqltypes.VARBINARY)
+    ):
+        return None, _decode_bytes
+    # JSON documents arrive already parsed by the wire codec
+    return None, None
+
+
+class RowCodec:
+    """
+    Per-table row encoder/decoder compiled once from the column types.
+
+    ``encode``/``values`` read a row's attributes for serialization;
+    ``decode``/``apply`` turn a received row back into column values. Only
+    columns that need a conversion pay for one; strings in text columns are
+    never mistaken for dates.
+    """
+
+    def __init__(
+        self,
+        encoders: Dict[str, Converter] | None = None,
+        decoders: Dict[str, Converter] | None = None,
+    ):
+        self.encoders: Dict[str, Converter] = dict(encoders or {})
+        self.decoders: Dict[str, Converter] = dict(decoders or {})
+
+    @classmethod
+    def for_table(cls, table: Any) -> "RowCodec":
+        encoders: Dict[str, Converter] = {}
+        decoders: Dict[str, Converter] = {}
+        for c in table.columns:
+            enc, dec = column_converters(c.type)
+            if enc is not None:
+                encoders[c.name] = enc
+            if dec is not None:
+                decoders[c.name] = dec
+        return cls(encoders, decoders)
+
+    def values(self, obj: object, fields: Iterable[str]) -> List[Any]:
+        encoders = self.encoders
+        if not encoders:
+            return [getattr(obj, f) for f in fields]
+        out = []
+        for f in fields:
+            v = getattr(obj, f)
+            enc = encoders.get(f)
+            out.append(enc(v) if enc is not None and v is not None else v)
+        return out
+
+    def encode(self, obj: object, fields: Iterable[str]) -> Dict[str, Any]:
+        fields = list(fields)
+        return dict(zip(fields, self.values(obj, fields)))
+
+    def decode(
+        self, data: Dict[str, Any], include_fields: Collection[str] | None = None
+    ) -> Dict[str, Any]:
+        """Column values from a received row, dropping keys not in ``include_fields``."""
+        decoders = self.decoders
+        out: Dict[str, Any] = {}
+        for k, v in data.items():
+            if include_fields is not None and k not in include_fields:
+                continue
+            dec = decoders.get(k)
+            out[k] = dec(v) if dec is not None and v is not None else v
+        return out
+
+    def decode_into(
+        self,
+        row: Dict[str, Any],
+        columns: Iterable[str],
+        values: Iterable[Any],
+        include_fields: Collection[str] | None = None,
+    ) -> None:
+        """``decode`` for a row given as parallel columns/values, written into ``row``."""
+        decoders = self.decoders
+        for k, v in zip(columns, values):
+            if include_fields is not None and k not in include_fields:
+                continue
+            dec = decoders.get(k)
+            row[k] = dec(v) if dec is not None and v is not None else v
+
+    def apply(self, obj: object, data: Dict[str, Any]) -> None:
+        self.apply_values(obj, data.keys(), data.values())
+
+    def apply_values(
+        self, obj: object, columns: Iterable[str], values: Iterable[Any]
+    ) -> None:
+        """``apply`` for a row given as parallel columns/values."""
+        decoders = self.decoders
+        for k, v in zip(columns, values):
+            dec = decoders.get(k)
+            setattr(obj, k, dec(v) if dec is not None and v is not None else v)
+
+
+@functools.lru_cache(maxsize=None)
+def _codec_for(model: Type) -> RowCodec:
+    table = getattr(model, "__table__", None)
+    return RowCodec.for_table(table) if table is not None else RowCodec()
 
 
 def serialize_row(obj: object, include_fields: Iterable[str]) -> Dict[str, Any]:
-    d = {}
-    for f in include_fields:
-        value = getattr(obj, f)
-        # Convert datetime objects to ISO format strings for JSON serialization
-        if isinstance(value, datetime):
-            d[f] = value.isoformat()
-        else:
-            d[f] = value
-    return d
+    """Deprecated: use ``RowCodec.encode`` (``TableSchema.codec``)."""
+    return _codec_for(type(obj)).encode(obj, include_fields)
 
 
 def apply_row(obj: object, data: Dict[str, Any], exclude: Iterable[str] = ()):
-    for k, v in data.items():
-        if k in exclude:
-            continue
-        # Convert ISO format datetime strings back to datetime objects
-        if isinstance(v, str):
-            try:
-                # Try to parse as ISO format datetime
-                v = datetime.fromisoformat(v)
-            except (ValueError, TypeError):
-                # Not a datetime, keep original value
-                pass
-        setattr(obj, k, v)
+    """Deprecated: use ``RowCodec.apply`` (``TableSchema.codec``)."""
+    exclude = set(exclude)
+    _codec_for(type(obj)).apply(
+        obj, {k: v for k, v in data.items() if k not in exclude}
+    )
 
 
 class TableSchema:
     def __init__(
-        self, model: Type, fields: Iterable[str], parents: Iterable[str] | None = None
+        self,
+        model: Type,
+        fields: Iterable[str],
+        parents: Iterable[str] | None = None,
+        codec: RowCodec | None = None,
     ):
         self.model = model
-        self.fields = list(fields)
+        self.fields: List[str] = list(fields)
+        self.field_set: FrozenSet[str] = frozenset(self.fields)
         self.parents: Set[str] = set(parents or [])
+        if codec is None:
+            table = getattr(model, "__table__", None)
+            codec = RowCodec.for_table(table) if table is not None else RowCodec()
+        self.codec = codec
@@ -1,12 +1,18 @@
-from typing import Optional
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, List, Optional, Set
 
 from flask import Blueprint, request, jsonify
 
 from sqlmodel import SQLModel, Field, Session, select, Column as SQLModelColumn
 
-from sqlalchemy import Integer, String, UniqueConstraint
+from sqlalchemy import BigInteger, DateTime, Integer, String, UniqueConstraint, inspect
+from sqlalchemy.exc import IntegrityError
 
-MAX_NODE = (1 << 10) - 1
+from data_shuttle_bridge.sql.changelog import SyncAck
+from data_shuttle_bridge.sql.ids import DEFAULT_LAYOUT, IdLayout
+from data_shuttle_bridge.sql.ids import MAX_NODE  # noqa: F401 (default layout)
 
 
 class NodeRegistry(SQLModel, table=True):
@@ -25,6 +31,13 @@ class NodeRegistry(SQLModel, table=True):
             nullable=False,
         )
     )
+    # Renewed by every registration of the device; leases idle past the
+    # allocator's TTL are reclaimed. NULL (rows leased before this column
+    # existed) never expires.
+    last_seen_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=SQLModelColumn(DateTime(timezone=True), nullable=True, index=True),
+    )
 
     __table_args__ = (
         UniqueConstraint("device_key", name="uq_node_registry_device_key"),
@@ -32,24 +45,285 @@ class NodeRegistry(SQLModel, table=True):
     )
 
 
-def allocate_node_id(sess: Session, device_key: str) -> int:
-    existing = sess.exec(
-        select(NodeRegistry).where(NodeRegistry.device_key == device_key)
+class IdLayoutRecord(SQLModel, table=True):
+    """The deployment's id layout; a single row, written once."""
+
+    __tablename__ = "id_layout"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    timestamp_bits: int = Field(sa_column=SQLModelColumn(Integer, nullable=False))
+    node_bits: int = Field(sa_column=SQLModelColumn(Integer, nullable=False))
+    sequence_bits: int = Field(sa_column=SQLModelColumn(Integer, nullable=False))
+    epoch_ms: int = Field(sa_column=SQLModelColumn(BigInteger, nullable=False))
+
+
+def load_id_layout(sess: Session) -> Optional[IdLayout]:
+    record = sess.get(IdLayoutRecord, 1)
+    if record is None:
+        return None
+    return IdLayout(
+        timestamp_bits=record.timestamp_bits,
+        node_bits=record.node_bits,
+        sequence_bits=record.sequence_bits,
+        epoch_ms=record.epoch_ms,
+    )
+
+
+def ensure_id_layout(sess: Session, layout: Optional[IdLayout] = None) -> IdLayout:
+    """
+    The deployment's persisted id layout. The first call stores ``layout``
+    (default 41/10/12); later calls raise IdLayoutMismatch if ``layout``
+    differs from the stored one, since ids of both could collide.
+    """
+    stored = load_id_layout(sess)
+    if stored is not None:
+        if layout is not None:
+            stored.check_compatible(layout)
+        return stored
+    layout = layout or DEFAULT_LAYOUT
+    too_large = sess.exec(
+        select(NodeRegistry.node_id).where(NodeRegistry.node_id > layout.max_node)
     ).first()
-    if existing:
-        return existing.node_id
-    used = set(x.node_id for x in sess.exec(select(NodeRegistry.node_id)).all())
-    for candidate in range(1, MAX_NODE + 1):
-        if candidate not in used:
-            entry = NodeRegistry(device_key=device_key, node_id=candidate)
-            sess.add(entry)
-            sess.commit()
+    if too_large is not None:
+        raise ValueError(
+            f"node_id {too_large} is already leased and doesn't fit "
+            f"{layout.node_bits} node bits"
+        )
+    sess.add(IdLayoutRecord(id=1, **layout.to_dict()))
+    sess.commit()
+    return layout
+
+
+def upgrade_node_registry(sess: Session) -> List[str]:
+    """
+    Add node_registry columns (and their indexes) that a table created by an
+    older release lacks, i.e. ``last_seen_at``. ``create_all`` never alters
+    existing tables. Idempotent; returns the names of the columns added.
+    NodeIdAllocator runs it before first use; ``node upgrade-registry`` runs
+    it from the command line.
+    """
+    conn = sess.connection()
+    inspector = inspect(conn)
+    table = NodeRegistry.__table__
+    if not inspector.has_table(table.name):
+        return []
+    existing = {c["name"] for c in inspector.get_columns(table.name)}
+    missing = [c for c in table.columns if c.name not in existing]
+    preparer = conn.dialect.identifier_preparer
+    for column in missing:
+        conn.exec_driver_sql(
+            f"ALTER TABLE {preparer.format_table(table)} "
+            f"ADD COLUMN {preparer.format_column(column)} "
+            f"{column.type.compile(dialect=conn.dialect)}"
+        )
+    for index in table.indexes:
+        if any(c.name in index.columns for c in missing):
+            index.create(conn, checkfirst=True)
+    sess.commit()
+    return [c.name for c in missing]
+
+
+class NodeIdAllocator:
+    """
+    Leases node ids from an in-memory map of used ids.
+
+    The map (one byte per node id) is built from node_registry on first use.
+    Ids freed in this process go on a free list; otherwise a cursor moves
+    through never-used ids, so each lease is O(1) amortized rather than a
+    scan of the table. Other processes leasing from the same table are
+    caught by the unique constraint: the id is marked used and the next one
+    tried. When no id is left, expired leases are reclaimed (with
+    ``lease_ttl``) and the map is rebuilt before giving up.
+
+    Reclaimed ids go to new devices, so ``lease_ttl`` must exceed the
+    longest time a live device may stay offline without renewing. Devices
+    that keep syncing against a sync_blueprint on the same database keep
+    their lease through ``sync_ack.acked_at``.
+    """
+
+    def __init__(
+        self,
+        layout: IdLayout = DEFAULT_LAYOUT,
+        lease_ttl: Optional[timedelta] = None,
+        max_retries: int = 16,
+    ):
+        self.layout = layout
+        self.lease_ttl = lease_ttl
+        self.max_retries = max_retries
+        self._lock = threading.RLock()
+        self._used: Optional[bytearray] = None
+        self._free: Deque[int] = deque()
+        self._cursor = 1
+        self._upgraded = False
+
+    def _upgrade(self, sess: Session) -> None:
+        if not self._upgraded:
+            with self._lock:
+                if not self._upgraded:
+                    upgrade_node_registry(sess)
+                    self._upgraded = True
+
+    def _load(self, sess: Session) -> None:
+        used = bytearray(self.layout.max_node + 1)
+        used[0] = 1  # node 0 is never leased
+        for node_id in sess.exec(select(NodeRegistry.node_id)):
+            if 0 < node_id < len(used):
+                used[node_id] = 1
+        self._used = used
+        self._free.clear()
+        self._cursor = 1
+
+    def _take(self) -> Optional[int]:
+        used = self._used
+        while self._free:
+            candidate = self._free.popleft()
+            if not used[candidate]:
+                used[candidate] = 1
+                return candidate
+        candidate = used.find(0, self._cursor)
+        if candidate < 0:
+            self._cursor = len(used)
+            return None
+        used[candidate] = 1
+        self._cursor = candidate + 1
+        return candidate
+
+    def _release(self, node_id: int) -> None:
+        if self._used is not None and 0 < node_id < len(self._used):
+            self._used[node_id] = 0
+            self._free.append(node_id)
+
+    def _candidate(self, sess: Session) -> int:
+        with self._lock:
+            if self._used is None:
+                self._load(sess)
+            candidate = self._take()
+            if candidate is None:
+                self.reclaim_expired(sess)
+                self._load(sess)
+                candidate = self._take()
+            if candidate is None:
+                raise RuntimeError("No available node_id slots")
             return candidate
-    raise RuntimeError("No available node_id slots")
 
+    def _synced_since(self, sess: Session, cutoff: datetime) -> Set[str]:
+        # Peers that pulled or acked recently (see sync_blueprint), if this
+        # database also serves sync
+        if not inspect(sess.get_bind()).has_table(SyncAck.__tablename__):
+            return set()
+        return set(sess.exec(select(SyncAck.peer_id).where(SyncAck.acked_at >= cutoff)))
+
+    def reclaim_expired(self, sess: Session) -> List[int]:
+        """
+        Delete leases not renewed within ``lease_ttl``; returns their node ids.
+        Leases of nodes that synced within the TTL (``sync_ack.acked_at``)
+        are renewed instead.
+        """
+        if self.lease_ttl is None:
+            return []
+        self._upgrade(sess)
+        now = datetime.now(timezone.utc)
+        cutoff = now - self.lease_ttl
+        expired = sess.exec(
+            select(NodeRegistry).where(NodeRegistry.last_seen_at < cutoff)
+        ).all()
+        active = self._synced_since(sess, cutoff) if expired else set()
+        node_ids = []
+        for entry in expired:
+            if str(entry.node_id) in active:
+                entry.last_seen_at = now
+                continue
+            node_ids.append(entry.node_id)
+            sess.delete(entry)
+        sess.commit()
+        with self._lock:
+            for node_id in node_ids:
+                self._release(node_id)
+        return node_ids
+
+    def allocate(self, sess: Session, device_key: str) -> int:
+        """The device's node id, leasing a free one if it has none; renews the lease."""
+        self._upgrade(sess)
+        now = datetime.now(timezone.utc)
+        existing = sess.exec(
+            select(NodeRegistry).where(NodeRegistry.device_key == device_key)
+        ).first()
+        if existing:
+            existing.last_seen_at = now
+            sess.commit()
+            return existing.node_id
+        for _ in range(self.max_retries):
+            candidate = self._candidate(sess)
+            sess.add(
+                NodeRegistry(device_key=device_key, node_id=candidate, last_seen_at=now)
+            )
+            try:
+                sess.commit()
+                return candidate
+            except IntegrityError:
+                sess.rollback()
+            existing = sess.exec(
+                select(NodeRegistry).where(NodeRegistry.device_key == device_key)
+            ).first()
+            if existing:
+                # The same device registered concurrently; keep its lease
+                with self._lock:
+                    self._release(candidate)
+                return existing.node_id
+            # Another process leased the candidate; it stays marked used
+        raise RuntimeError("Could not lease a node_id; too many concurrent leases")
+
+    def renew(self, sess: Session, device_key: str, node_id: int) -> bool:
+        """Refresh a lease; False if the device no longer holds ``node_id``."""
+        self._upgrade(sess)
+        entry = sess.exec(
+            select(NodeRegistry).where(
+                NodeRegistry.device_key == device_key, NodeRegistry.node_id == node_id
+            )
+        ).first()
+        if entry is None:
+            return False
+        entry.last_seen_at = datetime.now(timezone.utc)
+        sess.commit()
+        return True
+
+
+def allocate_node_id(
+    sess: Session, device_key: str, layout: IdLayout = DEFAULT_LAYOUT
+) -> int:
+    """
+    One-off lease (loads the used ids every call). Long-running servers keep
+    a NodeIdAllocator, as node_registry_blueprint does.
+    """
+    return NodeIdAllocator(layout).allocate(sess, device_key)
 
-def node_registry_blueprint(session_factory):
+
+def node_registry_blueprint(
+    session_factory,
+    layout: Optional[IdLayout] = None,
+    lease_ttl: Optional[timedelta] = None,
+):
+    """
+    ``POST /node/register`` leases (or renews) node ids, ``POST /node/renew``
+    renews a lease and ``GET /node/layout`` returns the id layout. ``layout``
+    is persisted on first use (see ensure_id_layout) and sent to clients with
+    every lease. With ``lease_ttl`` ids of devices that haven't registered or
+    renewed for that long are reclaimed once no free id is left.
+    """
     bp = Blueprint("node_registry", __name__)
+    allocators: list[NodeIdAllocator] = []
+    init_lock = threading.Lock()
+
+    def allocator(sess: Session) -> NodeIdAllocator:
+        if not allocators:
+            with init_lock:
+                if not allocators:
+                    allocators.append(
+                        NodeIdAllocator(ensure_id_layout(sess, layout), lease_ttl)
+                    )
+        return allocators[0]
+
+    def deployment_layout(sess: Session) -> IdLayout:
+        return allocator(sess).layout
 
     @bp.post("/node/register")
     def register():
@@ -58,7 +332,25 @@ def node_registry_blueprint(session_factory):
         if not device_key or not isinstance(device_key, str) or len(device_key) > 64:
             return jsonify({"error": "invalid device_key"}), 400
         with session_factory() as sess:
-            node_id = allocate_node_id(sess, device_key)
+            leases = allocator(sess)
+            node_id = leases.allocate(sess, device_key)
+            return jsonify({"node_id": node_id, "id_layout": leases.layout.to_dict()})
+
+    @bp.post("/node/renew")
+    def renew():
+        payload = request.get_json(force=True) or {}
+        device_key = payload.get("device_key")
+        node_id = payload.get("node_id")
+        if not isinstance(device_key, str) or not isinstance(node_id, int):
+            return jsonify({"error": "invalid device_key or node_id"}), 400
+        with session_factory() as sess:
+            if not allocator(sess).renew(sess, device_key, node_id):
+                return jsonify({"error": "lease expired"}), 409
             return jsonify({"node_id": node_id})
 
+    @bp.get("/node/layout")
+    def id_layout():
+        with session_factory() as sess:
+            return jsonify(deployment_layout(sess).to_dict())
+
     return bp
@@ -1,9 +1,116 @@
-from typing import Iterable, Dict, Type, List, Set
+import warnings
+from collections import deque
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, List, Mapping, Set, Tuple, Type
 
-from data_shuttle_bridge.sql.payloads import TableSchema
+from data_shuttle_bridge.sql.payloads import RowCodec, TableSchema
 
 
-def build_schema(models: Iterable[Type]) -> Dict[str, TableSchema]:
+class SchemaCycleError(ValueError):
+    """Foreign keys between the synced tables form a cycle."""
+
+    def __init__(self, cycle: List[str]):
+        self.cycle = cycle
+        super().__init__("foreign key cycle: " + " -> ".join(cycle))
+
+
+def _find_cycle(deps: Mapping[str, Set[str]], nodes: Set[str]) -> List[str]:
+    # Every node left over by Kahn's algorithm has a parent that is also left
+    # over, so walking parents from any of them must revisit a node
+    start = next(n for n in deps if n in nodes)
+    path: List[str] = []
+    seen: Dict[str, int] = {}
+    node = start
+    while node not in seen:
+        seen[node] = len(path)
+        path.append(node)
+        node = next(p for p in sorted(deps[node]) if p in nodes and p != node)
+    cycle = path[seen[node] :]
+    # Report parent-first, closing the loop
+    cycle.reverse()
+    return cycle + [cycle[0]]
+
+
+def parent_first_order(
+    schema: Mapping[str, TableSchema], strict: bool = False
+) -> Tuple[List[str], List[List[str]]]:
+    """
+    Order tables so parents come before the children referencing them
+    (Kahn's algorithm, linear in tables + foreign keys). Self-references are
+    ignored. Returns the order and the cycles found; tables on a cycle are
+    appended in schema order, or SchemaCycleError is raised when ``strict``.
+    """
+    deps: Dict[str, Set[str]] = {
+        name: {p for p in ts.parents if p in schema and p != name}
+        for name, ts in schema.items()
+    }
+    children: Dict[str, List[str]] = {name: [] for name in deps}
+    indeg: Dict[str, int] = {}
+    for name, parents in deps.items():
+        indeg[name] = len(parents)
+        for p in parents:
+            children[p].append(name)
+    q = deque(n for n, d in indeg.items() if d == 0)
+    out: List[str] = []
+    while q:
+        u = q.popleft()
+        out.append(u)
+        for v in children[u]:
+            indeg[v] -= 1
+            if indeg[v] == 0:
+                q.append(v)
+    cycles: List[List[str]] = []
+    if len(out) != len(deps):
+        remaining = {n for n, d in indeg.items() if d > 0}
+        cycles.append(_find_cycle(deps, remaining))
+        if strict:
+            raise SchemaCycleError(cycles[0])
+        out.extend(n for n in deps if n in remaining)
+    return out, cycles
+
+
+class CompiledSchema(Mapping[str, TableSchema]):
+    """
+    Read-only table schemas plus their parent-first order, computed once.
+
+    build_schema returns one of these; pass the same instance to every
+    engine (e.g. from a blueprint's engine_factory) so per-request engines
+    skip ordering and codec compilation. Behaves as a mapping of table name
+    to TableSchema.
+    """
+
+    def __init__(self, tables: Mapping[str, TableSchema], strict: bool = False):
+        self._tables: Mapping[str, TableSchema] = MappingProxyType(dict(tables))
+        order, cycles = parent_first_order(self._tables, strict=strict)
+        self.order: Tuple[str, ...] = tuple(order)
+        self.cycles: Tuple[Tuple[str, ...], ...] = tuple(tuple(c) for c in cycles)
+        for cycle in cycles:
+            warnings.warn(str(SchemaCycleError(cycle)), stacklevel=3)
+
+    @classmethod
+    def of(cls, schema: Mapping[str, TableSchema]) -> "CompiledSchema":
+        """``schema`` itself if already compiled, else a compiled copy."""
+        return schema if isinstance(schema, cls) else cls(schema)
+
+    def __getitem__(self, table: str) -> TableSchema:
+        return self._tables[table]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._tables)
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    def __repr__(self) -> str:
+        return f"CompiledSchema({list(self.order)!r})"
+
+
+def build_schema(models: Iterable[Type], strict: bool = False) -> CompiledSchema:
+    """
+    Compile sync schemas for ``models``: column lists, row codecs and the
+    parent-first table order. Foreign key cycles are warned about, or raise
+    SchemaCycleError with ``strict=True``.
+    """
     schema: Dict[str, TableSchema] = {}
     name_by_table: Dict[str, str] = {}
     for m in models:
@@ -23,5 +130,7 @@ def build_schema(models: Iterable[Type]) -> Dict[str, TableSchema]:
             for fk in c.foreign_keys:
                 p_table = fk.column.table.name
                 parents.add(p_table)
-        schema[table_name] = TableSchema(model=m, fields=fields, parents=parents)
-    return schema
+        schema[table_name] = TableSchema(
+            model=m, fields=fields, parents=parents, codec=RowCodec.for_table(table)
+        )
+    return CompiledSchema(schema, strict=strict)
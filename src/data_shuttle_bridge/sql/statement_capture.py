@@ -0,0 +1,290 @@
+"""
+Change capture for bulk statements on hooked models.
+
+Mapper events only see objects flushed by the unit of work. With
+``attach_change_hooks_for_models(models, capture_statements=True)`` these
+writes are logged as well, with one set-based change_log insert per
+statement:
+
+- ORM ``session.execute(update(Model)...)`` and ``delete(Model)``, including
+  bulk UPDATE by primary key, via ``Session.do_orm_execute``. Affected ids
+  and versions come from ``RETURNING`` where the dialect supports it (SQLite
+  3.35+, PostgreSQL), otherwise from a SELECT of the statement's WHERE
+  clause. Updates bump the version unless they set it.
+- Inserts: ORM ``insert(Model)``, Core ``insert(table)`` and
+  ``bulk_insert_mappings``, via the Core ``before_execute``/``after_execute``
+  events. Where the dialect supports ``RETURNING`` for the statement, the
+  insert is run with ``return_defaults`` so the logged rows (database
+  generated ids included) come back from the database; as a side effect its
+  result returns those columns as rows. Otherwise rows are read from the
+  executed parameters, which requires Python-side ids (e.g. the
+  ``SyncRowSQLModelMixin`` default) and one parameter set per row (not a
+  multi-VALUES ``insert().values([...])``); other inserts raise
+  InsertCaptureError instead of going unlogged.
+
+Core ``update(table)``/``delete(table)`` and ``bulk_update_mappings`` are not
+captured; use the ORM statement forms.
+"""
+
+from __future__ import annotations
+
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Sequence
+
+from sqlalchemy import event, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Mapper, ORMExecuteState, Session
+from sqlalchemy.sql.dml import Insert
+
+from data_shuttle_bridge.sql.changelog import ChangeLog
+from data_shuttle_bridge.sql.notify import mark_change_logged
+
+
+class InsertCaptureError(RuntimeError):
+    """An insert on a captured table whose inserted ids can't be determined."""
+
+
+# Execution option marking statements whose changes are logged elsewhere
+SKIP_CAPTURE = "data_shuttle_bridge_skip_capture"
+
+IN_CLAUSE_CHUNK = 500
+
+# Table name -> whether update entries record their changed fields
+_statement_tables: Dict[str, bool] = {}
+
+# The connection a Session flush is inserting through: its inserts are
+# logged by the mapper events. Set by the mapper's before_insert, so only
+# flushes that actually write set it
+_flushing: ContextVar[Connection | None] = ContextVar(
+    "data_shuttle_bridge_flushing", default=None
+)
+
+
+def capture_statements_for(table_name: str, track_fields: bool = False) -> None:
+    """Log bulk statements on ``table_name`` (see the module docstring)."""
+    _statement_tables[table_name] = track_fields
+    if not event.contains(Session, "do_orm_execute", _capture_orm_statement):
+        event.listen(Session, "do_orm_execute", _capture_orm_statement)
+        event.listen(Engine, "before_execute", _prepare_insert, retval=True)
+        event.listen(Engine, "after_execute", _capture_insert)
+        event.listen(Mapper, "before_insert", _flush_started)
+        event.listen(Session, "after_flush", _flush_ended)
+        event.listen(Session, "after_soft_rollback", _flush_ended)
+        event.listen(Session, "after_transaction_end", _flush_ended)
+
+
+def is_statement_captured(table_name: str) -> bool:
+    return table_name in _statement_tables
+
+
+def _flush_started(mapper, connection: Connection, target) -> None:
+    if mapper.local_table.name in _statement_tables:
+        _flushing.set(connection)
+
+
+def _flush_ended(session: Session, *args) -> None:
+    _flushing.set(None)
+
+
+def _summary_value(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _entries(
+    table: str,
+    op: str,
+    rows: Iterable[Any],
+    keys: Sequence[str],
+    fields: List[str] | None = None,
+) -> List[Dict[str, Any]]:
+    from .wiring import CHANGED_FIELDS_KEY, get_current_node_id  # avoid cycle
+
+    node_id = get_current_node_id()
+    out = []
+    for row in rows:
+        values = dict(zip(keys, row))
+        summary = None
+        if op != "D":
+            summary = {k: _summary_value(v) for k, v in values.items() if k != "id"}
+            if fields is not None:
+                summary[CHANGED_FIELDS_KEY] = fields
+        out.append(
+            {
+                "table": table,
+                "pk": int(values["id"]),
+                "op": op,
+                "version": int(values.get("version") or 1),
+                "summary": summary,
+                "node_id": node_id,
+            }
+        )
+    return out
+
+
+def _write(connection: Connection, entries: List[Dict[str, Any]]) -> None:
+    if entries:
+        connection.execute(ChangeLog.__table__.insert(), entries)
+        mark_change_logged(connection)
+
+
+def _summary_columns(table) -> List[Any]:
+    from .wiring import SUMMARY_KEYS  # avoid cycle
+
+    return [table.c.id] + [table.c[k] for k in SUMMARY_KEYS if k in table.c]
+
+
+def _set_keys(state: ORMExecuteState) -> List[str]:
+    """Column names an UPDATE statement assigns."""
+    stmt = state.statement
+    keys = [getattr(k, "key", k) for k in (getattr(stmt, "_values", None) or {})]
+    params = state.parameters
+    if isinstance(params, dict):
+        keys.extend(params)
+    elif params:
+        keys.extend(k for k in params[0] if k != "id")
+    return list(dict.fromkeys(keys))
+
+
+def _load(session: Session, mapper, columns, ids: List[int]) -> List[Any]:
+    table = mapper.local_table
+    rows: List[Any] = []
+    for i in range(0, len(ids), IN_CLAUSE_CHUNK):
+        chunk = ids[i : i + IN_CLAUSE_CHUNK]
+        rows.extend(
+            session.execute(
+                select(*columns).where(table.c.id.in_(chunk)),
+                bind_arguments={"mapper": mapper},
+            ).all()
+        )
+    return rows
+
+
+def _capture_orm_statement(state: ORMExecuteState):
+    if not (state.is_update or state.is_delete) or not state.is_orm_statement:
+        return None
+    if state.execution_options.get(SKIP_CAPTURE):
+        return None
+    mapper = state.bind_mapper
+    table = mapper.local_table if mapper is not None else None
+    if table is None or table.name not in _statement_tables:
+        return None
+    track_fields = _statement_tables[table.name]
+    session = state.session
+    columns = _summary_columns(table)
+    keys = [c.key for c in columns]
+    options = {SKIP_CAPTURE: True}
+    stmt = state.statement
+    params = state.parameters
+    by_pk = isinstance(params, list) and len(params) > 0
+    dialect = session.get_bind(mapper).dialect
+
+    if state.is_delete:
+        if dialect.delete_returning and not stmt.returning_column_descriptions:
+            result = state.invoke_statement(
+                statement=stmt.returning(*columns), execution_options=options
+            )
+            rows = result.all()
+        else:
+            rows = session.execute(
+                select(*columns).where(stmt.whereclause), params
+            ).all()
+            result = state.invoke_statement(execution_options=options)
+        _write(session.connection(), _entries(table.name, "D", rows, keys))
+        return result
+
+    set_keys = _set_keys(state)
+    bump = "version" in table.c and "version" not in set_keys
+    fields = None
+    if track_fields:
+        fields = set_keys + (["version"] if bump else [])
+    if by_pk:
+        # Bulk UPDATE by primary key: no RETURNING; bump and read back by id
+        result = state.invoke_statement(execution_options=options)
+        ids = [p["id"] for p in params]
+        if bump:
+            for i in range(0, len(ids), IN_CLAUSE_CHUNK):
+                session.execute(
+                    table.update()
+                    .where(table.c.id.in_(ids[i : i + IN_CLAUSE_CHUNK]))
+                    .values(version=table.c.version + 1),
+                    bind_arguments={"mapper": mapper},
+                    execution_options=options,
+                )
+        rows = _load(session, mapper, columns, ids)
+    else:
+        if bump:
+            stmt = stmt.values({table.c.version: table.c.version + 1})
+        if dialect.update_returning and not stmt.returning_column_descriptions:
+            result = state.invoke_statement(
+                statement=stmt.returning(*columns), execution_options=options
+            )
+            rows = result.all()
+        else:
+            ids = list(
+                session.scalars(select(table.c.id).where(stmt.whereclause), params)
+            )
+            result = state.invoke_statement(statement=stmt, execution_options=options)
+            rows = _load(session, mapper, columns, ids)
+    _write(session.connection(), _entries(table.name, "U", rows, keys, fields))
+    return result
+
+
+def _captured_insert(connection: Connection, clauseelement, execution_options) -> bool:
+    if not isinstance(clauseelement, Insert):
+        return False
+    table = clauseelement.table
+    if getattr(table, "name", None) not in _statement_tables:
+        return False
+    if _flushing.get() is connection:
+        return False
+    options = {**clauseelement.get_execution_options(), **execution_options}
+    return not options.get(SKIP_CAPTURE)
+
+
+def _prepare_insert(
+    conn: Connection, clauseelement, multiparams, params, execution_options
+):
+    # Have the database return the logged columns where it can
+    if _captured_insert(conn, clauseelement, execution_options):
+        dialect = conn.dialect
+        many = len(multiparams) > 1 or (
+            len(multiparams) == 1 and isinstance(multiparams[0], list)
+        )
+        supported = (
+            dialect.insert_executemany_returning if many else dialect.insert_returning
+        )
+        if supported and not clauseelement.returning_column_descriptions:
+            clauseelement = clauseelement.return_defaults(
+                supplemental_cols=_summary_columns(clauseelement.table)
+            )
+    return clauseelement, multiparams, params
+
+
+def _inserted_rows(result, keys: Sequence[str]) -> List[List[Any]]:
+    returned = result.returned_defaults_rows
+    if returned and all(k in returned[0]._mapping for k in keys):
+        return [[row._mapping[k] for k in keys] for row in returned]
+    # Bound values of every inserted row, Python-side defaults included
+    compiled = result.context.compiled_parameters or [{}]
+    rows = [[values.get(k) for k in keys] for values in compiled]
+    if rows and rows[0][0] is None:
+        for row, pk in zip(rows, result.inserted_primary_key_rows):
+            row[0] = pk[0]
+    count = result.rowcount
+    if any(row[0] is None for row in rows) or (count >= 0 and count != len(rows)):
+        raise InsertCaptureError(
+            "cannot log insert: the dialect does not return the inserted ids; "
+            "give the table a Python-side id default"
+        )
+    return rows
+
+
+def _capture_insert(
+    conn: Connection, clauseelement, multiparams, params, execution_options, result
+) -> None:
+    if not _captured_insert(conn, clauseelement, execution_options):
+        return
+    table = clauseelement.table
+    keys = [c.key for c in _summary_columns(table)]
+    _write(conn, _entries(table.name, "I", _inserted_rows(result, keys), keys))
@@ -1,15 +1,131 @@
 from __future__ import annotations
 
+import itertools
+import queue
+import threading
+import time
 from collections import defaultdict, deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Iterable, Tuple, Set
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Deque,
+    Dict,
+    List,
+    Iterable,
+    Iterator,
+    Mapping,
+    Sequence,
+    Tuple,
+    Set,
+    TypeVar,
+)
 
 from sqlmodel import Session, select
 
+from sqlalchemy import bindparam, delete, insert, update
+from sqlalchemy import select as sa_select
+from sqlalchemy.orm.util import identity_key
+
+from data_shuttle_bridge.sql.batching import AdaptiveBatchSize, estimate_payload_bytes
 from data_shuttle_bridge.sql.changelog import ChangeLog, SyncState
-from data_shuttle_bridge.sql.payloads import TableSchema, apply_row, serialize_row
-from data_shuttle_bridge.sql.typing_ import ChangePayload
-from data_shuttle_bridge.sql.wiring import set_current_node_id, get_current_node_id
+from data_shuttle_bridge.sql.columnar import (
+    ColumnarBatch,
+    TableBlock,
+    ValueItem,
+)
+from data_shuttle_bridge.sql.notify import mark_change_logged
+from data_shuttle_bridge.sql.payloads import TableSchema
+from data_shuttle_bridge.sql.schema import CompiledSchema
+from data_shuttle_bridge.sql.statement_capture import SKIP_CAPTURE
+from data_shuttle_bridge.sql.transport import send_ack
+from data_shuttle_bridge.sql.typing_ import (
+    ChangeBatch,
+    ChangePayload,
+    ChangeStream,
+    batch_last_id,
+)
+from data_shuttle_bridge.sql.wiring import (
+    CHANGED_FIELDS_KEY,
+    SUMMARY_KEYS,
+    get_current_node_id,
+    is_change_captured,
+    set_current_node_id,
+)
+
+# Upper bound on bound parameters per IN (...) clause; keeps us well below
+# SQLite's SQLITE_MAX_VARIABLE_NUMBER on older builds.
+IN_CLAUSE_CHUNK = 500
+
+
+def load_rows_by_pk(sess: Session, model, pks: Iterable[int]) -> Dict[int, Any]:
+    """Load rows of ``model`` for the given primary keys with chunked IN queries."""
+    wanted = list(dict.fromkeys(pks))
+    found: Dict[int, Any] = {}
+    id_col = getattr(model, "id")
+    for i in range(0, len(wanted), IN_CLAUSE_CHUNK):
+        chunk = wanted[i : i + IN_CLAUSE_CHUNK]
+        for obj in sess.exec(select(model).where(id_col.in_(chunk))).all():
+            found[getattr(obj, "id")] = obj
+    return found
+
+
+def _group_by_keys(rows: Iterable[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Split parameter sets into groups with identical keys, as executemany needs."""
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = defaultdict(list)
+    for row in rows:
+        groups[tuple(sorted(row))].append(row)
+    return list(groups.values())
+
+
+T = TypeVar("T")
+
+
+def _net_changes(
+    entries: Sequence[T],
+    key: Callable[[T], Tuple[str, int]],
+    op: Callable[[T], str],
+) -> List[Tuple[T, str]]:
+    """
+    Collapse entries for the same (table, pk) into their net effect.
+
+    ``entries`` must be in change-id order. Returns the last entry of each
+    surviving row together with its net op, in the order of those entries.
+    """
+    first_op: Dict[Tuple[str, int], str] = {}
+    last_index: Dict[Tuple[str, int], int] = {}
+    for i, e in enumerate(entries):
+        k = key(e)
+        first_op.setdefault(k, op(e))
+        last_index[k] = i
+    out: List[Tuple[T, str]] = []
+    for k, i in sorted(last_index.items(), key=lambda kv: kv[1]):
+        e = entries[i]
+        net = op(e)
+        if first_op[k] == "I":
+            if net == "D":
+                # Created and removed within the batch; the peer never needs it
+                continue
+            net = "I"
+        out.append((e, net))
+    return out
+
+
+def coalesce_changes(changes: Sequence[ChangePayload]) -> ChangeBatch:
+    """Collapse a batch of payloads to one net change per (table, pk)."""
+    net = _net_changes(changes, lambda c: (c["table"], c["pk"]), lambda c: c["op"])
+    return ChangeBatch(
+        [{**c, "op": op} for c, op in net],  # type: ignore[typeddict-item]
+        last_id=batch_last_id(changes),
+    )
+
+
+def compute_parent_first_order(schema: Mapping[str, TableSchema]) -> List[str]:
+    """Order tables so parents come before the children referencing them."""
+    return list(CompiledSchema.of(schema).order)
 
 
 class ConflictPolicy(str, Enum):
@@ -22,99 +138,191 @@ class SyncEngine:
         self,
         session: Session,
         peer_id: str,
-        schema: Dict[str, TableSchema],
+        schema: Mapping[str, TableSchema],
         policy: ConflictPolicy = ConflictPolicy.LWW,
         parent_first_order: Iterable[str] | None = None,
         node_id: str | None = None,
+        bulk_apply: bool = False,
+        coalesce: bool = False,
+        adaptive_batching: AdaptiveBatchSize | None = None,
+        group_commit: bool = False,
+        group_commit_rows: int | None = 0,
+        group_commit_seconds: float | None = 0.0,
+        delta_updates: bool = False,
+        columnar: bool = False,
     ):
         self.sess = session
         self.peer_id = peer_id
-        self.schema = schema
+        # build_schema's CompiledSchema is shared as-is; plain dicts compile here
+        self.schema = CompiledSchema.of(schema)
         self.policy = policy
         self.node_id = node_id
-        self.order = (
-            list(parent_first_order) if parent_first_order else self._compute_order()
+        self.bulk_apply = bulk_apply
+        self.coalesce = coalesce
+        # Ship only changed columns for updates whose log entry recorded them
+        self.delta_updates = delta_updates
+        # Serialize batches as per-table column blocks (see columnar.py)
+        self.columnar = columnar
+        # Pull and push learn their batch sizes independently
+        self.pull_batching = adaptive_batching
+        self.push_batching = adaptive_batching.copy() if adaptive_batching else None
+        self.group_commit = group_commit
+        self.group_commit_rows = group_commit_rows
+        self.group_commit_seconds = group_commit_seconds
+        self._group_rows = 0
+        self._group_started: float | None = None
+        self.order: Sequence[str] = (
+            list(parent_first_order) if parent_first_order else self.schema.order
         )
 
-    def _compute_order(self) -> List[str]:
-        deps: Dict[str, Set[str]] = {
-            name: set(ts.parents) for name, ts in self.schema.items()
-        }
-        indeg: Dict[str, int] = {name: 0 for name in deps}
-        for n in deps:
-            for p in deps[n]:
-                if p in deps:
-                    indeg[n] += 1
-        q = deque([n for n, d in indeg.items() if d == 0])
-        out: List[str] = []
-        while q:
-            u = q.popleft()
-            out.append(u)
-            for v in deps:
-                if u in deps[v]:
-                    indeg[v] -= 1
-                    if indeg[v] == 0:
-                        q.append(v)
-        if len(out) != len(deps):
-            remain = [n for n in deps if n not in out]
-            out.extend(remain)
-        return out
-
-    def _serialize_change(self, ch: ChangeLog) -> ChangePayload:
+    def _row_image(
+        self,
+        ch: ChangeLog,
+        rows: Dict[int, Any] | None,
+        op: str,
+        fields: Collection[str] | None,
+    ) -> Tuple[Sequence[str] | None, Any, bool]:
+        """Columns to ship, the loaded row (or None) and whether it's a delta."""
         ts = self.schema[ch.table]
-        data = None
-        if ch.op in ("I", "U"):
-            obj = self.sess.get(ts.model, ch.pk)
-            if obj:
-                data = serialize_row(obj, ts.fields)
-        return {
+        partial = op == "U" and fields is not None
+        if op not in ("I", "U"):
+            return None, None, partial
+        obj = rows.get(ch.pk) if rows is not None else self.sess.get(ts.model, ch.pk)
+        if partial:
+            # Timestamps and version always travel with a delta: the
+            # updated_at onupdate never shows up in attribute history
+            return (
+                [f for f in ts.fields if f in fields or f in SUMMARY_KEYS],
+                obj,
+                True,
+            )
+        return ts.fields, obj, False
+
+    def _serialize_change(
+        self,
+        ch: ChangeLog,
+        rows: Dict[int, Any] | None = None,
+        op: str | None = None,
+        fields: Collection[str] | None = None,
+    ) -> ChangePayload:
+        op = op or ch.op
+        include, obj, partial = self._row_image(ch, rows, op, fields)
+        payload: ChangePayload = {
             "id": ch.id,
             "table": ch.table,
             "pk": ch.pk,
-            "op": ch.op,  # type: ignore
+            "op": op,  # type: ignore
             "version": ch.version,
-            "data": data,
-            "at": ch.at.isoformat() if ch.at else None,
+            "data": (self.schema[ch.table].codec.encode(obj, include) if obj else None),
+            "at": self._entry_at(ch),
         }
+        if partial:
+            payload["partial"] = True
+        return payload
 
-    def local_changes_since(
-        self, since_id: int, limit: int = 1000
-    ) -> List[ChangePayload]:
-        """Get changes since a given ID. For pushing to remote, we only push changes from OTHER nodes, not our own."""
-        query = (
-            select(ChangeLog)
-            .where(ChangeLog.id > since_id)
-            .order_by(ChangeLog.id.asc())
-            .limit(limit)
-        )
-        # When pushing, exclude our own node's changes (we already have them)
-        # Only push changes from other nodes to maintain proper sync
-        if self.node_id:
-            from sqlalchemy import or_
+    def _serialize_columnar(
+        self,
+        net: Sequence[Tuple[ChangeLog, str]],
+        rows_by_table: Dict[str, Dict[int, Any]],
+        delta: Dict[Any, Set[str] | None],
+        last_id: int | None,
+    ) -> ColumnarBatch:
+        batch = ColumnarBatch(last_id=last_id)
+        for ch, op in net:
+            include, obj, partial = self._row_image(
+                ch, rows_by_table.get(ch.table, {}), op, delta.get(self._delta_key(ch))
+            )
+            ts = self.schema[ch.table]
+            block = batch.block(ch.table, ts.fields)
+            values = mask = None
+            if obj:
+                values = ts.codec.values(obj, include)
+                if partial:
+                    mask = [block.columns.index(f) for f in include]
+            block.append(
+                ch.id,
+                ch.pk,
+                op,
+                ch.version,
+                self._entry_at(ch),
+                values,
+                mask,
+            )
+        return batch
 
-            query = query.where(
-                or_(
-                    ChangeLog.node_id.is_(
-                        None
-                    ),  # Include legacy changes with no node_id
-                    ChangeLog.node_id
-                    != self.node_id,  # Include changes from other nodes only
+    @staticmethod
+    def _entry_at(ch: ChangeLog) -> str | None:
+        return ch.at.isoformat() if ch.at else None
+
+    @staticmethod
+    def _changed_fields(ch: ChangeLog) -> Set[str] | None:
+        if ch.op != "U" or not ch.summary:
+            return None
+        fields = ch.summary.get(CHANGED_FIELDS_KEY)
+        return set(fields) if fields is not None else None
+
+    def _delta_key(self, ch: ChangeLog) -> Any:
+        # Coalesced updates to a row share one payload, so their fields merge
+        return (ch.table, ch.pk) if self.coalesce else ch.id
+
+    def _delta_fields(self, changes: Sequence[ChangeLog]) -> Dict[Any, Set[str] | None]:
+        """
+        Columns each payload's updates touched. None means the full row is
+        needed (an insert, or an update that didn't record its fields).
+        """
+        out: Dict[Any, Set[str] | None] = {}
+        for ch in changes:
+            key = self._delta_key(ch)
+            fields = self._changed_fields(ch)
+            if key not in out:
+                out[key] = fields
+            elif out[key] is not None:
+                out[key] = out[key] | fields if fields is not None else None
+        return out
+
+    def _serialize_changes(
+        self, changes: Sequence[ChangeLog], columnar: bool = False
+    ) -> ChangeBatch | ColumnarBatch:
+        """Serialize a batch of changes, loading referenced rows with one query per table."""
+        if self.coalesce:
+            net = _net_changes(changes, lambda ch: (ch.table, ch.pk), lambda ch: ch.op)
+        else:
+            net = [(ch, ch.op) for ch in changes]
+        delta = self._delta_fields(changes) if self.delta_updates else {}
+        pks_by_table: Dict[str, List[int]] = defaultdict(list)
+        for ch, op in net:
+            if op in ("I", "U"):
+                pks_by_table[ch.table].append(ch.pk)
+        rows_by_table: Dict[str, Dict[int, Any]] = {
+            table: load_rows_by_pk(self.sess, self.schema[table].model, pks)
+            for table, pks in pks_by_table.items()
+        }
+        last_id = changes[-1].id if changes else None
+        if columnar:
+            return self._serialize_columnar(net, rows_by_table, delta, last_id)
+        return ChangeBatch(
+            [
+                self._serialize_change(
+                    ch,
+                    rows_by_table.get(ch.table, {}),
+                    op,
+                    delta.get(self._delta_key(ch)),
                 )
-            )
-        rows = self.sess.exec(query).all()
-        return [self._serialize_change(r) for r in rows]
+                for ch, op in net
+            ],
+            last_id=last_id,
+        )
 
-    def remote_changes_since(
-        self, since_id: int, limit: int = 1000, exclude_node_id: str | None = None
-    ) -> List[ChangePayload]:
-        """Get changes since a given ID, optionally excluding changes from a specific node (watermarking)."""
+    def _changes_query(
+        self, since_id: int, limit: int, exclude_node_id: str | None = None
+    ):
         query = (
             select(ChangeLog)
             .where(ChangeLog.id > since_id)
             .order_by(ChangeLog.id.asc())
             .limit(limit)
         )
-        # Filter out changes from the specified node (watermarking on pull)
+        # Filter out changes from the specified node (watermarking)
         # Include both NULL node_id (legacy) and any node_id that's not the excluded one
         if exclude_node_id:
             from sqlalchemy import or_
@@ -128,29 +336,114 @@ class SyncEngine:
                     != exclude_node_id,  # Include changes from other nodes
                 )
             )
+        return query
+
+    def _stream_changes(self, query, chunk_size: int) -> ChangeStream:
+        """Serialize a query's changes chunk by chunk from a server-side cursor."""
+
+        def gen():
+            last_id = None
+            result = self.sess.exec(query.execution_options(yield_per=chunk_size))
+            for part in result.partitions():
+                batch = self._serialize_changes(part)
+                last_id = batch.last_id
+                yield from batch
+            return last_id
+
+        return ChangeStream(gen())
+
+    def has_changes_since(
+        self, since_id: int, exclude_node_id: str | None = None
+    ) -> bool:
+        """Whether the change log has an entry above ``since_id`` not made by ``exclude_node_id``."""
+        query = self._changes_query(since_id, 1, exclude_node_id)
+        return self.sess.exec(query).first() is not None
+
+    def local_changes_since(
+        self, since_id: int, limit: int = 1000, columnar: bool | None = None
+    ) -> ChangeBatch | ColumnarBatch:
+        """Get changes since a given ID. For pushing to remote, we only push changes from OTHER nodes, not our own."""
+        # When pushing, exclude our own node's changes (we already have them)
+        rows = self.sess.exec(self._changes_query(since_id, limit, self.node_id)).all()
+        return self._serialize_changes(
+            rows, self.columnar if columnar is None else columnar
+        )
+
+    def remote_changes_since(
+        self,
+        since_id: int,
+        limit: int = 1000,
+        exclude_node_id: str | None = None,
+        columnar: bool | None = None,
+    ) -> ChangeBatch | ColumnarBatch:
+        """Get changes since a given ID, optionally excluding changes from a specific node (watermarking)."""
+        query = self._changes_query(since_id, limit, exclude_node_id)
         rows = self.sess.exec(query).all()
-        return [self._serialize_change(r) for r in rows]
+        return self._serialize_changes(
+            rows, self.columnar if columnar is None else columnar
+        )
+
+    def stream_local_changes_since(
+        self, since_id: int, limit: int = 1000, chunk_size: int = 500
+    ) -> ChangeStream:
+        """
+        Like local_changes_since, but reads the change log through a
+        server-side cursor and serializes ``chunk_size`` entries at a time, so
+        memory stays flat however large ``limit`` is.
+        """
+        query = self._changes_query(since_id, limit, self.node_id)
+        return self._stream_changes(query, chunk_size)
+
+    def stream_remote_changes_since(
+        self,
+        since_id: int,
+        limit: int = 1000,
+        exclude_node_id: str | None = None,
+        chunk_size: int = 500,
+    ) -> ChangeStream:
+        """Streaming counterpart of remote_changes_since (see stream_local_changes_since)."""
+        query = self._changes_query(since_id, limit, exclude_node_id)
+        return self._stream_changes(query, chunk_size)
 
     def _apply_one(self, cp: ChangePayload):
-        ts = self.schema[cp["table"]]
+        for item in self._value_items([cp]):
+            self._apply_values(cp["table"], *item)
+
+    def _apply_values(
+        self,
+        table: str,
+        pk: int,
+        op: str,
+        incoming_version: int,
+        columns: Sequence[str] | None,
+        values: Sequence[Any] | None,
+        partial: bool = False,
+    ):
+        ts = self.schema[table]
         model = ts.model
-        obj = self.sess.get(model, cp["pk"])
-        if cp["op"] == "D":
+        obj = self.sess.get(model, pk)
+        if op == "D":
             if obj:
                 self.sess.delete(obj)
             return
-        incoming_version = cp["version"]
+        if obj is None and partial:
+            # A column delta can't create a row; the full row arrives with
+            # its insert (or a later full update)
+            import sys
+
+            print(f"WARNING: Partial update for missing {table} {pk}", file=sys.stderr)
+            return
         if obj is None:
-            obj = model(id=cp["pk"])  # type: ignore
+            obj = model(id=pk)  # type: ignore
             self.sess.add(obj)
-            if cp["data"]:
-                apply_row(obj, cp["data"])
+            if values:
+                ts.codec.apply_values(obj, columns, values)
             else:
                 # Data is missing - this shouldn't happen for I/U operations
                 import sys
 
                 print(
-                    f"WARNING: No data for {cp['table']} {cp['pk']} operation {cp['op']}",
+                    f"WARNING: No data for {table} {pk} operation {op}",
                     file=sys.stderr,
                 )
             setattr(obj, "version", incoming_version)
@@ -163,17 +456,185 @@ class SyncEngine:
             and incoming_version <= current_version
         ):
             return
-        if cp["data"]:
-            apply_row(obj, cp["data"])
+        if values:
+            ts.codec.apply_values(obj, columns, values)
         setattr(obj, "version", max(current_version, incoming_version))
 
+    def _prefetch_versions(self, table, pks: Iterable[int]) -> Dict[int, int]:
+        wanted = list(pks)
+        versions: Dict[int, int] = {}
+        for i in range(0, len(wanted), IN_CLAUSE_CHUNK):
+            chunk = wanted[i : i + IN_CLAUSE_CHUNK]
+            rows = self.sess.execute(
+                sa_select(table.c.id, table.c.version).where(table.c.id.in_(chunk))
+            )
+            for pk, version in rows:
+                versions[pk] = version
+        return versions
+
+    def _upsert_stmt(self, table, keys: Iterable[str]):
+        dialect = self.sess.get_bind().dialect.name
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        elif dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            return insert(table)
+        stmt = dialect_insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={k: stmt.excluded[k] for k in keys if k != "id"},
+        )
+
+    def _apply_table_bulk(self, table_name: str, changes: Sequence[ValueItem]):
+        """
+        Apply one table's slice of a batch with set-based statements.
+
+        Existing versions are prefetched in one query, the conflict policy is
+        evaluated in memory, and the net effect per row is written with
+        executemany deletes, updates and upserts. Rows arrive as parallel
+        column/value sequences, so columnar blocks are decoded straight into
+        the statement parameters. Core statements bypass the
+        mapper events, so change_log entries are written here as well. Unlike
+        the ORM path, incoming versions are stored as-is rather than bumped.
+        """
+        ts = self.schema[table_name]
+        table = ts.model.__table__
+        fields = ts.field_set
+        existing = self._prefetch_versions(table, {c[0] for c in changes})
+        current: Dict[int, int | None] = dict(existing)
+        pending: Dict[int, Dict[str, Any]] = {}
+        summaries: Dict[int, Dict[str, Any]] = {}
+        deleted: Dict[int, int] = {}
+        for pk, op, incoming_version, columns, values, partial in changes:
+            cur = current.get(pk)
+            if op == "D":
+                if cur is not None:
+                    current[pk] = None
+                    pending.pop(pk, None)
+                    deleted[pk] = cur
+                continue
+            if cur is None:
+                if not values or partial:
+                    # Nothing to insert: the row was deleted at the source, or
+                    # only a column delta arrived
+                    continue
+                row: Dict[str, Any] = {}
+                new_version = incoming_version
+            else:
+                if self.policy == ConflictPolicy.VERSION and incoming_version <= cur:
+                    continue
+                row = pending.get(pk, {})
+                new_version = max(cur, incoming_version)
+            if values:
+                ts.codec.decode_into(row, columns, values, fields)  # type: ignore[arg-type]
+                summaries[pk] = {
+                    k: v.isoformat() if isinstance(v, datetime) else v
+                    for k, v in zip(columns, values)  # type: ignore[arg-type]
+                    if k in SUMMARY_KEYS
+                }
+            row["version"] = new_version
+            row.pop("id", None)
+            pending[pk] = row
+            current[pk] = new_version
+
+        deletes = [pk for pk, v in current.items() if v is None and pk in existing]
+        updates = [{**row, "_pk": pk} for pk, row in pending.items() if pk in existing]
+        inserts = [
+            {**row, "id": pk} for pk, row in pending.items() if pk not in existing
+        ]
+        for i in range(0, len(deletes), IN_CLAUSE_CHUNK):
+            chunk = deletes[i : i + IN_CLAUSE_CHUNK]
+            self.sess.execute(delete(table).where(table.c.id.in_(chunk)))
+        for group in _group_by_keys(updates):
+            self.sess.execute(
+                update(table).where(table.c.id == bindparam("_pk")), group
+            )
+        # Logged below; keep statement capture from logging the upserts too
+        upsert_options = {SKIP_CAPTURE: True}
+        for group in _group_by_keys(inserts):
+            self.sess.execute(
+                self._upsert_stmt(table, group[0]),
+                group,
+                execution_options=upsert_options,
+            )
+
+        if is_change_captured(table_name):
+            node_id = get_current_node_id()
+            log_rows = [
+                {
+                    "table": table_name,
+                    "pk": pk,
+                    "op": "U" if pk in existing else "I",
+                    "version": row["version"],
+                    "summary": {**summaries.get(pk, {}), "version": row["version"]},
+                    "node_id": node_id,
+                }
+                for pk, row in pending.items()
+            ] + [
+                {
+                    "table": table_name,
+                    "pk": pk,
+                    "op": "D",
+                    "version": deleted[pk],
+                    "summary": None,
+                    "node_id": node_id,
+                }
+                for pk in deletes
+            ]
+            if log_rows:
+                self.sess.execute(ChangeLog.__table__.insert(), log_rows)
+                mark_change_logged(self.sess.connection())
+
+        # Rows written behind the ORM's back must be reloaded on next access
+        for pk in list(pending) + deletes:
+            obj = self.sess.identity_map.get(identity_key(ts.model, pk))
+            if obj is not None:
+                self.sess.expire(obj)
+
+    @staticmethod
+    def _value_items(entries: Sequence[Any]) -> Iterator[ValueItem]:
+        """Apply items (positional row values) for one table's blocks or payload dicts."""
+        for entry in entries:
+            if isinstance(entry, TableBlock):
+                yield from entry.value_items()
+                continue
+            data = entry["data"]
+            yield (
+                entry["pk"],
+                entry["op"],
+                entry["version"],
+                data.keys() if data else None,
+                data.values() if data else None,
+                entry.get("partial", False),
+            )
+
     def apply_remote_changes(self, changes: Iterable[ChangePayload]):
-        by_table: Dict[str, List[ChangePayload]] = defaultdict(list)
-        for c in changes:
-            by_table[c["table"]].append(c)
+        """
+        Apply a batch parent-first. A ColumnarBatch is applied straight from
+        its table blocks, without building a payload dict per change (and
+        without receive-side coalescing).
+        """
+        by_table: Dict[str, List[Any]] = defaultdict(list)
+        if isinstance(changes, ColumnarBatch):
+            for block in changes.blocks:
+                by_table[block.table].append(block)
+        else:
+            if self.coalesce:
+                changes = coalesce_changes(list(changes))
+            for c in changes:
+                by_table[c["table"]].append(c)
+        if self.bulk_apply:
+            # Core statements do not see pending ORM state
+            self.sess.flush()
         for table in self.order:
-            for c in by_table.get(table, []):
-                self._apply_one(c)
+            if table not in by_table:
+                continue
+            if self.bulk_apply:
+                self._apply_table_bulk(table, list(self._value_items(by_table[table])))
+                continue
+            for item in self._value_items(by_table[table]):
+                self._apply_values(table, *item)
         # Flush after all changes in a batch to ensure new objects are tracked
         self.sess.flush()
 
@@ -187,35 +648,359 @@ class SyncEngine:
             self.sess.commit()
         return st
 
-    def pull_then_push(self, peer_transport, batch: int = 1000) -> Tuple[int, int]:
-        # Set the current node_id for change logging
-        set_current_node_id(self.node_id)
+    def _group_due(self, rows: int) -> bool:
+        """
+        Account a batch against the group-commit budgets; True if one is
+        spent. A 0/None budget is unbounded; with neither set every batch
+        commits on its own.
+        """
+        if self._group_started is None:
+            self._group_started = time.monotonic()
+        self._group_rows += rows
+        max_rows, max_seconds = self.group_commit_rows, self.group_commit_seconds
+        if not max_rows and not max_seconds:
+            return True
+        if max_rows and self._group_rows >= max_rows:
+            return True
+        return bool(
+            max_seconds and time.monotonic() - self._group_started >= max_seconds
+        )
+
+    def _commit_group(self, st: SyncState, peer_transport=None) -> None:
+        """Commit pending batches and, after a pull, ack the durable watermark."""
+        if self._group_started is None:
+            return
+        self.sess.commit()
+        self._group_rows = 0
+        self._group_started = None
+        if peer_transport is not None:
+            send_ack(peer_transport, st.last_pulled_change_id, self.node_id)
+
+    def _store_pulled(self, st: SyncState, changes, last_id: int, peer_transport):
+        if self.group_commit:
+            # Data and watermark share one transaction
+            if changes:
+                self.apply_remote_changes(changes)
+            st.last_pulled_change_id = last_id
+            self.sess.add(st)
+            if self._group_due(len(changes)):
+                self._commit_group(st, peer_transport)
+            return
+        if changes:
+            self.apply_remote_changes(changes)
+            self.sess.commit()
+        st.last_pulled_change_id = last_id
+        self.sess.add(st)
+        self.sess.commit()
+        send_ack(peer_transport, st.last_pulled_change_id, self.node_id)
+
+    def _store_pushed(self, st: SyncState, last_id: int, rows: int = 0):
+        st.last_pushed_change_id = last_id
+        self.sess.add(st)
+        if self.group_commit:
+            if self._group_due(rows):
+                self._commit_group(st)
+            return
+        self.sess.commit()
+
+    @staticmethod
+    def _limit(ctl: AdaptiveBatchSize | None, batch: int) -> int:
+        return ctl.size if ctl is not None else batch
+
+    @staticmethod
+    def _observe(ctl: AdaptiveBatchSize | None, changes, seconds: float) -> None:
+        if ctl is not None and changes:
+            ctl.observe(len(changes), seconds, estimate_payload_bytes(changes))
+
+    def _pull(self, peer_transport, st: SyncState, batch: int) -> int:
+        pulled = 0
+        ctl = self.pull_batching
+        while True:
+            started = time.perf_counter()
+            remote_changes = peer_transport.get_changes_since(
+                st.last_pulled_change_id,
+                limit=self._limit(ctl, batch),
+                exclude_node_id=self.node_id,
+            )
+            last_id = batch_last_id(remote_changes)
+            if last_id is None or last_id <= st.last_pulled_change_id:
+                break
+            self._store_pulled(st, remote_changes, last_id, peer_transport)
+            self._observe(ctl, remote_changes, time.perf_counter() - started)
+            pulled += len(remote_changes)
+        return pulled
+
+    def _pull_streamed(
+        self, peer_transport, st: SyncState, batch: int, stream_limit: int
+    ) -> int:
+        pulled = 0
+        while True:
+            since = st.last_pulled_change_id
+            stream = peer_transport.stream_changes_since(
+                since, limit=stream_limit, exclude_node_id=self.node_id
+            )
+            chunk: List[ChangePayload] = []
+            for change in stream:
+                chunk.append(change)
+                if len(chunk) >= batch:
+                    self._store_pulled(st, chunk, chunk[-1]["id"], peer_transport)
+                    pulled += len(chunk)
+                    chunk = []
+            if chunk:
+                self._store_pulled(st, chunk, chunk[-1]["id"], peer_transport)
+                pulled += len(chunk)
+            last_id = stream.last_id
+            if last_id is None or last_id <= since:
+                break
+            if last_id > st.last_pulled_change_id:
+                # Trailing entries were coalesced away at the source
+                self._store_pulled(st, [], last_id, peer_transport)
+        return pulled
+
+    def _pull_pipelined(
+        self, peer_transport, st: SyncState, batch: int, depth: int
+    ) -> int:
+        """
+        Pull with a background fetcher that runs up to ``depth`` batches ahead.
+
+        Batches are applied and watermarks advanced on the calling thread in
+        fetch order; only the transport is used from the fetcher thread.
+        """
+        batches: queue.Queue = queue.Queue(maxsize=depth)
+        stop = threading.Event()
+        done = object()
+        ctl = self.pull_batching
+
+        def put(item) -> None:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def fetch(since: int) -> None:
+            try:
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    changes = peer_transport.get_changes_since(
+                        since,
+                        limit=self._limit(ctl, batch),
+                        exclude_node_id=self.node_id,
+                    )
+                    fetch_seconds = time.perf_counter() - started
+                    last_id = batch_last_id(changes)
+                    if last_id is None or last_id <= since:
+                        break
+                    put((changes, last_id, fetch_seconds))
+                    since = last_id
+            except BaseException as e:
+                put(e)
+            finally:
+                put(done)
+
+        fetcher = threading.Thread(
+            target=fetch,
+            args=(st.last_pulled_change_id,),
+            name="sync-pull-prefetch",
+            daemon=True,
+        )
+        fetcher.start()
+        pulled = 0
         try:
-            st = self._ensure_state()
-            pulled = 0
             while True:
-                remote_changes = peer_transport.get_changes_since(
-                    st.last_pulled_change_id, limit=batch, exclude_node_id=self.node_id
+                item = batches.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                changes, last_id, fetch_seconds = item
+                started = time.perf_counter()
+                self._store_pulled(st, changes, last_id, peer_transport)
+                self._observe(
+                    ctl, changes, fetch_seconds + time.perf_counter() - started
                 )
-                if not remote_changes:
+                pulled += len(changes)
+        finally:
+            stop.set()
+            fetcher.join()
+        return pulled
+
+    def _push(self, peer_transport, st: SyncState, batch: int) -> int:
+        pushed = 0
+        ctl = self.push_batching
+        while True:
+            started = time.perf_counter()
+            out = self.local_changes_since(
+                st.last_pushed_change_id, limit=self._limit(ctl, batch)
+            )
+            if out.last_id is None:
+                break
+            if out:
+                peer_transport.apply_changes(out)
+            self._store_pushed(st, out.last_id, len(out))
+            self._observe(ctl, out, time.perf_counter() - started)
+            pushed += len(out)
+        return pushed
+
+    def _push_streamed(
+        self, peer_transport, st: SyncState, stream_limit: int, chunk_size: int
+    ) -> int:
+        pushed = 0
+        while True:
+            out = self.stream_local_changes_since(
+                st.last_pushed_change_id, limit=stream_limit, chunk_size=chunk_size
+            )
+            # Peek so an exhausted log doesn't cost an empty request
+            changes = iter(out)
+            first = next(changes, None)
+            if first is None:
+                if out.last_id is None:
                     break
-                self.apply_remote_changes(remote_changes)
-                self.sess.commit()
-                st.last_pulled_change_id = remote_changes[-1]["id"]
-                self.sess.add(st)
-                self.sess.commit()
-                peer_transport.ack(st.last_pulled_change_id)
-                pulled += len(remote_changes)
-            pushed = 0
+                self._store_pushed(st, out.last_id)
+                continue
+            sent = 0
+
+            def counted(first=first, changes=changes, out=out):
+                nonlocal sent
+                for change in itertools.chain([first], changes):
+                    sent += 1
+                    yield change
+                return out.last_id
+
+            peer_transport.stream_apply_changes(ChangeStream(counted()))
+            self._store_pushed(st, out.last_id, sent)
+            pushed += sent
+        return pushed
+
+    @staticmethod
+    def _timed(fn, *args) -> float:
+        started = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - started
+
+    def _push_pipelined(
+        self, peer_transport, st: SyncState, batch: int, depth: int
+    ) -> int:
+        """
+        Push while serializing ahead: up to ``depth`` batches are in flight.
+
+        POSTs are sent one at a time, in order, from a single worker thread;
+        the watermark only advances once a batch's POST has succeeded. After
+        a POST fails, batches queued behind it are not sent.
+        """
+        pushed = 0
+        since = st.last_pushed_change_id
+        in_flight: Deque[Tuple[Future | None, ChangeBatch, float]] = deque()
+        failed = threading.Event()
+
+        def send(out: ChangeBatch) -> float:
+            if failed.is_set():
+                raise CancelledError()
+            try:
+                return self._timed(peer_transport.apply_changes, out)
+            except BaseException:
+                failed.set()
+                raise
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="sync-push") as pool:
+            try:
+                while True:
+                    started = time.perf_counter()
+                    out = self.local_changes_since(
+                        since, limit=self._limit(self.push_batching, batch)
+                    )
+                    if out.last_id is None:
+                        break
+                    fut = pool.submit(send, out) if out else None
+                    in_flight.append((fut, out, time.perf_counter() - started))
+                    since = out.last_id
+                    while len(in_flight) > depth:
+                        pushed += self._finish_push(st, *in_flight.popleft())
+                while in_flight:
+                    pushed += self._finish_push(st, *in_flight.popleft())
+            except BaseException:
+                for fut, _, _ in in_flight:
+                    if fut is not None:
+                        fut.cancel()
+                raise
+        return pushed
+
+    def _finish_push(
+        self,
+        st: SyncState,
+        fut: Future | None,
+        out: ChangeBatch,
+        serialize_seconds: float,
+    ) -> int:
+        send_seconds = fut.result() if fut is not None else 0.0
+        self._store_pushed(st, out.last_id, len(out))  # type: ignore[arg-type]
+        self._observe(self.push_batching, out, serialize_seconds + send_seconds)
+        return len(out)
+
+    def wait_for_changes(self, peer_transport, timeout: float = 30.0) -> bool:
+        """
+        Block until the peer has changes past our pull watermark (other than
+        our own), or ``timeout`` expires. Use instead of polling
+        ``pull_then_push`` on a timer::
+
             while True:
-                out = self.local_changes_since(st.last_pushed_change_id, limit=batch)
-                if not out:
-                    break
-                peer_transport.apply_changes(out)
-                st.last_pushed_change_id = out[-1]["id"]
-                self.sess.add(st)
-                self.sess.commit()
-                pushed += len(out)
+                if engine.wait_for_changes(transport):
+                    engine.pull_then_push(transport)
+        """
+        since = self._ensure_state().last_pulled_change_id
+        return peer_transport.wait_for_changes(
+            since, exclude_node_id=self.node_id, timeout=timeout
+        )
+
+    def pull_then_push(
+        self,
+        peer_transport,
+        batch: int = 1000,
+        prefetch: int = 0,
+        stream_limit: int | None = None,
+    ) -> Tuple[int, int]:
+        """
+        Pull remote changes, then push local ones, in batches of ``batch``
+        (or of the adaptive sizes, when the engine has ``adaptive_batching``).
+
+        With ``prefetch > 0`` both phases are pipelined: up to ``prefetch``
+        batches are fetched ahead of the one being applied, and local batches
+        are serialized while earlier ones are still being sent. The transport
+        is then called from a worker thread and must tolerate that.
+
+        With ``group_commit`` each pulled batch commits together with its
+        watermark, and consecutive batches share one commit until
+        ``group_commit_rows`` rows or ``group_commit_seconds`` have
+        accumulated (whichever of the two is set; 0 or None leaves that
+        budget unbounded). Acks are only sent for committed watermarks.
+
+        With ``stream_limit`` the pull asks for up to that many changes per
+        request through ``peer_transport.stream_changes_since`` and applies
+        them in sub-batches of ``batch`` as they arrive, advancing the
+        watermark after each one. The push streams up to ``stream_limit``
+        local changes per request through ``peer_transport.stream_apply_changes``,
+        reading them from a server-side cursor ``batch`` at a time. Meant for
+        bootstraps and long-offline clients.
+        """
+        # Set the current node_id for change logging
+        set_current_node_id(self.node_id)
+        try:
+            st = self._ensure_state()
+            self._group_rows, self._group_started = 0, None
+            if stream_limit:
+                pulled = self._pull_streamed(peer_transport, st, batch, stream_limit)
+                self._commit_group(st, peer_transport)
+                pushed = self._push_streamed(peer_transport, st, stream_limit, batch)
+            elif prefetch > 0:
+                pulled = self._pull_pipelined(peer_transport, st, batch, prefetch)
+                self._commit_group(st, peer_transport)
+                pushed = self._push_pipelined(peer_transport, st, batch, prefetch)
+            else:
+                pulled = self._pull(peer_transport, st, batch)
+                self._commit_group(st, peer_transport)
+                pushed = self._push(peer_transport, st, batch)
+            self._commit_group(st)
             return pulled, pushed
         finally:
             # Clear the node_id context
@@ -1,6 +1,18 @@
 from __future__ import annotations
 
-from typing import Any, Callable, Iterable, Optional, Type, Dict, List, Set, Tuple
+from collections import defaultdict
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Optional,
+    Type,
+    Dict,
+    List,
+    Mapping,
+    Sequence,
+    Tuple,
+)
 
 from flask import Blueprint, request, jsonify, g
 
@@ -9,10 +21,34 @@ from sqlmodel import SQLModel, Field, select, Column as SQLModelColumn
 from sqlalchemy import event, String as SA_String, Integer as SA_Integer, JSON
 from sqlalchemy.orm import Session
 
-from data_shuttle_bridge.sql.typing_ import ChangePayload
-from data_shuttle_bridge.sql.payloads import TableSchema, apply_row
+from data_shuttle_bridge.sql.blueprints import (
+    apply_ndjson_request,
+    decode_request,
+    encode_response,
+    ndjson_response,
+    note_peer_seen,
+    wait_response,
+    wants_columnar,
+    wants_ndjson,
+)
+from data_shuttle_bridge.sql.columnar import (
+    ColumnarBatch,
+    TableBlock,
+    changes_from_wire,
+    changes_to_wire,
+)
+from data_shuttle_bridge.sql.codecs import NDJSON
+from data_shuttle_bridge.sql.compaction import record_ack
+from data_shuttle_bridge.sql.compression import (
+    DEFAULT_LEVEL,
+    DEFAULT_MAX_BODY_BYTES,
+    DEFAULT_MIN_BYTES,
+)
+from data_shuttle_bridge.sql.typing_ import ChangePayload, batch_last_id
+from data_shuttle_bridge.sql.payloads import TableSchema
 from data_shuttle_bridge.sql.schema import build_schema
-from data_shuttle_bridge.sql.sync import ConflictPolicy
+from data_shuttle_bridge.sql.sync import ConflictPolicy, SyncEngine
+from data_shuttle_bridge.sql.transport import send_ack
 from data_shuttle_bridge.sql.wiring import _summary
 
 # -------------------------------
@@ -25,6 +61,13 @@ def tenant_sync_blueprint_db_per_tenant(
     models: Iterable[Type],
     peer_id_namer: Callable[[str], str] | None = None,
     policy: ConflictPolicy = ConflictPolicy.LWW,
+    compress_min_bytes: int = DEFAULT_MIN_BYTES,
+    compress_level: int = DEFAULT_LEVEL,
+    apply_batch: int = 500,
+    commit_every: int = 0,
+    max_wait: float = 30.0,
+    wait_poll_interval: float = 5.0,
+    max_body_bytes: int | None = DEFAULT_MAX_BODY_BYTES,
 ):
     """
     A sync blueprint where each tenant has its own engine/database.
@@ -33,8 +76,11 @@ def tenant_sync_blueprint_db_per_tenant(
     - session_factory_for_tenant(tenant) -> Session
     - models: list of model classes (SQLAlchemy or SQLModel)
     - peer_id_namer: if provided, builds the peer_id used in SyncState per tenant
+    - compress_min_bytes/compress_level: pull response compression knobs
+    - apply_batch/commit_every: streamed push knobs (see apply_ndjson_request)
+    - max_wait/wait_poll_interval: /sync/wait long-poll knobs (see wait_response)
+    - max_body_bytes: largest inflated push body; larger ones get 413
     """
-    from .sync import SyncEngine  # avoid cycle
     from .wiring import attach_change_hooks_for_models
 
     bp = Blueprint("sync_mt_db", __name__)
@@ -57,25 +103,61 @@ def tenant_sync_blueprint_db_per_tenant(
     def get_changes():
         tenant = _tenant()
         eng = _engine_for(tenant)
+        note_peer_seen(eng)
         since_id = int(request.args.get("since_id", "0"))
         limit = int(request.args.get("limit", "1000"))
-        changes = eng.local_changes_since(since_id, limit=limit)
-        return jsonify({"changes": changes})
+        if wants_ndjson():
+            return ndjson_response(
+                eng.stream_local_changes_since(since_id, limit=limit),
+                compress_level=compress_level,
+            )
+        changes = eng.local_changes_since(
+            since_id, limit=limit, columnar=wants_columnar()
+        )
+        return encode_response(
+            changes_to_wire(changes),
+            compress_min_bytes=compress_min_bytes,
+            compress_level=compress_level,
+        )
 
     @bp.post("/sync/apply")
     def apply():
         tenant = _tenant()
         eng = _engine_for(tenant)
-        payload = request.get_json(force=True) or {}
-        changes: list[ChangePayload] = payload.get("changes", [])
-        eng.apply_remote_changes(changes)
+        if request.mimetype == NDJSON:
+            return jsonify(
+                apply_ndjson_request(
+                    eng,
+                    apply_batch=apply_batch,
+                    commit_every=commit_every,
+                    max_bytes=max_body_bytes,
+                )
+            )
+        eng.apply_remote_changes(changes_from_wire(decode_request(max_body_bytes)))
         eng.sess.commit()
         return jsonify({"ok": True})
 
+    @bp.get("/sync/wait")
+    def wait():
+        eng = _engine_for(_tenant())
+        note_peer_seen(eng)
+        return wait_response(
+            eng,
+            max_wait=max_wait,
+            poll_interval=wait_poll_interval,
+        )
+
     @bp.post("/sync/ack")
     def ack():
-        # no-op; kept for API symmetry
-        return jsonify({"ok": True})
+        payload = request.get_json(force=True) or {}
+        if not payload.get("node_id"):
+            return jsonify({"error": "node_id is required"}), 400
+        tenant = _tenant()
+        eng = _engine_for(tenant)
+        last_seen = int(payload.get("last_seen", 0))
+        stored = record_ack(eng.sess, str(payload["node_id"]), last_seen)
+        eng.sess.commit()
+        return jsonify({"ok": True, "last_ack": stored})
 
     return bp
 
@@ -194,7 +276,7 @@ def attach_change_hooks_mt_for_models(
             )
 
 
-class SyncEngineMT:
+class SyncEngineMT(SyncEngine):
     """
     Tenant-scoped SyncEngine variant for single-DB (row-level tenancy).
     Filters change log and maintains per-tenant watermarks.
@@ -205,60 +287,17 @@ class SyncEngineMT:
         session: Session,
         tenant: str,
         peer_id: str,
-        schema: Dict[str, TableSchema],
+        schema: Mapping[str, TableSchema],
         policy: ConflictPolicy = ConflictPolicy.LWW,
+        node_id: str | None = None,
     ):
-        from .payloads import apply_row  # reuse same apply
-
-        self.sess = session
+        super().__init__(session, peer_id, schema, policy=policy, node_id=node_id)
         self.tenant = tenant
-        self.peer_id = peer_id
-        self.schema = schema
-        self.policy = policy
-        self._order = self._compute_order()
-
-    def _compute_order(self) -> List[str]:
-        deps: Dict[str, Set[str]] = {
-            name: set(ts.parents) for name, ts in self.schema.items()
-        }
-        indeg: Dict[str, int] = {name: 0 for name in deps}
-        for n in deps:
-            for p in deps[n]:
-                if p in deps:
-                    indeg[n] += 1
-        from collections import deque
-
-        q = deque([n for n, d in indeg.items() if d == 0])
-        out: List[str] = []
-        while q:
-            u = q.popleft()
-            out.append(u)
-            for v in deps:
-                if u in deps[v]:
-                    indeg[v] -= 1
-                    if indeg[v] == 0:
-                        q.append(v)
-        if len(out) != len(deps):
-            remain = [n for n in deps if n not in out]
-            out.extend(remain)
-        return out
-
-    def _serialize_change(self, ch: ChangeLogMT) -> ChangePayload:
-        ts = self.schema[ch.table]
-        data = None
-        if ch.op in ("I", "U"):
-            obj = self.sess.get(ts.model, ch.pk)
-            if obj:
-                data = {f: getattr(obj, f) for f in ts.fields}
-        return {
-            "id": ch.id,  # type: ignore
-            "table": ch.table,
-            "pk": ch.pk,
-            "op": ch.op,  # type: ignore
-            "version": ch.version,
-            "data": data,
-            "at": None,
-        }
+
+    @staticmethod
+    def _entry_at(ch: ChangeLogMT) -> str | None:
+        # change_log_mt has no timestamp column
+        return None
 
     def _ensure_state(self) -> SyncStateMT:
         st = self.sess.get(
@@ -275,33 +314,41 @@ class SyncEngineMT:
             self.sess.commit()
         return st
 
-    def local_changes_since(
-        self, since_id: int, limit: int = 1000
-    ) -> List[ChangePayload]:
-        rows = self.sess.exec(
+    def _changes_query(
+        self, since_id: int, limit: int, exclude_node_id: str | None = None
+    ):
+        # change_log_mt does not record node ids, so nothing is excluded
+        return (
             select(ChangeLogMT)
             .where(
                 (ChangeLogMT.tenant == self.tenant) & (ChangeLogMT.id > since_id)  # type: ignore
             )
             .order_by(ChangeLogMT.id.asc())
             .limit(limit)
-        ).all()
-        return [self._serialize_change(r) for r in rows]
+        )
 
-    def _apply_one(self, cp: ChangePayload):
-        ts = self.schema[cp["table"]]
+    def _apply_values(
+        self,
+        table: str,
+        pk: int,
+        op: str,
+        incoming_version: int,
+        columns: Sequence[str] | None,
+        values: Sequence[Any] | None,
+        partial: bool = False,
+    ):
+        ts = self.schema[table]
         model = ts.model
-        obj = self.sess.get(model, cp["pk"])
-        if cp["op"] == "D":
+        obj = self.sess.get(model, pk)
+        if op == "D":
             if obj:
                 self.sess.delete(obj)
             return
-        incoming_version = cp["version"]
         if obj is None:
-            obj = model(id=cp["pk"])  # type: ignore
+            obj = model(id=pk)  # type: ignore
             self.sess.add(obj)
-            if cp["data"]:
-                apply_row(obj, cp["data"])
+            if values:
+                ts.codec.apply_values(obj, columns, values)
             setattr(obj, "version", incoming_version)
             return
         current_version = getattr(obj, "version", 1)
@@ -310,17 +357,28 @@ class SyncEngineMT:
             and incoming_version <= current_version
         ):
             return
-        if cp["data"]:
-            apply_row(obj, cp["data"])
+        if values:
+            ts.codec.apply_values(obj, columns, values)
         setattr(obj, "version", max(current_version, incoming_version))
 
     def apply_remote_changes(self, changes: Iterable[ChangePayload]):
-        from collections import defaultdict
-
+        """
+        Apply a batch parent-first. A ColumnarBatch is applied from its table
+        blocks, like SyncEngine.apply_remote_changes.
+        """
+        if isinstance(changes, ColumnarBatch):
+            blocks: Dict[str, List[TableBlock]] = defaultdict(list)
+            for block in changes.blocks:
+                blocks[block.table].append(block)
+            for table in self.order:
+                for block in blocks.get(table, []):
+                    for item in block.value_items():
+                        self._apply_values(table, *item)
+            return
         by_table: Dict[str, List[ChangePayload]] = defaultdict(list)
         for c in changes:
             by_table[c["table"]].append(c)
-        for table in self._order:
+        for table in self.order:
             for c in by_table.get(table, []):
                 self._apply_one(c)
 
@@ -332,14 +390,16 @@ class SyncEngineMT:
             remote_changes = peer_transport.get_changes_since(
                 st.last_pulled_change_id, limit=batch
             )
-            if not remote_changes:
+            last_id = batch_last_id(remote_changes)
+            if last_id is None or last_id <= st.last_pulled_change_id:
                 break
-            self.apply_remote_changes(remote_changes)
-            self.sess.commit()
-            st.last_pulled_change_id = remote_changes[-1]["id"]
+            if remote_changes:
+                self.apply_remote_changes(remote_changes)
+                self.sess.commit()
+            st.last_pulled_change_id = last_id
             self.sess.add(st)
             self.sess.commit()
-            peer_transport.ack(st.last_pulled_change_id)
+            send_ack(peer_transport, st.last_pulled_change_id, self.node_id)
             pulled += len(remote_changes)
 
         pushed = 0
@@ -361,10 +421,16 @@ def tenant_sync_blueprint_row_level(
     models: Iterable[Type],
     tenant_resolver: Callable[[], str],
     policy: ConflictPolicy = ConflictPolicy.LWW,
+    compress_min_bytes: int = DEFAULT_MIN_BYTES,
+    compress_level: int = DEFAULT_LEVEL,
+    apply_batch: int = 500,
+    commit_every: int = 0,
+    max_body_bytes: int | None = DEFAULT_MAX_BODY_BYTES,
 ):
     """
     Sync blueprint for single-DB, row-level multi-tenancy.
-    Requires ChangeLogMT/SyncStateMT tables (create_all).
+    Requires ChangeLogMT/SyncStateMT tables (create_all). Pushes inflating
+    past ``max_body_bytes`` are rejected with 413.
     """
     bp = Blueprint("sync_mt_row", __name__)
     models = list(models)
@@ -387,20 +453,47 @@ def tenant_sync_blueprint_row_level(
         eng = _eng()
         since_id = int(request.args.get("since_id", "0"))
         limit = int(request.args.get("limit", "1000"))
+        if wants_ndjson():
+            return ndjson_response(
+                eng.stream_local_changes_since(since_id, limit=limit),
+                compress_level=compress_level,
+            )
         changes = eng.local_changes_since(since_id, limit=limit)
-        return jsonify({"changes": changes})
+        if wants_columnar():
+            changes = ColumnarBatch.from_changes(changes)
+        return encode_response(
+            changes_to_wire(changes),
+            compress_min_bytes=compress_min_bytes,
+            compress_level=compress_level,
+        )
 
     @bp.post("/sync/apply")
     def apply():
         eng = _eng()
-        payload = request.get_json(force=True) or {}
-        changes: list[ChangePayload] = payload.get("changes", [])
-        eng.apply_remote_changes(changes)
+        if request.mimetype == NDJSON:
+            return jsonify(
+                apply_ndjson_request(
+                    eng,
+                    apply_batch=apply_batch,
+                    commit_every=commit_every,
+                    max_bytes=max_body_bytes,
+                )
+            )
+        eng.apply_remote_changes(changes_from_wire(decode_request(max_body_bytes)))
         eng.sess.commit()
         return jsonify({"ok": True})
 
     @bp.post("/sync/ack")
     def ack():
-        return jsonify({"ok": True})
+        payload = request.get_json(force=True) or {}
+        if not payload.get("node_id"):
+            return jsonify({"error": "node_id is required"}), 400
+        eng = _eng()
+        last_seen = int(payload.get("last_seen", 0))
+        # Tenants share sync_ack here, so scope the peer id by tenant
+        peer = f"{eng.tenant}:{payload['node_id']}"
+        stored = record_ack(eng.sess, peer, last_seen)
+        eng.sess.commit()
+        return jsonify({"ok": True, "last_ack": stored})
 
     return bp
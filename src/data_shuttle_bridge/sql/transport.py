@@ -1,8 +1,56 @@
 from __future__ import annotations
 
-from typing import Iterable, List
+import functools
+import inspect
+from typing import Iterable, Iterator, List, Sequence, Tuple
 
-from data_shuttle_bridge.sql.typing_ import ChangePayload
+from data_shuttle_bridge.sql.codecs import JSON, NDJSON, get_codec
+from data_shuttle_bridge.sql.columnar import (
+    COLUMNAR,
+    ColumnarBatch,
+    changes_from_wire,
+    changes_to_wire,
+)
+from data_shuttle_bridge.sql.compression import (
+    DEFAULT_LEVEL,
+    DEFAULT_MIN_BYTES,
+    GZIP,
+    IDENTITY,
+    SUPPORTED_ENCODINGS,
+    compress_chunks,
+    maybe_compress,
+    normalize_encoding,
+)
+from data_shuttle_bridge.sql.typing_ import ChangePayload, ChangeStream
+
+# Streamed request bodies are sent in pieces of about this size
+_STREAM_FLUSH_BYTES = 64 * 1024
+# Client-side allowance on top of a long-poll's own timeout
+_WAIT_GRACE_SECONDS = 10.0
+
+
+@functools.lru_cache(maxsize=None)
+def _ack_takes_node_id(func) -> bool:
+    try:
+        params = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(
+        p.name == "node_id" or p.kind is inspect.Parameter.VAR_KEYWORD for p in params
+    )
+
+
+def send_ack(transport, last_seen_change_id: int, node_id: str | None = None):
+    """
+    Call ``transport.ack``, passing ``node_id`` only when its ``ack`` accepts
+    it, so transports written against the older ``ack(last_seen_change_id)``
+    signature keep working. Returns whatever ``ack`` returns (a coroutine for
+    async transports).
+    """
+    ack = transport.ack
+    if node_id is not None and _ack_takes_node_id(getattr(ack, "__func__", ack)):
+        return ack(last_seen_change_id, node_id=node_id)
+    return ack(last_seen_change_id)
 
 
 class PeerTransport:
@@ -11,12 +59,45 @@ class PeerTransport:
     ) -> List[ChangePayload]:
         raise NotImplementedError
 
+    def stream_changes_since(
+        self, since_id: int, limit: int = 1000, exclude_node_id: str | None = None
+    ) -> ChangeStream:
+        """
+        Changes as a stream that can be applied while it is still arriving.
+        Falls back to one get_changes_since batch.
+        """
+        return ChangeStream.from_batch(
+            self.get_changes_since(
+                since_id, limit=limit, exclude_node_id=exclude_node_id
+            )  # type: ignore[call-arg]
+        )
+
     def apply_changes(self, changes: Iterable[ChangePayload]) -> None:
         raise NotImplementedError
 
-    def ack(self, last_seen_change_id: int) -> None:
+    def stream_apply_changes(self, changes: Iterable[ChangePayload]) -> None:
+        """
+        Push changes produced lazily (e.g. a ChangeStream), consuming them
+        while sending. Falls back to one apply_changes call.
+        """
+        self.apply_changes(list(changes))
+
+    def ack(self, last_seen_change_id: int, node_id: str | None = None) -> None:
         pass
 
+    def wait_for_changes(
+        self,
+        since_id: int,
+        exclude_node_id: str | None = None,
+        timeout: float = 30.0,
+    ) -> bool:
+        """
+        Block until the peer has changes above ``since_id`` (other than
+        ``exclude_node_id``'s) or ``timeout`` expires. Transports that can't
+        wait report that there may be changes.
+        """
+        return True
+
 
 class InMemoryPeerTransport(PeerTransport):
     def __init__(self, changes: list[ChangePayload] | None = None):
@@ -31,12 +112,137 @@ class InMemoryPeerTransport(PeerTransport):
         self._changes.extend(list(changes))
 
 
-class HttpPeerTransport(PeerTransport):
-    def __init__(self, base_url: str, session=None):
+class _HttpWire:
+    """Codec and compression negotiation shared by the HTTP transports."""
+
+    def _init_wire(
+        self,
+        content_type: str,
+        compression: str | None,
+        compress_min_bytes: int,
+        compress_level: int,
+        columnar: bool = False,
+    ) -> None:
+        if compression is not None and compression not in SUPPORTED_ENCODINGS:
+            raise ValueError(f"unsupported compression {compression!r}")
+        self.codec = get_codec(content_type)
+        self.compression = compression
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+        self.columnar = columnar
+        # Encodings the server accepts for pushed bodies, learned from its
+        # responses. Until then pushes go out uncompressed.
+        self._server_encodings: frozenset = frozenset()
+        self._accept = (
+            f"{self.codec.content_type}, {JSON};q=0.5"
+            if self.codec.content_type != JSON
+            else JSON
+        )
+
+    def _pull_headers(self) -> dict:
+        return {
+            "Accept": self._accept,
+            "Accept-Encoding": (
+                ", ".join(SUPPORTED_ENCODINGS) if self.compression else IDENTITY
+            ),
+        }
+
+    def _learn_encodings(self, r) -> None:
+        advertised = r.headers.get("Accept-Encoding")
+        if advertised:
+            self._server_encodings = frozenset(
+                normalize_encoding(e.split(";", 1)[0]) for e in advertised.split(",")
+            )
+
+    def _read_pull(self, r) -> Sequence[ChangePayload]:
+        self._learn_encodings(r)
+        # The HTTP client has already undone any Content-Encoding
+        body = get_codec(r.headers.get("Content-Type")).decode(r.content)
+        return changes_from_wire(body, nbytes=len(r.content))
+
+    def _pull_params(
+        self, since_id: int, limit: int, exclude_node_id: str | None
+    ) -> dict:
+        params: dict = {"since_id": since_id, "limit": limit}
+        if exclude_node_id:
+            params["exclude_node_id"] = exclude_node_id
+        if self.columnar:
+            params["layout"] = COLUMNAR
+        return params
+
+    def _push_body(self, changes) -> Tuple[bytes, dict]:
+        encoding = (
+            self.compression if self.compression in self._server_encodings else None
+        )
+        if self.columnar and not isinstance(changes, ColumnarBatch):
+            changes = ColumnarBatch.from_changes(list(changes))
+        data, encoding = maybe_compress(
+            self.codec.encode(changes_to_wire(changes)),
+            encoding,
+            min_bytes=self.compress_min_bytes,
+            level=self.compress_level,
+        )
+        headers = {"Content-Type": self.codec.content_type}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return data, headers
+
+    def _push_stream(
+        self, changes: Iterable[ChangePayload]
+    ) -> Tuple[Iterator[bytes], dict]:
+        codec = get_codec(JSON)
+
+        def lines() -> Iterator[bytes]:
+            buf = bytearray()
+            for change in changes:
+                buf += codec.encode(change)
+                buf += b"\n"
+                if len(buf) >= _STREAM_FLUSH_BYTES:
+                    yield bytes(buf)
+                    buf.clear()
+            buf += codec.encode({"last_id": getattr(changes, "last_id", None)})
+            buf += b"\n"
+            yield bytes(buf)
+
+        headers = {"Content-Type": NDJSON}
+        body = lines()
+        if self.compression in self._server_encodings:
+            body = compress_chunks(body, self.compression, self.compress_level)
+            headers["Content-Encoding"] = self.compression
+        return body, headers
+
+
+class HttpPeerTransport(_HttpWire, PeerTransport):
+    """
+    Sync over HTTP. ``content_type`` selects the wire codec (see ``codecs``);
+    responses are decoded by their Content-Type, so a server without that
+    codec can still answer in JSON.
+
+    ``compression`` (gzip, deflate or None) is negotiated: pull responses are
+    requested compressed, and pushed bodies of at least ``compress_min_bytes``
+    are compressed once the server has advertised support for the encoding.
+
+    ``columnar=True`` requests and pushes batches in the columnar layout (one
+    column header per table plus positional value arrays; see ``columnar``).
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        session=None,
+        content_type: str = JSON,
+        compression: str | None = GZIP,
+        compress_min_bytes: int = DEFAULT_MIN_BYTES,
+        compress_level: int = DEFAULT_LEVEL,
+        columnar: bool = False,
+    ):
         import requests
 
         self.base_url = base_url.rstrip("/")
         self._session = session or requests.Session()
+        self._init_wire(
+            content_type, compression, compress_min_bytes, compress_level, columnar
+        )
 
     def get_changes_since(
         self,
@@ -44,23 +250,179 @@ class HttpPeerTransport(PeerTransport):
         limit: int = 1000,
         exclude_node_id: str | None = None,
     ):
-        params = {"since_id": since_id, "limit": limit}
-        if exclude_node_id:
-            params["exclude_node_id"] = exclude_node_id
+        params = self._pull_params(since_id, limit, exclude_node_id)
         r = self._session.get(
             f"{self.base_url}/sync/changes",
             params=params,
+            headers=self._pull_headers(),
         )
         r.raise_for_status()
-        return r.json()["changes"]
+        return self._read_pull(r)
+
+    def stream_changes_since(
+        self,
+        since_id: int,
+        limit: int = 1000,
+        exclude_node_id: str | None = None,
+    ) -> ChangeStream:
+        """
+        Pull as newline-delimited JSON, parsed line by line while the response
+        is still downloading. Servers that don't stream answer with a regular
+        batch, which is handled too.
+        """
+        headers = self._pull_headers()
+        headers["Accept"] = f"{NDJSON}, {self._accept};q=0.5"
+        r = self._session.get(
+            f"{self.base_url}/sync/changes",
+            params=self._pull_params(since_id, limit, exclude_node_id),
+            headers=headers,
+            stream=True,
+        )
+        r.raise_for_status()
+        content_type = (r.headers.get("Content-Type") or "").split(";", 1)[0]
+        if content_type.strip().lower() != NDJSON:
+            return ChangeStream.from_batch(self._read_pull(r))
+        self._learn_encodings(r)
+        codec = get_codec(JSON)
+
+        def gen():
+            last_id = None
+            try:
+                for line in r.iter_lines():
+                    if not line:
+                        continue
+                    record = codec.decode(line)
+                    if "table" in record:
+                        yield record
+                    else:
+                        last_id = record.get("last_id")
+            finally:
+                r.close()
+            return last_id
+
+        return ChangeStream(gen())
 
     def apply_changes(self, changes):
+        data, headers = self._push_body(changes)
         r = self._session.post(
-            f"{self.base_url}/sync/apply", json={"changes": list(changes)}
+            f"{self.base_url}/sync/apply", data=data, headers=headers
         )
         r.raise_for_status()
 
-    def ack(self, last_seen_change_id: int) -> None:
-        self._session.post(
-            f"{self.base_url}/sync/ack", json={"last_seen": last_seen_change_id}
+    def stream_apply_changes(self, changes: Iterable[ChangePayload]) -> None:
+        """
+        Push as a chunked NDJSON request body generated while it is sent, so
+        the client never holds the whole batch. The server applies it in
+        sub-batches as it arrives.
+        """
+        data, headers = self._push_stream(changes)
+        r = self._session.post(
+            f"{self.base_url}/sync/apply", data=data, headers=headers
         )
+        r.raise_for_status()
+
+    def ack(self, last_seen_change_id: int, node_id: str | None = None) -> None:
+        payload: dict = {"last_seen": last_seen_change_id}
+        if node_id:
+            payload["node_id"] = node_id
+        self._session.post(f"{self.base_url}/sync/ack", json=payload)
+
+    def wait_for_changes(
+        self,
+        since_id: int,
+        exclude_node_id: str | None = None,
+        timeout: float = 30.0,
+    ) -> bool:
+        """Long-poll /sync/wait. The server may cap ``timeout``."""
+        params: dict = {"since_id": since_id, "timeout": timeout}
+        if exclude_node_id:
+            params["exclude_node_id"] = exclude_node_id
+        r = self._session.get(
+            f"{self.base_url}/sync/wait",
+            params=params,
+            timeout=timeout + _WAIT_GRACE_SECONDS,
+        )
+        r.raise_for_status()
+        return bool(r.json().get("changes"))
+
+
+class AsyncPeerTransport:
+    async def get_changes_since(
+        self, since_id: int, limit: int = 1000, exclude_node_id: str | None = None
+    ) -> List[ChangePayload]:
+        raise NotImplementedError
+
+    async def apply_changes(self, changes: Iterable[ChangePayload]) -> None:
+        raise NotImplementedError
+
+    async def ack(self, last_seen_change_id: int, node_id: str | None = None) -> None:
+        pass
+
+
+class AsyncInMemoryPeerTransport(AsyncPeerTransport):
+    def __init__(self, changes: list[ChangePayload] | None = None):
+        self._changes = changes or []
+
+    async def get_changes_since(
+        self, since_id: int, limit: int = 1000, exclude_node_id: str | None = None
+    ) -> list[ChangePayload]:
+        return [c for c in self._changes if c["id"] > since_id][:limit]
+
+    async def apply_changes(self, changes: Iterable[ChangePayload]) -> None:
+        self._changes.extend(list(changes))
+
+
+class AsyncHttpPeerTransport(_HttpWire, AsyncPeerTransport):
+    """
+    HTTP transport for AsyncSyncEngine. Requires ``httpx``. Codec and
+    compression options are as for HttpPeerTransport.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        client=None,
+        content_type: str = JSON,
+        compression: str | None = GZIP,
+        compress_min_bytes: int = DEFAULT_MIN_BYTES,
+        compress_level: int = DEFAULT_LEVEL,
+        columnar: bool = False,
+    ):
+        import httpx
+
+        self.base_url = base_url.rstrip("/")
+        self._client = client or httpx.AsyncClient()
+        self._init_wire(
+            content_type, compression, compress_min_bytes, compress_level, columnar
+        )
+
+    async def get_changes_since(
+        self,
+        since_id: int,
+        limit: int = 1000,
+        exclude_node_id: str | None = None,
+    ):
+        params = self._pull_params(since_id, limit, exclude_node_id)
+        r = await self._client.get(
+            f"{self.base_url}/sync/changes",
+            params=params,
+            headers=self._pull_headers(),
+        )
+        r.raise_for_status()
+        return self._read_pull(r)
+
+    async def apply_changes(self, changes):
+        data, headers = self._push_body(changes)
+        r = await self._client.post(
+            f"{self.base_url}/sync/apply", content=data, headers=headers
+        )
+        r.raise_for_status()
+
+    async def ack(self, last_seen_change_id: int, node_id: str | None = None) -> None:
+        payload: dict = {"last_seen": last_seen_change_id}
+        if node_id:
+            payload["node_id"] = node_id
+        await self._client.post(f"{self.base_url}/sync/ack", json=payload)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
@@ -0,0 +1,339 @@
+"""
+Trigger-based change capture for SQLite and PostgreSQL.
+
+An alternative to ``attach_change_hooks_for_models``. The database writes
+change_log entries itself, so Core ``insert()``/``update()``, bulk operations
+and raw SQL are captured too. Don't attach ORM hooks to the same tables, or
+every change is logged twice.
+
+Triggers mirror the ORM hooks:
+
+- inserts and deletes are logged as ``I``/``D`` with the row's version
+- updates that change a data column (anything but id, updated_at, deleted_at
+  and version) are logged as ``U``; if the statement didn't set the version
+  itself, it is bumped by one first
+- entries carry the writer's node id, which is the current
+  ``set_current_node_id`` value. On SQLite it comes from a connection
+  function, and on PostgreSQL from the ``data_shuttle_bridge.node_id``
+  transaction setting. ``enable_trigger_capture`` wires up either.
+
+On PostgreSQL, writers that don't set the node id log NULL. SQLite can't
+fall back like that: its triggers fail with "no such function: dsb_node_id"
+on a connection without the function. Once ``enable_trigger_capture`` has
+run for any SQLite engine, every SQLite connection SQLAlchemy checks out in
+that process gets the function. Other processes and non-SQLAlchemy clients
+writing to the database must call ``enable_trigger_capture`` themselves or
+register the function: ``conn.create_function("dsb_node_id", 0, lambda: None)``
+logs NULL node ids.
+
+Use ``install_change_triggers``/``uninstall_change_triggers`` directly, or
+put ``trigger_ddl``/``drop_trigger_ddl`` statements in a migration.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterable, List
+
+from sqlalchemy import Table, event
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.pool import Pool
+
+from data_shuttle_bridge.sql.notify import mark_change_logged
+from data_shuttle_bridge.sql.wiring import (
+    SUMMARY_KEYS,
+    SYSTEM_FIELDS,
+    get_current_node_id,
+    is_change_captured,
+)
+
+# SQLite function returning the writer's node id
+SQLITE_NODE_FUNCTION = "dsb_node_id"
+# PostgreSQL setting holding the writer's node id (SET LOCAL / set_config)
+PG_NODE_SETTING = "data_shuttle_bridge.node_id"
+
+_PG_CAPTURE_FUNCTION = "dsb_capture_change"
+_PG_BUMP_FUNCTION = "dsb_bump_version"
+
+# Connection-record info keys
+_SQLITE_READY_KEY = "data_shuttle_bridge.node_function"
+_PG_NODE_KEY = "data_shuttle_bridge.node_setting"
+_UNSET = object()
+
+_PG_FUNCTIONS = [
+    f"""
+CREATE OR REPLACE FUNCTION {_PG_BUMP_FUNCTION}() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.version := COALESCE(OLD.version, 0) + 1;
+    RETURN NEW;
+END $$
+""".strip(),
+    f"""
+CREATE OR REPLACE FUNCTION {_PG_CAPTURE_FUNCTION}() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    r jsonb;
+    summary json;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        r := to_jsonb(OLD);
+    ELSE
+        r := to_jsonb(NEW);
+        SELECT jsonb_object_agg(key, value)::json INTO summary
+        FROM jsonb_each(r)
+        WHERE key IN ({", ".join(f"'{k}'" for k in SUMMARY_KEYS)});
+    END IF;
+    INSERT INTO change_log ("table", pk, op, version, node_id, summary)
+    VALUES (
+        TG_TABLE_NAME,
+        (r->>'id')::bigint,
+        left(TG_OP, 1),
+        COALESCE((r->>'version')::integer, 1),
+        NULLIF(current_setting('{PG_NODE_SETTING}', true), ''),
+        summary
+    );
+    RETURN NULL;
+END $$
+""".strip(),
+]
+
+
+def _table_of(model_or_table: Any) -> Table:
+    if isinstance(model_or_table, Table):
+        return model_or_table
+    table = getattr(model_or_table, "__table__", None)
+    if table is None:
+        raise ValueError(f"Model {model_or_table} is not mapped to a table")
+    return table
+
+
+def _preparer(dialect_name: str):
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects import sqlite
+
+        return sqlite.dialect().identifier_preparer
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects import postgresql
+
+        return postgresql.dialect().identifier_preparer
+    raise ValueError(f"trigger capture is not supported on {dialect_name}")
+
+
+def _trigger_name(table: Table, what: str) -> str:
+    return f"dsb_{table.name}_{what}"
+
+
+def _data_columns(table: Table) -> List[Any]:
+    return [c for c in table.columns if c.name != "id" and c.name not in SYSTEM_FIELDS]
+
+
+def _sqlite_ddl(table: Table) -> List[str]:
+    q = _preparer("sqlite").quote
+    name = q(table.name)
+    has_version = "version" in table.c
+    summary_keys = [k for k in SUMMARY_KEYS if k in table.c]
+
+    def summary(row: str) -> str:
+        pairs = ", ".join(f"'{k}', {row}.{q(k)}" for k in summary_keys)
+        return f"json_object({pairs})"
+
+    def version(row: str) -> str:
+        return f"COALESCE({row}.version, 1)" if has_version else "1"
+
+    columns = '"table", pk, op, version, node_id, summary'
+    changed = " OR ".join(
+        f"OLD.{q(c.name)} IS NOT NEW.{q(c.name)}" for c in _data_columns(table)
+    )
+    bump = (
+        f"    UPDATE {name} SET version = COALESCE(OLD.version, 0) + 1\n"
+        f"    WHERE id = NEW.id AND NEW.version IS OLD.version;\n"
+        if has_version
+        else ""
+    )
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {q(_trigger_name(table, 'insert'))}\n"
+        f"AFTER INSERT ON {name}\n"
+        f"BEGIN\n"
+        f"    INSERT INTO change_log ({columns})\n"
+        f"    VALUES ('{table.name}', NEW.id, 'I', {version('NEW')},"
+        f" {SQLITE_NODE_FUNCTION}(), {summary('NEW')});\n"
+        f"END",
+        f"CREATE TRIGGER IF NOT EXISTS {q(_trigger_name(table, 'update'))}\n"
+        f"AFTER UPDATE ON {name}\n"
+        + (f"WHEN {changed}\n" if changed else "")
+        + f"BEGIN\n"
+        + bump
+        + f"    INSERT INTO change_log ({columns})\n"
+        f"    SELECT '{table.name}', NEW.id, 'U', {version('cur')},"
+        f" {SQLITE_NODE_FUNCTION}(), {summary('cur')}\n"
+        f"    FROM {name} AS cur WHERE cur.id = NEW.id;\n"
+        f"END",
+        f"CREATE TRIGGER IF NOT EXISTS {q(_trigger_name(table, 'delete'))}\n"
+        f"AFTER DELETE ON {name}\n"
+        f"BEGIN\n"
+        f"    INSERT INTO change_log ({columns})\n"
+        f"    VALUES ('{table.name}', OLD.id, 'D', {version('OLD')},"
+        f" {SQLITE_NODE_FUNCTION}(), NULL);\n"
+        f"END",
+    ]
+
+
+def _pg_ddl(table: Table) -> List[str]:
+    from sqlalchemy import JSON
+
+    q = _preparer("postgresql").quote
+    name = q(table.name)
+
+    def value(row: str, column) -> str:
+        # json has no equality operator; compare its text form
+        ref = f"{row}.{q(column.name)}"
+        return f"{ref}::text" if isinstance(column.type, JSON) else ref
+
+    data = _data_columns(table)
+    changed = (
+        f"(ROW({', '.join(value('OLD', c) for c in data)})"
+        f" IS DISTINCT FROM ROW({', '.join(value('NEW', c) for c in data)}))"
+        if data
+        else ""
+    )
+    statements = list(_PG_FUNCTIONS)
+    if "version" in table.c:
+        unbumped = "NEW.version IS NOT DISTINCT FROM OLD.version"
+        statements.append(
+            f"CREATE TRIGGER {q(_trigger_name(table, 'version'))}\n"
+            f"BEFORE UPDATE ON {name} FOR EACH ROW\n"
+            f"WHEN ({changed + ' AND ' if changed else ''}{unbumped})\n"
+            f"EXECUTE FUNCTION {_PG_BUMP_FUNCTION}()"
+        )
+    statements.append(
+        f"CREATE TRIGGER {q(_trigger_name(table, 'insert_delete'))}\n"
+        f"AFTER INSERT OR DELETE ON {name} FOR EACH ROW\n"
+        f"EXECUTE FUNCTION {_PG_CAPTURE_FUNCTION}()"
+    )
+    statements.append(
+        f"CREATE TRIGGER {q(_trigger_name(table, 'update'))}\n"
+        f"AFTER UPDATE ON {name} FOR EACH ROW\n"
+        + (f"WHEN {changed}\n" if changed else "")
+        + f"EXECUTE FUNCTION {_PG_CAPTURE_FUNCTION}()"
+    )
+    return statements
+
+
+def trigger_ddl(model_or_table: Any, dialect_name: str) -> List[str]:
+    """Statements creating the capture triggers (and shared functions) for a table."""
+    table = _table_of(model_or_table)
+    if dialect_name == "sqlite":
+        return _sqlite_ddl(table)
+    if dialect_name == "postgresql":
+        return _pg_ddl(table)
+    raise ValueError(f"trigger capture is not supported on {dialect_name}")
+
+
+def drop_trigger_ddl(model_or_table: Any, dialect_name: str) -> List[str]:
+    """Statements removing a table's capture triggers. Shared functions stay."""
+    table = _table_of(model_or_table)
+    q = _preparer(dialect_name).quote
+    if dialect_name == "sqlite":
+        whats = ("insert", "update", "delete")
+        return [f"DROP TRIGGER IF EXISTS {q(_trigger_name(table, w))}" for w in whats]
+    whats = ("version", "insert_delete", "update")
+    return [
+        f"DROP TRIGGER IF EXISTS {q(_trigger_name(table, w))} ON {q(table.name)}"
+        for w in whats
+    ]
+
+
+def _register_sqlite_function(dbapi_connection, connection_record, *args) -> None:
+    if connection_record.info.get(_SQLITE_READY_KEY):
+        return
+    # Registered on every pool, so skip connections that aren't SQLite's
+    create_function = getattr(dbapi_connection, "create_function", None)
+    if create_function is not None:
+        create_function(SQLITE_NODE_FUNCTION, 0, get_current_node_id)
+        connection_record.info[_SQLITE_READY_KEY] = True
+
+
+def _set_config_sql(paramstyle: str) -> str:
+    if paramstyle == "numeric_dollar":
+        return "SELECT set_config($1, $2, true)"
+    return "SELECT set_config(%s, %s, true)"
+
+
+def _set_pg_node(
+    conn: Connection, cursor, statement, parameters, context, executemany
+) -> None:
+    node_id = get_current_node_id()
+    if conn.info.get(_PG_NODE_KEY, _UNSET) == node_id:
+        return
+    # Transaction-local, like SET LOCAL; re-sent when the node id changes
+    cursor.execute(
+        _set_config_sql(conn.dialect.paramstyle), (PG_NODE_SETTING, node_id or "")
+    )
+    conn.info[_PG_NODE_KEY] = node_id
+
+
+def _reset_pg_node(conn: Connection) -> None:
+    conn.info.pop(_PG_NODE_KEY, None)
+
+
+_DML = ("INSERT", "UPDATE", "DELETE")
+
+
+def _mark_dml(conn: Connection, cursor, statement, parameters, context, executemany):
+    # The triggers may have written change_log entries: wake /sync/wait
+    # waiters after the commit (a spurious wake-up only costs a re-check)
+    if statement.lstrip()[:6].upper() in _DML:
+        mark_change_logged(conn)
+
+
+def enable_trigger_capture(engine: Engine) -> None:
+    """
+    Make the current node id visible to capture triggers on ``engine``'s
+    connections, and let writes through it wake /sync/wait long-polls.
+    Install once per engine in every process that writes.
+    """
+    dialect = engine.dialect.name
+    if dialect in ("sqlite", "postgresql") and not event.contains(
+        engine, "after_cursor_execute", _mark_dml
+    ):
+        event.listen(engine, "after_cursor_execute", _mark_dml)
+    if dialect == "sqlite":
+        # On every pool, so writers through other engines don't hit "no such
+        # function"; checkout rather than connect, so already pooled
+        # connections get it too
+        if not event.contains(Pool, "checkout", _register_sqlite_function):
+            event.listen(Pool, "checkout", _register_sqlite_function)
+    elif dialect == "postgresql":
+        if not event.contains(engine, "before_cursor_execute", _set_pg_node):
+            event.listen(engine, "before_cursor_execute", _set_pg_node)
+            event.listen(engine, "commit", _reset_pg_node)
+            event.listen(engine, "rollback", _reset_pg_node)
+    else:
+        raise ValueError(f"trigger capture is not supported on {dialect}")
+
+
+def install_change_triggers(engine: Engine, models: Iterable[Any]) -> None:
+    """Create (or recreate) capture triggers for ``models`` (or tables) and enable capture."""
+    tables = [_table_of(m) for m in models]
+    for table in tables:
+        if is_change_captured(table.name):
+            raise ValueError(
+                f"{table.name} already has ORM change hooks; use one capture method"
+            )
+    enable_trigger_capture(engine)
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        for table in tables:
+            # Dropping first makes reinstalling (e.g. after adding columns) safe
+            for statement in drop_trigger_ddl(table, dialect) + trigger_ddl(
+                table, dialect
+            ):
+                conn.exec_driver_sql(statement)
+
+
+def uninstall_change_triggers(engine: Engine, models: Iterable[Any]) -> None:
+    """Drop the capture triggers of ``models`` (or tables)."""
+    with engine.begin() as conn:
+        for m in models:
+            for statement in drop_trigger_ddl(m, engine.dialect.name):
+                conn.exec_driver_sql(statement)
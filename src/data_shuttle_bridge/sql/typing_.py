@@ -1,9 +1,26 @@
-from typing import TypedDict, Literal, Dict, Any
+from __future__ import annotations
+
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Sequence,
+    TypedDict,
+)
 
 Op = Literal["I", "U", "D"]
 
 
-class ChangePayload(TypedDict):
+class _ChangePayloadOptional(TypedDict, total=False):
+    # True when ``data`` holds only the columns an update changed
+    partial: bool
+
+
+class ChangePayload(_ChangePayloadOptional):
     id: int
     table: str
     pk: int
@@ -11,3 +28,59 @@ class ChangePayload(TypedDict):
     version: int
     data: Dict[str, Any] | None
     at: str | None
+
+
+class ChangeBatch(List[ChangePayload]):
+    """
+    A list of changes that also records the highest change id it covers.
+
+    Coalescing can drop the newest entries of a batch (an insert followed by a
+    delete nets out to nothing), so ``last_id`` may be above the id of the last
+    payload. Watermarks must advance to ``last_id``. Transports may record the
+    size of the batch on the wire in ``nbytes``.
+    """
+
+    def __init__(
+        self,
+        changes: Iterable[ChangePayload] = (),
+        last_id: int | None = None,
+        nbytes: int | None = None,
+    ):
+        super().__init__(changes)
+        if last_id is None and self:
+            last_id = self[-1]["id"]
+        self.last_id = last_id
+        self.nbytes = nbytes
+
+
+class ChangeStream:
+    """
+    Changes produced incrementally, e.g. from a server-side cursor or an
+    NDJSON response. Iterate it once; ``last_id`` (the watermark the stream
+    covers, as for ChangeBatch) is known only after iteration finishes.
+
+    Wraps a generator that yields payloads and returns the last id.
+    """
+
+    def __init__(self, source: Generator[ChangePayload, None, int | None]):
+        self._source = source
+        self.last_id: int | None = None
+
+    @classmethod
+    def from_batch(cls, changes: Sequence[ChangePayload]) -> "ChangeStream":
+        def gen():
+            yield from changes
+            return batch_last_id(changes)
+
+        return cls(gen())
+
+    def __iter__(self) -> Iterator[ChangePayload]:
+        self.last_id = yield from self._source
+
+
+def batch_last_id(changes: Sequence[ChangePayload]) -> int | None:
+    """Highest change id covered by a batch, or None for an empty batch."""
+    last_id = getattr(changes, "last_id", None)
+    if last_id is not None:
+        return last_id
+    return changes[-1]["id"] if changes else None
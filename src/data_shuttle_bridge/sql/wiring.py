@@ -1,28 +1,59 @@
-import threading
+from contextvars import ContextVar
 from datetime import datetime
-from typing import Type, Iterable, Optional
+from typing import Any, Dict, Type, Iterable, List, Optional, Set, Tuple
 
 from sqlmodel import SQLModel
 
 from sqlalchemy import event
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import get_history, instance_state
 
 from data_shuttle_bridge.sql.changelog import ChangeLog
+from data_shuttle_bridge.sql.notify import mark_change_logged
 
-# Thread-local storage for current node_id during sync operations
-_current_node_id: threading.local = threading.local()
+# Context-local node_id during sync operations. Each thread starts with its own
+# context, and each asyncio task gets a copy, so concurrent syncs don't clash.
+_current_node_id: ContextVar[Optional[str]] = ContextVar(
+    "current_node_id", default=None
+)
+
+# Names of tables whose models have change hooks attached
+_captured_tables: Set[str] = set()
+
+SUMMARY_KEYS = ("updated_at", "deleted_at", "version")
+
+# Bookkeeping columns; changing only these doesn't make an update worth logging
+SYSTEM_FIELDS = frozenset(SUMMARY_KEYS)
+
+# InstanceState.info key carrying before_update's dirty check to after_update
+_DIRTY_KEY = "data_shuttle_bridge.dirty"
+
+# Session.info keys for buffered capture (see configure_change_buffer)
+_BUFFER_KEY = "data_shuttle_bridge.change_buffer"
+_DEFER_KEY = "data_shuttle_bridge.defer_change_log"
+_COALESCE_KEY = "data_shuttle_bridge.coalesce_change_log"
+
+# Summary key listing the attributes an update changed (see track_fields)
+CHANGED_FIELDS_KEY = "fields"
 
 
 def set_current_node_id(node_id: Optional[str]) -> None:
     """Set the current node_id for change logging."""
-    _current_node_id.value = node_id
+    _current_node_id.set(node_id)
 
 
 def get_current_node_id() -> Optional[str]:
     """Get the current node_id for change logging."""
-    return getattr(_current_node_id, "value", None)
+    return _current_node_id.get()
 
 
-def _summary(obj, keys=("updated_at", "deleted_at", "version")):
+def is_change_captured(table_name: str) -> bool:
+    """Whether change hooks have been attached for the given table."""
+    return table_name in _captured_tables
+
+
+def _summary(obj, keys=SUMMARY_KEYS):
     out = {}
     for k in keys:
         if hasattr(obj, k):
@@ -35,37 +66,203 @@ def _summary(obj, keys=("updated_at", "deleted_at", "version")):
     return out
 
 
-def _log(connection, table: str, pk: int, op: str, version: int, summary):
-    connection.execute(
-        ChangeLog.__table__.insert().values(
-            table=table,
-            pk=pk,
-            op=op,
-            version=version,
-            summary=summary,
-            node_id=get_current_node_id(),
-        )
+def _log(
+    connection,
+    table: str,
+    pk: int,
+    op: str,
+    version: int,
+    summary,
+    session: Session | None = None,
+):
+    row = dict(
+        table=table,
+        pk=pk,
+        op=op,
+        version=version,
+        summary=summary,
+        node_id=get_current_node_id(),
     )
+    if session is not None:
+        # Buffered capture: written in one executemany by write_buffered_changes.
+        # Entries remember the (sub)transaction they were buffered in, so a
+        # savepoint rollback discards only its own.
+        transaction = session.get_nested_transaction() or session.get_transaction()
+        buffers = session.info.setdefault(_BUFFER_KEY, {})
+        buffers.setdefault(connection, []).append((transaction, row))
+        return
+    connection.execute(ChangeLog.__table__.insert().values(**row))
+    # Wakes /sync/wait long-polls once the transaction commits
+    mark_change_logged(connection)
 
 
-def attach_change_hooks(model: Type, table_name: str):
-    @event.listens_for(model, "before_update", propagate=True)
-    def _bump_version(mapper, connection, target):
-        # Check if any actual data changed (not just updated_at)
-        from sqlalchemy.orm import attributes
+def configure_change_buffer(
+    session: Session, defer_to_commit: bool = False, coalesce: bool = False
+) -> None:
+    """
+    Set how ``session`` writes entries of tables attached with ``buffered=True``.
+
+    By default they are written after each flush. With ``defer_to_commit``
+    they accumulate until the transaction commits (rolling back a savepoint
+    discards only the entries buffered inside it), and with ``coalesce`` the entries
+    for one row collapse into its net change, as SyncEngine(coalesce=True)
+    does on the wire.
+    """
+    session.info[_DEFER_KEY] = defer_to_commit
+    session.info[_COALESCE_KEY] = coalesce
+
+
+def _coalesce_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    from .sync import _net_changes  # avoid cycle
+
+    # Union of the fields a row's updates touched; None once one didn't say
+    fields: Dict[Tuple[str, int], List[str] | None] = {}
+    for r in rows:
+        if r["op"] != "U":
+            continue
+        key = (r["table"], r["pk"])
+        touched = (r["summary"] or {}).get(CHANGED_FIELDS_KEY)
+        if touched is None or fields.get(key, []) is None:
+            fields[key] = None
+        else:
+            known = fields.setdefault(key, [])
+            known.extend(f for f in touched if f not in known)
+    out = []
+    for r, op in _net_changes(rows, lambda r: (r["table"], r["pk"]), lambda r: r["op"]):
+        summary = r["summary"]
+        if summary is not None and CHANGED_FIELDS_KEY in summary:
+            summary = dict(summary)
+            touched = fields.get((r["table"], r["pk"]))
+            if op == "U" and touched is not None:
+                summary[CHANGED_FIELDS_KEY] = touched
+            else:
+                del summary[CHANGED_FIELDS_KEY]
+        out.append({**r, "op": op, "summary": summary})
+    return out
+
+
+def write_buffered_changes(session: Session) -> None:
+    """Write the change_log entries buffered on ``session``, one executemany per connection."""
+    buffers = session.info.pop(_BUFFER_KEY, None)
+    if not buffers:
+        return
+    for connection, entries in buffers.items():
+        rows = [row for _, row in entries]
+        if session.info.get(_COALESCE_KEY):
+            rows = _coalesce_rows(rows)
+        if rows:
+            connection.execute(ChangeLog.__table__.insert(), rows)
+            mark_change_logged(connection)
+
+
+@event.listens_for(Session, "after_flush")
+def _write_after_flush(session: Session, flush_context) -> None:
+    if not session.info.get(_DEFER_KEY):
+        write_buffered_changes(session)
+
 
-        # Get the session history for modified attributes
-        has_real_changes = False
-        for attr in mapper.attrs:
-            if attr.key in ("updated_at", "version", "deleted_at", "id"):
-                # Skip system fields
+@event.listens_for(Session, "before_commit")
+def _write_before_commit(session: Session) -> None:
+    # Also fires when a savepoint is released; its entries then wait for the
+    # outermost commit, or are discarded if an enclosing savepoint rolls back
+    if session.info.get(_DEFER_KEY) and session.get_nested_transaction() is None:
+        # before_commit runs ahead of the commit's own flush
+        session.flush()
+        write_buffered_changes(session)
+
+
+def _within(transaction, ancestor) -> bool:
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_buffer(session: Session, previous_transaction) -> None:
+    # Drop the entries buffered in the rolled-back transaction or any
+    # savepoint nested in it; entries of enclosing transactions stay
+    buffers = session.info.get(_BUFFER_KEY)
+    if not buffers:
+        return
+    for connection in list(buffers):
+        kept = [
+            (transaction, row)
+            for transaction, row in buffers[connection]
+            if not _within(transaction, previous_transaction)
+        ]
+        if kept:
+            buffers[connection] = kept
+        else:
+            del buffers[connection]
+
+
+def attach_change_hooks(
+    model: Type,
+    table_name: str,
+    track_fields: bool = False,
+    buffered: bool = False,
+    capture_statements: bool = False,
+):
+    """
+    Log inserts, updates and deletes of ``model`` to the change log.
+
+    With ``track_fields=True`` update entries also record which attributes
+    changed (under ``summary["fields"]``), so a SyncEngine with
+    ``delta_updates=True`` can ship only those columns.
+
+    With ``buffered=True`` entries are queued on the Session during the flush
+    and written with one executemany afterwards, instead of one INSERT per
+    row (see configure_change_buffer).
+
+    With ``capture_statements=True`` ORM bulk ``update()``/``delete()``
+    statements and inserts that bypass the unit of work (Core ``insert()``,
+    ``bulk_insert_mappings``) are logged too (see statement_capture).
+    """
+    _captured_tables.add(table_name)
+    if capture_statements:
+        from .statement_capture import capture_statements_for  # avoid cycle
+
+        capture_statements_for(table_name, track_fields=track_fields)
+    # Attribute keys (in mapper order) whose changes are detected, per mapper;
+    # the before_update hook propagates to subclasses with their own mappers
+    tracked: Dict[Any, Dict[str, int]] = {}
+
+    def _tracked(mapper) -> Dict[str, int]:
+        keys = tracked.get(mapper)
+        if keys is None:
+            keys = tracked[mapper] = {
+                attr.key: i for i, attr in enumerate(mapper.attrs) if attr.key != "id"
+            }
+        return keys
+
+    model_mapper = sa_inspect(model, raiseerr=False)
+    if model_mapper is not None:
+        _tracked(model_mapper)
+
+    def _session(target) -> Session | None:
+        return object_session(target) if buffered else None
+
+    def _dirty(mapper, target) -> Tuple[bool, List[str]]:
+        """Whether data columns changed, and which attributes changed at all."""
+        keys = _tracked(mapper)
+        changed = []
+        # Only attributes modified since load are candidates
+        for key in instance_state(target).committed_state:
+            if key not in keys:
                 continue
             # history is (added, unchanged, deleted) tuple - if added or deleted is non-empty, it changed
-            history = attributes.get_history(target, attr.key)
+            history = get_history(target, key)
             if history.added or history.deleted:
-                has_real_changes = True
-                break
+                changed.append(key)
+        changed.sort(key=keys.__getitem__)
+        return any(k not in SYSTEM_FIELDS for k in changed), changed
 
+    @event.listens_for(model, "before_update", propagate=True)
+    def _bump_version(mapper, connection, target):
+        # Check if any actual data changed (not just updated_at)
+        has_real_changes, changed = _dirty(mapper, target)
         if has_real_changes:
             cur = getattr(target, "version", 1)
             try:
@@ -73,6 +270,10 @@ def attach_change_hooks(model: Type, table_name: str):
             except Exception:
                 next_v = 1
             setattr(target, "version", next_v)
+            if "version" not in changed and "version" in _tracked(mapper):
+                changed.append("version")
+        # Handed to after_update through the instance state
+        instance_state(target).info[_DIRTY_KEY] = (has_real_changes, changed)
 
     @event.listens_for(model, "after_insert")
     def _after_insert(mapper, connection, target):
@@ -83,34 +284,27 @@ def attach_change_hooks(model: Type, table_name: str):
             "I",
             int(getattr(target, "version", 1)),
             _summary(target),
+            session=_session(target),
         )
 
     @event.listens_for(model, "after_update")
     def _after_update(mapper, connection, target):
-        # Check if any real data changed (not just updated_at)
-        from sqlalchemy.orm import attributes
-
-        # Get the session history for modified attributes
-        has_real_changes = False
-        for attr in mapper.attrs:
-            if attr.key in ("updated_at", "version", "deleted_at", "id"):
-                # Skip system fields
-                continue
-            # history is (added, unchanged, deleted) tuple - if added or deleted is non-empty, it changed
-            history = attributes.get_history(target, attr.key)
-            if history.added or history.deleted:
-                has_real_changes = True
-                break
+        dirty = instance_state(target).info.pop(_DIRTY_KEY, None)
+        has_real_changes, changed = dirty or _dirty(mapper, target)
 
-        # Only log if actual data changed
+        # Only log if actual data changed (not just updated_at)
         if has_real_changes:
+            summary = _summary(target)
+            if track_fields:
+                summary[CHANGED_FIELDS_KEY] = changed
             _log(
                 connection,
                 table_name,
                 int(getattr(target, "id")),
                 "U",
                 int(getattr(target, "version", 1)),
-                _summary(target),
+                summary,
+                session=_session(target),
             )
 
     @event.listens_for(model, "after_delete")
@@ -122,10 +316,16 @@ def attach_change_hooks(model: Type, table_name: str):
             "D",
             int(getattr(target, "version", 1)),
             None,
+            session=_session(target),
         )
 
 
-def attach_change_hooks_for_models(models: Iterable[Type]):
+def attach_change_hooks_for_models(
+    models: Iterable[Type],
+    track_fields: bool = False,
+    buffered: bool = False,
+    capture_statements: bool = False,
+):
     for m in models:
         table = getattr(m, "__table__", None)
         table_name = getattr(m, "__tablename__", None) or (
@@ -133,4 +333,10 @@ def attach_change_hooks_for_models(models: Iterable[Type]):
         )
         if not table_name:
             raise ValueError(f"Model {m} has no table mapping")
-        attach_change_hooks(m, table_name)
+        attach_change_hooks(
+            m,
+            table_name,
+            track_fields=track_fields,
+            buffered=buffered,
+            capture_statements=capture_statements,
+        )
@@ -0,0 +1,2361 @@
+"""Tests for the SQL sync engine."""
+
+import json
+import threading
+import zlib
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from typing import Optional
+
+import pytest
+from sqlalchemy import ForeignKey, Integer, String, event, func
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import Column as SQLModelColumn
+from sqlmodel import Field, Session, SQLModel, create_engine, select
+
+from data_shuttle_bridge.cli import main
+from data_shuttle_bridge.sql.batching import AdaptiveBatchSize
+from data_shuttle_bridge.sql.blueprints import sync_blueprint
+from data_shuttle_bridge.sql.changelog import (
+    ChangeLog,
+    ChangeLogArchive,
+    SyncAck,
+    SyncState,
+)
+from data_shuttle_bridge.sql.columnar import ColumnarBatch, TableBlock
+from data_shuttle_bridge.sql.compaction import compact_change_log, record_ack
+from data_shuttle_bridge.sql.ids import (
+    EPOCH_MS,
+    IdGeneratorRegistry,
+    IdLayout,
+    IdLayoutMismatch,
+    KSortedID,
+    clear_id_generator,
+    get_id_generator,
+    set_id_generator,
+)
+from data_shuttle_bridge.sql.mixins import SyncRowSQLModelMixin
+from data_shuttle_bridge.sql.notify import get_change_notifier
+from data_shuttle_bridge.sql.payloads import (
+    RowCodec,
+    TableSchema,
+    apply_row,
+    serialize_row,
+)
+from data_shuttle_bridge.sql.schema import (
+    CompiledSchema,
+    SchemaCycleError,
+    build_schema,
+)
+from data_shuttle_bridge.sql.sync import ConflictPolicy, SyncEngine, coalesce_changes
+from data_shuttle_bridge.sql import codecs, compression
+from data_shuttle_bridge.sql.async_sync import AsyncSyncEngine
+from data_shuttle_bridge.sql.transport import (
+    AsyncInMemoryPeerTransport,
+    AsyncPeerTransport,
+    HttpPeerTransport,
+    PeerTransport,
+)
+from data_shuttle_bridge.sql.triggers import (
+    drop_trigger_ddl,
+    install_change_triggers,
+    trigger_ddl,
+    uninstall_change_triggers,
+)
+from data_shuttle_bridge.sql.wiring import (
+    attach_change_hooks_for_models,
+    configure_change_buffer,
+    set_current_node_id,
+)
+
+
+class SyncCustomer(SyncRowSQLModelMixin, SQLModel, table=True):
+    __tablename__ = "sync_customers"
+    name: str = Field(sa_column=SQLModelColumn(String(255), nullable=False))
+    email: Optional[str] = Field(
+        default=None, sa_column=SQLModelColumn(String(255), nullable=True)
+    )
+
+
+class SyncOrder(SyncRowSQLModelMixin, SQLModel, table=True):
+    __tablename__ = "sync_orders"
+    customer_id: int = Field(
+        sa_column=SQLModelColumn(ForeignKey("sync_customers.id"), nullable=False)
+    )
+    status: str = Field(default="new", sa_column=SQLModelColumn(String(50)))
+    total_cents: int = Field(default=0, sa_column=SQLModelColumn(Integer))
+
+
+MODELS = [SyncCustomer, SyncOrder]
+attach_change_hooks_for_models(MODELS)
+SCHEMA = build_schema(MODELS)
+
+
+class SyncTicket(SyncRowSQLModelMixin, SQLModel, table=True):
+    __tablename__ = "sync_tickets"
+    title: str = Field(sa_column=SQLModelColumn(String(255), nullable=False))
+    status: str = Field(default="open", sa_column=SQLModelColumn(String(50)))
+    body: Optional[str] = Field(default=None, sa_column=SQLModelColumn(String(2000)))
+
+
+attach_change_hooks_for_models([SyncTicket], track_fields=True)
+TICKET_SCHEMA = build_schema([SyncTicket])
+
+
+class SyncNote(SyncRowSQLModelMixin, SQLModel, table=True):
+    __tablename__ = "sync_notes"
+    text: str = Field(default="", sa_column=SQLModelColumn(String(255)))
+    pinned: bool = Field(default=False)
+
+
+attach_change_hooks_for_models([SyncNote], track_fields=True, buffered=True)
+
+
+class SyncPart(SyncRowSQLModelMixin, SQLModel, table=True):
+    """Captured by database triggers rather than ORM hooks."""
+
+    __tablename__ = "sync_parts"
+    sku: str = Field(default="", sa_column=SQLModelColumn(String(64)))
+    qty: int = Field(default=0)
+
+
+class SyncBin(SyncRowSQLModelMixin, SQLModel, table=True):
+    __tablename__ = "sync_bins"
+    label: str = Field(default="", sa_column=SQLModelColumn(String(64)))
+    qty: int = Field(default=0)
+
+
+attach_change_hooks_for_models([SyncBin], track_fields=True, capture_statements=True)
+
+
+class EnginePeerTransport(PeerTransport):
+    """Transport that talks directly to a server-side SyncEngine."""
+
+    def __init__(self, server: SyncEngine):
+        self.server = server
+        self.acked: list[int] = []
+
+    def get_changes_since(self, since_id, limit=1000, exclude_node_id=None):
+        return self.server.remote_changes_since(
+            since_id, limit=limit, exclude_node_id=exclude_node_id
+        )
+
+    def apply_changes(self, changes):
+        self.server.apply_remote_changes(list(changes))
+        self.server.sess.commit()
+
+    def ack(self, last_seen_change_id):
+        self.acked.append(last_seen_change_id)
+
+
+def make_sessionmaker(path):
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    return sessionmaker(bind=engine, class_=Session, expire_on_commit=False)
+
+
+def count_statements(sess: Session) -> list:
+    statements: list = []
+    event.listen(
+        sess.get_bind(),
+        "before_cursor_execute",
+        lambda conn, cursor, stmt, *args: statements.append(stmt),
+    )
+    return statements
+
+
+@pytest.fixture(autouse=True)
+def id_generator():
+    set_id_generator(1)
+    yield
+    clear_id_generator()
+
+
+@pytest.fixture
+def server_session(tmp_path):
+    with make_sessionmaker(tmp_path / "server.db")() as sess:
+        yield sess
+
+
+@pytest.fixture
+def client_session(tmp_path):
+    with make_sessionmaker(tmp_path / "client.db")() as sess:
+        yield sess
+
+
+def seed_customers(sess: Session, count: int) -> list[SyncCustomer]:
+    customers = [SyncCustomer(name=f"c{i}") for i in range(count)]
+    sess.add_all(customers)
+    sess.commit()
+    return customers
+
+
+class TestSerialization:
+    """Tests for changelog serialization."""
+
+    def test_remote_changes_since_batches_row_loads(self, server_session):
+        """Row images are loaded with one query per table, not one per change."""
+        customers = seed_customers(server_session, 50)
+        server_session.add_all(
+            [SyncOrder(customer_id=c.id, total_cents=100) for c in customers]
+        )
+        server_session.commit()
+        server_session.expunge_all()
+
+        eng = SyncEngine(server_session, peer_id="client", schema=SCHEMA)
+        statements = count_statements(server_session)
+        changes = eng.remote_changes_since(0, limit=1000)
+
+        assert len(changes) == 100
+        assert len(statements) == 3  # change_log + one per table
+        assert all(c["data"] is not None for c in changes)
+        assert changes[0]["data"]["name"] == "c0"
+
+    def test_deleted_rows_serialize_without_data(self, server_session):
+        """Changes for rows that no longer exist carry no data."""
+        (customer,) = seed_customers(server_session, 1)
+        server_session.delete(customer)
+        server_session.commit()
+
+        eng = SyncEngine(server_session, peer_id="client", schema=SCHEMA)
+        changes = eng.remote_changes_since(0)
+
+        assert [c["op"] for c in changes] == ["I", "D"]
+        assert all(c["data"] is None for c in changes)
+
+
+class TestPullThenPush:
+    """End-to-end sync between two databases."""
+
+    def test_pull_then_push_roundtrip(self, server_session, client_session):
+        """Rows created on either side end up on both."""
+        seed_customers(server_session, 3)
+        server = SyncEngine(server_session, peer_id="client", schema=SCHEMA)
+        client = SyncEngine(client_session, peer_id="server", schema=SCHEMA)
+        transport = EnginePeerTransport(server)
+
+        pulled, pushed = client.pull_then_push(transport)
+        assert pulled == 3
+        assert len(client_session.exec(select(SyncCustomer)).all()) == 3
+
+        client_session.add(SyncCustomer(name="from-client"))
+        client_session.commit()
+        client.pull_then_push(transport)
+
+        names = {c.name for c in server_session.exec(select(SyncCustomer)).all()}
+        assert "from-client" in names
+        st = client_session.get(SyncState, "server")
+        assert st.last_pulled_change_id == transport.acked[-1]
+        assert st.last_pushed_change_id == max(
+            ch.id for ch in client_session.exec(select(ChangeLog)).all()
+        )
+
+
+class TestBulkApply:
+    """Tests for the set-based apply mode."""
+
+    def _changes(self, server_session):
+        customers = seed_customers(server_session, 20)
+        customers[0].name = "renamed"
+        server_session.commit()
+        eng = SyncEngine(server_session, peer_id="client", schema=SCHEMA)
+        return eng.remote_changes_since(0)
+
+    def test_bulk_matches_row_by_row(self, server_session, tmp_path):
+        """Bulk and per-row apply converge on the same rows."""
+        changes = self._changes(server_session)
+        results = []
+        for bulk in (False, True):
+            with make_sessionmaker(tmp_path / f"bulk-{bulk}.db")() as sess:
+                eng = SyncEngine(sess, peer_id="server", schema=SCHEMA, bulk_apply=bulk)
+                eng.apply_remote_changes(changes)
+                sess.commit()
+                rows = sess.exec(select(SyncCustomer).order_by(SyncCustomer.id))
+                results.append([(c.id, c.name) for c in rows])
+        assert results[0] == results[1]
+        assert len(results[1]) == 20
+        assert results[1][0][1] == "renamed"
+
+    def test_bulk_apply_uses_set_based_statements(self, server_session, tmp_path):
+        """A batch costs a handful of statements regardless of its size."""
+        changes = self._changes(server_session)
+        with make_sessionmaker(tmp_path / "client.db")() as sess:
+            eng = SyncEngine(sess, peer_id="server", schema=SCHEMA, bulk_apply=True)
+            statements = count_statements(sess)
+            eng.apply_remote_changes(changes)
+            sess.commit()
+            # prefetch, insert executemany, changelog executemany
+            assert len([s for s in statements if "sync_customers" in s]) == 2
+            logged = sess.exec(select(ChangeLog)).all()
+            assert {c.op for c in logged} == {"I"}
+            assert len(logged) == 20
+
+    def test_bulk_version_policy(self, server_session, client_session):
+        """Stale versions are skipped under the version-strict policy."""
+        (customer,) = seed_customers(server_session, 1)
+        eng = SyncEngine(
+            client_session,
+            peer_id="server",
+            schema=SCHEMA,
+            policy=ConflictPolicy.VERSION,
+            bulk_apply=True,
+        )
+        base = {
+            "id": 1,
+            "table": "sync_customers",
+            "pk": customer.id,
+            "at": None,
+        }
+        eng.apply_remote_changes(
+            [
+                {**base, "op": "I", "version": 3, "data": {"name": "v3"}},
+                {**base, "op": "U", "version": 2, "data": {"name": "v2"}},
+            ]
+        )
+        client_session.commit()
+        row = client_session.get(SyncCustomer, customer.id)
+        assert (row.name, row.version) == ("v3", 3)
+
+        eng.apply_remote_changes([{**base, "op": "D", "version": 3, "data": None}])
+        client_session.commit()
+        assert client_session.get(SyncCustomer, customer.id) is None
+
+
+class TestCoalesce:
+    """Tests for per-row change coalescing."""
+
+    def test_hot_row_collapses_to_single_change(self, server_session):
+        """Repeated updates to one row are sent once, with the final image."""
+        (customer,) = seed_customers(server_session, 1)
+        for i in range(10):
+            customer.name = f"name-{i}"
+            server_session.commit()
+
+        eng = SyncEngine(server_session, "client", SCHEMA, coalesce=True)
+        changes = eng.remote_changes_since(0)
+
+        assert len(changes) == 1
+        assert changes[0]["op"] == "I"
+        assert changes[0]["data"]["name"] == "name-9"
+        assert changes.last_id == changes[0]["id"]
+
+    def test_insert_then_delete_advances_watermark(
+        self, server_session, client_session
+    ):
+        """A batch that nets out to nothing still moves the watermark."""
+        customers = seed_customers(server_session, 2)
+        server_session.delete(customers[1])
+        server_session.commit()
+        last_id = max(c.id for c in server_session.exec(select(ChangeLog)).all())
+
+        server = SyncEngine(server_session, "client", SCHEMA, coalesce=True)
+        changes = server.remote_changes_since(0)
+        assert [c["pk"] for c in changes] == [customers[0].id]
+        assert changes.last_id == last_id
+
+        client = SyncEngine(client_session, "server", SCHEMA, coalesce=True)
+        transport = EnginePeerTransport(server)
+        pulled, _ = client.pull_then_push(transport)
+        assert pulled == 1
+        st = client_session.get(SyncState, "server")
+        assert st.last_pulled_change_id == last_id
+
+    def test_coalesce_incoming_payloads(self):
+        """Incoming batches collapse update chains and cancelled inserts."""
+        base = {"table": "t", "version": 1, "data": {}, "at": None}
+        changes = [
+            {**base, "id": 1, "pk": 10, "op": "I"},
+            {**base, "id": 2, "pk": 11, "op": "U"},
+            {**base, "id": 3, "pk": 10, "op": "U", "data": {"name": "x"}},
+            {**base, "id": 4, "pk": 11, "op": "D"},
+            {**base, "id": 5, "pk": 12, "op": "I"},
+            {**base, "id": 6, "pk": 12, "op": "D"},
+        ]
+        out = coalesce_changes(changes)
+        assert [(c["id"], c["pk"], c["op"]) for c in out] == [
+            (3, 10, "I"),
+            (4, 11, "D"),
+        ]
+        assert out[0]["data"] == {"name": "x"}
+        assert out.last_id == 6
+
+
+class TestCompaction:
+    """Tests for persisted acks and change_log compaction."""
+
+    def _hot_row(self, sess: Session) -> SyncCustomer:
+        (customer,) = seed_customers(sess, 1)
+        for i in range(4):
+            customer.name = f"name-{i}"
+            sess.commit()
+        return customer
+
+    def test_record_ack_is_monotone(self, server_session):
+        """A stale ack never lowers the stored watermark."""
+        assert record_ack(server_session, "a", 10) == 10
+        assert record_ack(server_session, "a", 5) == 10
+        server_session.commit()
+        assert server_session.get(SyncAck, "a").last_ack_change_id == 10
+
+    def test_compaction_respects_slowest_peer(self, server_session):
+        """Only entries acknowledged by every peer are removed."""
+        self._hot_row(server_session)
+        ids = [c.id for c in server_session.exec(select(ChangeLog)).all()]
+        assert compact_change_log(server_session) == 0
+
+        record_ack(server_session, "fast", ids[-1])
+        record_ack(server_session, "slow", ids[1])
+        assert compact_change_log(server_session) == 2
+        assert compact_change_log(server_session, peer_ids=["fast", "new"]) == 0
+
+        record_ack(server_session, "slow", ids[-1])
+        compact_change_log(server_session, archive=True)
+        server_session.commit()
+        remaining = server_session.exec(select(ChangeLog)).all()
+        assert [c.id for c in remaining] == [ids[-1]]
+        archived = server_session.exec(select(ChangeLogArchive)).all()
+        assert [c.id for c in archived] == ids[2:-1]
+
+    def test_late_joiner_converges_after_compaction(
+        self, server_session, client_session
+    ):
+        """The newest entry per row is kept, so a fresh client gets every row."""
+        customer = self._hot_row(server_session)
+        last = max(c.id for c in server_session.exec(select(ChangeLog)).all())
+        record_ack(server_session, "old-client", last)
+        compact_change_log(server_session)
+        server_session.commit()
+
+        server = SyncEngine(server_session, "client", SCHEMA)
+        client = SyncEngine(client_session, "server", SCHEMA)
+        client.pull_then_push(EnginePeerTransport(server))
+        assert client_session.get(SyncCustomer, customer.id).name == "name-3"
+
+    def test_ack_endpoint_persists_watermark(self, tmp_path):
+        """POST /sync/ack stores the watermark per acknowledging node."""
+        from flask import Flask
+
+        Session_ = make_sessionmaker(tmp_path / "server.db")
+        app = Flask(__name__)
+        app.register_blueprint(
+            sync_blueprint(lambda: SyncEngine(Session_(), "client", SCHEMA))
+        )
+        client = app.test_client()
+        r = client.post("/sync/ack", json={"last_seen": 42, "node_id": "7"})
+        assert r.get_json() == {"ok": True, "last_ack": 42}
+        with Session_() as sess:
+            assert sess.get(SyncAck, "7").last_ack_change_id == 42
+
+    def test_ack_endpoint_requires_node_id(self, tmp_path):
+        """An ack without a node_id is rejected instead of sharing a watermark."""
+        from flask import Flask
+
+        Session_ = make_sessionmaker(tmp_path / "server.db")
+        app = Flask(__name__)
+        app.register_blueprint(
+            sync_blueprint(lambda: SyncEngine(Session_(), "client", SCHEMA))
+        )
+        r = app.test_client().post("/sync/ack", json={"last_seen": 42})
+        assert r.status_code == 400
+        with Session_() as sess:
+            assert sess.exec(select(SyncAck)).all() == []
+
+    def test_ack_passes_node_id_when_supported(self, server_session, client_session):
+        """Transports whose ack accepts node_id receive it; older ones still work."""
+        seed_customers(server_session, 3)
+        server = SyncEngine(server_session, "client", SCHEMA)
+
+        class NodeAwareTransport(EnginePeerTransport):
+            def ack(self, last_seen_change_id, node_id=None):
+                self.acked.append((last_seen_change_id, node_id))
+
+        transport = NodeAwareTransport(server)
+        client = SyncEngine(client_session, "server", SCHEMA, node_id="9")
+        client.pull_then_push(transport)
+        assert transport.acked and all(n == "9" for _, n in transport.acked)
+
+    def test_registered_nodes_hold_back_compaction(self, server_session):
+        """A leased node that never acked counts as 0 by default."""
+        from data_shuttle_bridge.sql.registry import NodeIdAllocator
+
+        self._hot_row(server_session)
+        node = NodeIdAllocator().allocate(server_session, "device")
+        record_ack(server_session, "other", 10**9)
+        assert compact_change_log(server_session) == 0
+
+        record_ack(server_session, str(node), 10**9)
+        assert compact_change_log(server_session) == 4
+
+    def test_record_ack_survives_concurrent_first_ack(self, tmp_path, monkeypatch):
+        """A first ack racing another writer's insert updates that row instead."""
+        Session_ = make_sessionmaker(tmp_path / "server.db")
+        with Session_() as other:
+            record_ack(other, "p", 5)
+            other.commit()
+        with Session_() as sess:
+            real_get = sess.get
+            calls = iter([None])
+            monkeypatch.setattr(
+                sess, "get", lambda *a, **kw: next(calls, None) or real_get(*a, **kw)
+            )
+            assert record_ack(sess, "p", 9) == 9
+            sess.commit()
+        with Session_() as sess:
+            assert sess.get(SyncAck, "p").last_ack_change_id == 9
+
+    def test_row_level_ack_persists_watermark(self, tmp_path):
+        """The row-level tenancy blueprint stores acks per tenant and node."""
+        from flask import Flask
+
+        from data_shuttle_bridge.sql.tenancy import tenant_sync_blueprint_row_level
+
+        Session_ = make_sessionmaker(tmp_path / "server.db")
+        app = Flask(__name__)
+        app.register_blueprint(
+            tenant_sync_blueprint_row_level(Session_, [], lambda: "acme")
+        )
+        client = app.test_client()
+        assert client.post("/sync/ack", json={"last_seen": 3}).status_code == 400
+        r = client.post("/sync/ack", json={"last_seen": 42, "node_id": "7"})
+        assert r.get_json() == {"ok": True, "last_ack": 42}
+        with Session_() as sess:
+            assert sess.get(SyncAck, "acme:7").last_ack_change_id == 42
+
+    def test_cli_compact(self, tmp_path, capsys):
+        """The changelog compact subcommand runs compaction on demand."""
+        Session_ = make_sessionmaker(tmp_path / "server.db")
+        with Session_() as sess:
+            self._hot_row(sess)
+            record_ack(sess, "peer", 10**9)
+            sess.commit()
+        assert (
+            main(["changelog", "compact", "--db", f"sqlite:///{tmp_path}/server.db"])
+            == 0
+        )
+        assert "removed=4" in capsys.readouterr().out
+
+
+class TestPipelinedSync:
+    """Tests for prefetching pull and overlapping push."""
+
+    def test_pipelined_matches_serial(self, server_session, client_session):
+        """Pipelined sync moves the same rows and watermarks in order."""
+        seed_customers(server_session, 25)
+        server = SyncEngine(server_session, "client", SCHEMA)
+        client = SyncEngine(client_session, "server", SCHEMA, node_id="1")
+        transport = EnginePeerTransport(server)
+
+        pulled, _ = client.pull_then_push(transport, batch=4, prefetch=2)
+
+        assert pulled == 25
+        assert transport.acked == sorted(transport.acked)
+        assert len(transport.acked) == 7
+        assert len(client_session.exec(select(SyncCustomer)).all()) == 25
+
+        client_session.add_all([SyncCustomer(name=f"local-{i}") for i in range(9)])
+        client_session.commit()
+        _, pushed = client.pull_then_push(transport, batch=4, prefetch=2)
+        assert pushed == 9
+        names = {c.name for c in server_session.exec(select(SyncCustomer)).all()}
+        assert {f"local-{i}" for i in range(9)} <= names
+
+    def test_fetch_errors_propagate(self, client_session):
+        """A failing fetch surfaces on the calling thread without moving watermarks."""
+
+        class FailingTransport(PeerTransport):
+            def get_changes_since(self, since_id, limit=1000, exclude_node_id=None):
+                raise ConnectionError("link down")
+
+        client = SyncEngine(client_session, "server", SCHEMA)
+        with pytest.raises(ConnectionError):
+            client.pull_then_push(FailingTransport(), prefetch=2)
+        assert client_session.get(SyncState, "server").last_pulled_change_id == 0
+
+    def test_push_stops_after_failed_batch(self, client_session):
+        """Batches queued behind a failed POST are never sent."""
+        sent = []
+        release = threading.Event()
+
+        class FlakyTransport(PeerTransport):
+            def get_changes_since(self, since_id, limit=1000, exclude_node_id=None):
+                return []
+
+            def apply_changes(self, changes):
+                sent.append(changes.last_id)
+                if len(sent) == 2:
+                    # Let the caller queue the batches behind this one
+                    release.wait(1.0)
+                    raise ConnectionError("link down")
+
+        client_session.add_all([SyncCustomer(name=f"c{i}") for i in range(12)])
+        client_session.commit()
+        client = SyncEngine(client_session, "server", SCHEMA)
+        original = client.local_changes_since
+
+        def local_changes_since(since, limit=1000):
+            out = original(since, limit=limit)
+            if out.last_id is None or len(sent) >= 2:
+                release.set()
+            return out
+
+        client.local_changes_since = local_changes_since
+        with pytest.raises(ConnectionError):
+            client.pull_then_push(FlakyTransport(), batch=3, prefetch=3)
+        assert len(sent) == 2
+        st = client_session.get(SyncState, "server")
+        assert st.last_pushed_change_id == sent[0]
+
+
+class TestAsyncSync:
+    """Tests for the asyncio engine."""
+
+    def _async_sessionmaker(self, path):
+        pytest.importorskip("aiosqlite")
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from sqlmodel.ext.asyncio.session import AsyncSession
+
+        make_sessionmaker(path)  # create tables synchronously
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    def test_many_concurrent_syncs(self, tmp_path):
+        """Many clients sync concurrently on one loop, each logging its own node."""
+        import asyncio
+
+        server_factory = self._async_sessionmaker(tmp_path / "server.db")
+
+        class AsyncEnginePeerTransport(AsyncPeerTransport):
+            async def get_changes_since(
+                self, since_id, limit=1000, exclude_node_id=None
+            ):
+                async with server_factory() as sess:
+                    eng = AsyncSyncEngine(sess, "client", SCHEMA)
+                    return await eng.remote_changes_since(
+                        since_id, limit=limit, exclude_node_id=exclude_node_id
+                    )
+
+            async def apply_changes(self, changes):
+                async with server_factory() as sess:
+                    await AsyncSyncEngine(sess, "client", SCHEMA).apply_remote_changes(
+                        changes
+                    )
+                    await sess.commit()
+
+        with make_sessionmaker(tmp_path / "server.db")() as sess:
+            seed_customers(sess, 5)
+
+        async def sync_client(i: int):
+            factory = self._async_sessionmaker(tmp_path / f"client-{i}.db")
+            async with factory() as sess:
+                eng = AsyncSyncEngine(sess, "server", SCHEMA, node_id=str(i))
+                return await eng.pull_then_push(AsyncEnginePeerTransport())
+
+        async def main():
+            return await asyncio.gather(*(sync_client(i) for i in range(20)))
+
+        results = asyncio.run(main())
+        assert [pulled for pulled, _ in results] == [5] * 20
+        for i in (0, 19):
+            with make_sessionmaker(tmp_path / f"client-{i}.db")() as sess:
+                nodes = {c.node_id for c in sess.exec(select(ChangeLog)).all()}
+                assert nodes == {str(i)}
+                st = sess.get(SyncState, "server")
+                assert st.last_pulled_change_id == 5
+
+    def test_in_memory_transport(self, tmp_path):
+        """The async in-memory stand-in collects pushed changes."""
+        import asyncio
+
+        factory = self._async_sessionmaker(tmp_path / "client.db")
+        with make_sessionmaker(tmp_path / "client.db")() as sess:
+            seed_customers(sess, 3)
+
+        async def main():
+            transport = AsyncInMemoryPeerTransport()
+            async with factory() as sess:
+                eng = AsyncSyncEngine(sess, "server", SCHEMA)
+                result = await eng.pull_then_push(transport)
+            return result, transport
+
+        (pulled, pushed), transport = asyncio.run(main())
+        assert (pulled, pushed) == (0, 3)
+        assert len(asyncio.run(transport.get_changes_since(0))) == 3
+
+
+class TestAdaptiveBatching:
+    """Tests for the adaptive batch size controller."""
+
+    def test_grows_when_fast_and_shrinks_when_slow(self):
+        """Fast batches double the limit; slow ones cut it to the target."""
+        ctl = AdaptiveBatchSize(initial=1000, target_seconds=1.0, max_size=20000)
+        assert ctl.observe(1000, 0.01) == 2000
+        assert ctl.observe(2000, 0.02) == 4000
+        ctl = AdaptiveBatchSize(initial=1000, target_seconds=1.0, smoothing=1.0)
+        assert ctl.observe(1000, 4.0) == 250
+
+    def test_bytes_cap_and_bounds(self):
+        """Wide rows are capped by max_bytes, and limits stay within bounds."""
+        ctl = AdaptiveBatchSize(initial=1000, max_bytes=100_000, min_size=10)
+        assert ctl.observe(1000, 0.001, nbytes=1_000_000) == 100
+        assert ctl.observe(100, 0.001, nbytes=10_000_000) == 10
+        with pytest.raises(ValueError):
+            AdaptiveBatchSize(min_size=0)
+
+    def test_engine_adapts_limits(self, server_session, client_session):
+        """pull_then_push sends the controller's limit with each request."""
+        seed_customers(server_session, 60)
+        server = SyncEngine(server_session, "client", SCHEMA)
+        limits: list[int] = []
+
+        class RecordingTransport(EnginePeerTransport):
+            def get_changes_since(self, since_id, limit=1000, exclude_node_id=None):
+                limits.append(limit)
+                return super().get_changes_since(since_id, limit, exclude_node_id)
+
+        ctl = AdaptiveBatchSize(initial=5, min_size=5, target_seconds=60.0)
+        client = SyncEngine(client_session, "server", SCHEMA, adaptive_batching=ctl)
+        pulled, _ = client.pull_then_push(RecordingTransport(server))
+
+        assert pulled == 60
+        assert limits[:4] == [5, 10, 20, 40]
+        assert client.push_batching is not ctl
+
+
+class TestGroupCommit:
+    """Tests for grouping batch commits."""
+
+    def _sync(self, server_session, client_session, **kwargs):
+        seed_customers(server_session, 20)
+        server = SyncEngine(server_session, "client", SCHEMA)
+        client = SyncEngine(client_session, "server", SCHEMA, node_id="1", **kwargs)
+        client._ensure_state()
+        commits: list = []
+        event.listen(client_session, "after_commit", commits.append)
+        transport = EnginePeerTransport(server)
+        pulled, _ = client.pull_then_push(transport, batch=5)
+        assert pulled == 20
+        assert len(client_session.exec(select(SyncCustomer)).all()) == 20
+        return len(commits), transport.acked
+
+    def test_one_commit_per_batch(self, server_session, client_session):
+        """Data and watermark for a batch commit together."""
+        commits, acked = self._sync(server_session, client_session, group_commit=True)
+        assert commits == 4
+        assert len(acked) == 4
+
+    def test_row_budget_groups_batches(self, server_session, client_session):
+        """Consecutive batches share a commit until the row budget is spent."""
+        commits, acked = self._sync(
+            server_session,
+            client_session,
+            group_commit=True,
+            group_commit_rows=10,
+            group_commit_seconds=60.0,
+        )
+        assert commits == 2
+        assert acked == sorted(acked) and len(acked) == 2
+        st = client_session.get(SyncState, "server")
+        assert st.last_pulled_change_id == acked[-1]
+
+    def test_row_budget_alone(self, server_session, client_session):
+        """A row budget without a time budget still groups batches."""
+        commits, acked = self._sync(
+            server_session, client_session, group_commit=True, group_commit_rows=10
+        )
+        assert commits == 2 and len(acked) == 2
+
+    def test_time_budget_alone(self, server_session, client_session, monkeypatch):
+        """A time budget without a row budget groups until it elapses."""
+        clock = iter(range(0, 1000, 10))
+        monkeypatch.setattr(
+            "data_shuttle_bridge.sql.sync.time.monotonic", lambda: next(clock)
+        )
+        commits, acked = self._sync(
+            server_session, client_session, group_commit=True, group_commit_seconds=25
+        )
+        # Each batch advances the clock by 10s: batches 1-3 share a commit
+        assert commits == 2 and len(acked) == 2
+
+    def test_default_commits_twice_per_batch(self, server_session, client_session):
+        """Without group commit the historical two commits per batch remain."""
+        commits, _ = self._sync(server_session, client_session)
+        assert commits == 8
+
+
+class FlaskResponse:
+    """requests.Response look-alike over a Werkzeug test response."""
+
+    def __init__(self, resp):
+        self._resp = resp
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+        self.raw_content = resp.get_data()
+        # requests undoes Content-Encoding transparently
+        self.content = compression.decompress(
+            self.raw_content, resp.headers.get("Content-Encoding")
+        )
+
+    def iter_lines(self):
+        yield from self.content.splitlines()
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FlaskSession:
+    """requests.Session look-alike that routes to a Flask test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.requests: list = []
+        self.responses: list = []
+
+    def _path(self, url):
+        return url.split("://", 1)[-1].split("/", 1)[-1].join(["/", ""])
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        self.requests.append(("GET", headers or {}, None))
+        resp = self.client.get(self._path(url), query_string=params, headers=headers)
+        self.responses.append(FlaskResponse(resp))
+        return self.responses[-1]
+
+    def post(self, url, data=None, json=None, headers=None, **kwargs):
+        if data is not None and not isinstance(data, (bytes, str, dict)):
+            # A generator body, sent chunked by requests
+            data = b"".join(data)
+        self.requests.append(("POST", headers or {}, data))
+        resp = self.client.post(self._path(url), data=data, json=json, headers=headers)
+        self.responses.append(FlaskResponse(resp))
+        return self.responses[-1]
+
+
+def make_sync_app(session_factory, **kwargs):
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.register_blueprint(
+        sync_blueprint(
+            lambda: SyncEngine(session_factory(), "client", SCHEMA), **kwargs
+        )
+    )
+    return app
+
+
+class TestCodecs:
+    """Tests for wire codecs and content negotiation."""
+
+    VALUES = {
+        "big": 2**62 + 1,
+        "naive": datetime(2025, 3, 1, 12, 30, 15, 123456),
+        "aware": datetime(2025, 3, 1, 12, 30, tzinfo=timezone(timedelta(hours=2))),
+        "day": date(2024, 2, 29),
+        "amount": Decimal("12.340"),
+        "blob": b"\x00\x01",
+    }
+
+    def test_msgpack_roundtrip_native_types(self):
+        """The binary codec preserves int64, datetime, date, Decimal and bytes."""
+        pytest.importorskip("msgpack")
+        codec = codecs.get_codec(codecs.MSGPACK)
+        assert codec.decode(codec.encode(self.VALUES)) == self.VALUES
+
+    def test_json_fallback_and_negotiation(self):
+        """Unknown media types fall back to JSON; q-values pick the codec."""
+        codec = codecs.get_codec("text/plain")
+        assert codec.content_type == codecs.JSON
+        decoded = codec.decode(codec.encode(self.VALUES))
+        assert decoded["naive"] == "2025-03-01T12:30:15.123456"
+        assert codecs.negotiate(None).content_type == codecs.JSON
+        assert codecs.negotiate("image/png").content_type == codecs.JSON
+        if codecs.MSGPACK in codecs.available_content_types():
+            accept = "application/json;q=0.4, application/msgpack;q=0.9"
+            assert codecs.negotiate(accept).content_type == codecs.MSGPACK
+
+    @pytest.mark.parametrize("content_type", [codecs.JSON, codecs.MSGPACK])
+    def test_http_sync_roundtrip(self, tmp_path, client_session, content_type):
+        """Pull and push over HTTP with each registered codec."""
+        if content_type not in codecs.available_content_types():
+            pytest.skip(f"{content_type} codec not available")
+        server_factory = make_sessionmaker(tmp_path / "server.db")
+        with server_factory() as sess:
+            seed_customers(sess, 3)
+        http = FlaskSession(make_sync_app(server_factory))
+        transport = HttpPeerTransport(
+            "http://server", session=http, content_type=content_type
+        )
+        client = SyncEngine(client_session, "server", SCHEMA, node_id="1")
+        pulled, _ = client.pull_then_push(transport)
+        assert pulled == 3
+        row = client_session.exec(select(SyncCustomer)).first()
+        assert isinstance(row.updated_at, datetime)
+
+        client_session.add(SyncCustomer(name="over-http"))
+        client_session.commit()
+        _, pushed = client.pull_then_push(transport)
+        assert pushed == 1
+        with server_factory() as sess:
+            names = {c.name for c in sess.exec(select(SyncCustomer)).all()}
+        assert "over-http" in names
+        assert any(
+            h.get("Content-Type") == content_type
+            for m, h, _ in http.requests
+            if m == "POST"
+        )
+
+
+class TestCompression:
+    """Tests for negotiated gzip/deflate compression of sync bodies."""
+
+    @pytest.mark.parametrize("encoding", [compression.GZIP, compression.DEFLATE])
+    def test_stream_roundtrip(self, encoding):
+        """Compressed bodies inflate correctly when fed in small chunks."""
+        data = json.dumps([{"id": i, "name": "x" * 20} for i in range(500)]).encode()
+        packed = compression.compress(data, encoding, level=9)
+        assert len(packed) < len(data) // 4
+        chunks = [packed[i : i + 100] for i in range(0, len(packed), 100)]
+        assert compression.decompress_stream(chunks, encoding) == data
+        with pytest.raises(ValueError):
+            compression.decompress_stream(chunks, encoding, max_size=1000)
+
+    def test_choose_encoding(self):
+        """Accept-Encoding q-values pick a supported encoding."""
+        assert compression.choose_encoding(None) is None
+        assert compression.choose_encoding("br") is None
+        assert compression.choose_encoding("gzip;q=0.5, deflate") == "deflate"
+        assert compression.choose_encoding("gzip, deflate;q=0") == "gzip"
+        assert compression.choose_encoding("identity, gzip;q=0") is None
+
+    def test_http_sync_compresses_both_directions(self, tmp_path, client_session):
+        """Large pulls come back compressed; large pushes are sent compressed."""
+        server_factory = make_sessionmaker(tmp_path / "server.db")
+        with server_factory() as sess:
+            seed_customers(sess, 200)
+        http = FlaskSession(make_sync_app(server_factory, compress_min_bytes=256))
+        transport = HttpPeerTransport(
+            "http://server", session=http, compress_min_bytes=256
+        )
+        client = SyncEngine(client_session, "server", SCHEMA, node_id="1")
+        pulled, _ = client.pull_then_push(transport)
+        assert pulled == 200
+        pull = http.responses[0]
+        assert pull.headers["Content-Encoding"] == "gzip"
+        assert len(pull.raw_content) * 4 < len(pull.content)
+
+        for i in range(50):
+            client_session.add(SyncCustomer(name=f"pushed-{i}"))
+        client_session.commit()
+        _, pushed = client.pull_then_push(transport)
+        assert pushed == 50
+        _, headers, body = [r for r in http.requests if r[0] == "POST"][-1]
+        assert headers["Content-Encoding"] == "gzip"
+        assert zlib.decompress(body, 16 + zlib.MAX_WBITS).startswith(b"{")
+        with server_factory() as sess:
+            assert len(sess.exec(select(SyncCustomer)).all()) == 250
+
+    def test_small_bodies_and_disabled_compression(self, tmp_path, client_session):
+        """Bodies under the threshold, or with compression off, go uncompressed."""
+        server_factory = make_sessionmaker(tmp_path / "server.db")
+        with server_factory() as sess:
+            seed_customers(sess, 2)
+        http = FlaskSession(make_sync_app(server_factory))
+        transport = HttpPeerTransport("http://server", session=http, compression=None)
+        client = SyncEngine(client_session, "server", SCHEMA, node_id="1")
+        client_session.add(SyncCustomer(name="local"))
+        client_session.commit()
+        assert client.pull_then_push(transport) == (2, 1)
+        assert all("Content-Encoding" not in r.headers for r in http.responses)
+        assert all("Content-Encoding" not in h for _, h, _ in http.requests)
+
+    def test_unsupported_request_encoding_rejected(self, tmp_path):
+        """The server answers 415 to a push in an encoding it cannot inflate."""
+        app = make_sync_app(make_sessionmaker(tmp_path / "server.db"))
+        resp = app.test_client().post(
+            "/sync/apply",
+            data=b"...",
+            headers={"Content-Type": codecs.JSON, "Content-Encoding": "br"},
+        )
+        assert resp.status_code == 415
+
+    @pytest.mark.parametrize("content_type", [codecs.JSON, codecs.NDJSON])
+    def test_oversized_inflated_push_rejected(self, tmp_path, content_type):
+        """A small compressed push that inflates past max_body_bytes gets 413."""
+        app = make_sync_app(
+            make_sessionmaker(tmp_path / "server.db"), max_body_bytes=64 * 1024
+        )
+        bomb = compression.compress(b" " * (1024 * 1024), compression.GZIP, level=9)
+        assert len(bomb) < 64 * 1024
+        resp = app.test_client().post(
+            "/sync/apply",
+            data=bomb,
+            headers={"Content-Type": content_type, "Content-Encoding": "gzip"},
+        )
+        assert resp.status_code == 413
+
+
+class TestDeltaUpdates:
+    """Tests for field-level update payloads."""
+
+    def _ticket(self, sess: Session) -> SyncTicket:
+        ticket = SyncTicket(title="printer", body="x" * 500)
+        sess.add(ticket)
+        sess.commit()
+        return ticket
+
+    def _updates(self, engine: SyncEngine) -> list:
+        return [c for c in engine.remote_changes_since(0) if c["op"] == "U"]
+
+    def test_hooks_record_changed_fields(self, server_session):
+        """Tracked tables log the changed attributes; others don't."""
+        ticket = self._ticket(server_session)
+        ticket.status = "closed"
+        server_session.commit()
+        (customer,) = seed_customers(server_session, 1)
+        customer.name = "renamed"
+        server_session.commit()
+        entries = server_session.exec(select(ChangeLog).where(ChangeLog.op == "U"))
+        summaries = {e.table: e.summary for e in entries}
+        assert "status" in summaries["sync_tickets"]["fields"]
+        assert "title" not in summaries["sync_tickets"]["fields"]
+        assert "fields" not in summaries["sync_customers"]
+
+    def test_update_ships_only_changed_columns(self, server_session, client_session):
+        """Partial payloads carry the changed columns and merge on apply."""
+        ticket = self._ticket(server_session)
+        client = SyncEngine(client_session, "server", TICKET_SCHEMA, node_id="c")
+        client.apply_remote_changes(
+            SyncEngine(server_session, "c", TICKET_SCHEMA).remote_changes_since(0)
+        )
+        client_session.commit()
+        since = server_session.exec(select(func.max(ChangeLog.id))).one()
+
+        ticket.status = "closed"
+        server_session.commit()
+        server = SyncEngine(server_session, "c", TICKET_SCHEMA, delta_updates=True)
+        (cp,) = server.remote_changes_since(since)
+        assert cp["partial"] is True
+        assert "status" in cp["data"] and "updated_at" in cp["data"]
+        assert "body" not in cp["data"] and "title" not in cp["data"]
+
+        client.apply_remote_changes([cp])
+        client_session.commit()
+        row = client_session.get(SyncTicket, ticket.id)
+        assert (row.status, row.title, row.body) == ("closed", "printer", "x" * 500)
+
+        full = SyncEngine(server_session, "c", TICKET_SCHEMA).remote_changes_since(
+            since
+        )
+        assert "partial" not in full[0] and "body" in full[0]["data"]
+
+    def test_coalesced_updates_merge_fields(self, server_session):
+        """Coalescing unions the changed columns; inserts stay full rows."""
+        ticket = self._ticket(server_session)
+        ticket.status = "pending"
+        server_session.commit()
+        ticket.title = "scanner"
+        server_session.commit()
+        server = SyncEngine(
+            server_session, "c", TICKET_SCHEMA, delta_updates=True, coalesce=True
+        )
+        (cp,) = server.remote_changes_since(0)
+        assert cp["op"] == "I" and "partial" not in cp
+
+        since = server_session.exec(select(func.min(ChangeLog.id))).one()
+        (cp,) = server.remote_changes_since(since)
+        assert cp["partial"] is True
+        assert {"status", "title"} <= set(cp["data"])
+        assert "body" not in cp["data"]
+
+    @pytest.mark.parametrize("bulk_apply", [False, True])
+    def test_partial_update_never_creates_row(self, client_session, bulk_apply):
+        """A column delta for a row the receiver lacks is skipped."""
+        client = SyncEngine(
+            client_session, "server", TICKET_SCHEMA, bulk_apply=bulk_apply
+        )
+        cp = {
+            "id": 5,
+            "table": "sync_tickets",
+            "pk": 99,
+            "op": "U",
+            "version": 2,
+            "data": {"status": "closed"},
+            "at": None,
+            "partial": True,
+        }
+        client.apply_remote_changes([cp])
+        client_session.commit()
+        assert client_session.get(SyncTicket, 99) is None
+
+    def test_compaction_promotes_deltas_to_full_rows(self, server_session):
+        """Survivors of compaction lose their field list, so late joiners get full rows."""
+        ticket = self._ticket(server_session)
+        ticket.status = "closed"
+        server_session.commit()
+        last = server_session.exec(select(func.max(ChangeLog.id))).one()
+        record_ack(server_session, "peer", last)
+        assert compact_change_log(server_session) == 1
+        server_session.commit()
+        server = SyncEngine(server_session, "c", TICKET_SCHEMA, delta_updates=True)
+        (cp,) = server.remote_changes_since(0)
+        assert "partial" not in cp and cp["data"]["body"] == "x" * 500
+
+
+class TestColumnar:
+    """Tests for the columnar batch layout."""
+
+    def _seed(self, sess: Session):
+        customers = seed_customers(sess, 10)
+        sess.add(SyncOrder(customer_id=customers[0].id, total_cents=500))
+        customers[1].email = "c1@example.com"
+        sess.commit()
+        sess.delete(customers[2])
+        sess.commit()
+
+    def test_layouts_carry_the_same_changes(self, server_session):
+        """A columnar batch reads back as the row batch, in less space."""
+        self._seed(server_session)
+        eng = SyncEngine(server_session, "client", SCHEMA)
+        rows = eng.remote_changes_since(0)
+        batch = eng.remote_changes_since(0, columnar=True)
+        assert isinstance(batch, ColumnarBatch)
+        assert batch.last_id == rows.last_id and len(batch) == len(rows)
+        key = lambda c: c["id"]
+        assert sorted(batch, key=key) == sorted(rows, key=key)
+
+        codec = codecs.get_codec(codecs.JSON)
+        wire = codec.decode(codec.encode(batch.to_wire()))
+        assert sorted(ColumnarBatch.from_wire(wire), key=key) == sorted(
+            codec.decode(codec.encode(list(rows))), key=key
+        )
+        assert len(codec.encode(batch.to_wire())) < len(codec.encode(list(rows)))
+
+    @pytest.mark.parametrize("bulk_apply", [False, True])
+    def test_apply_reads_blocks_directly(
+        self, server_session, tmp_path, monkeypatch, bulk_apply
+    ):
+        """Applying a columnar batch never builds per-change payload dicts."""
+        self._seed(server_session)
+        # Coalesce away the insert+delete pair: per-row apply can't insert a
+        # row whose image is gone
+        eng = SyncEngine(server_session, "client", SCHEMA, coalesce=True, columnar=True)
+        batch = eng.remote_changes_since(0)
+
+        def no_payloads(self, i):
+            raise AssertionError("payload dict built")
+
+        monkeypatch.setattr(TableBlock, "change", no_payloads)
+        monkeypatch.setattr(TableBlock, "data", no_payloads)
+        with make_sessionmaker(tmp_path / "client.db")() as sess:
+            client = SyncEngine(sess, "server", SCHEMA, bulk_apply=bulk_apply)
+            client.apply_remote_changes(batch)
+            sess.commit()
+            names = {c.name: c.email for c in sess.exec(select(SyncCustomer))}
+            assert len(names) == 9 and names["c1"] == "c1@example.com"
+            assert sess.exec(select(SyncOrder)).one().total_cents == 500
+
+    @pytest.mark.parametrize("bulk_apply", [False, True])
+    def test_partial_rows_use_masks(self, server_session, client_session, bulk_apply):
+        """Column deltas ride in the table's block with a per-row mask."""
+        ticket = SyncTicket(title="printer", body="long")
+        server_session.add(ticket)
+        server_session.commit()
+        ticket.status = "closed"
+        server_session.commit()
+        server = SyncEngine(
+            server_session, "c", TICKET_SCHEMA, delta_updates=True, columnar=True
+        )
+        batch = server.remote_changes_since(0)
+        (block,) = batch.blocks
+        assert block.ops == ["I", "U"] and block.masks[0] is None
+        assert "body" not in block.data(1) and block.is_partial(1)
+
+        client = SyncEngine(
+            client_session, "server", TICKET_SCHEMA, bulk_apply=bulk_apply
+        )
+        client.apply_remote_changes(ColumnarBatch.from_wire(batch.to_wire()))
+        client_session.commit()
+        row = client_session.get(SyncTicket, ticket.id)
+        assert (row.status, row.body) == ("closed", "long")
+
+    def test_http_columnar_roundtrip(self, tmp_path, client_session):
+        """Pull and push over HTTP in the columnar layout."""
+        server_factory = make_sessionmaker(tmp_path / "server.db")
+        with server_factory() as sess:
+            seed_customers(sess, 5)
+        http = FlaskSession(make_sync_app(server_factory))
+        transport = HttpPeerTransport("http://server", session=http, columnar=True)
+        client = SyncEngine(client_session, "server", SCHEMA, node_id="1")
+        client_session.add(SyncCustomer(name="local"))
+        client_session.commit()
+        assert client.pull_then_push(transport) == (5, 1)
+        assert http.responses[0].json()["format"] == "columnar"
+        _, _, body = [r for r in http.requests if r[2] is not None][0]
+        assert json.loads(body)["format"] == "columnar"
+        with server_factory() as sess:
+            assert len(sess.exec(select(SyncCustomer)).all()) == 6
+
+    def test_row_level_tenancy_applies_blocks(
+        self, server_session, client_session, monkeypatch
+    ):
+        """The row-level tenancy engine applies columnar batches block by block."""
+        from data_shuttle_bridge.sql.tenancy import SyncEngineMT
+
+        self._seed(server_session)
+        batch = SyncEngine(
+            server_session, "client", SCHEMA, coalesce=True, columnar=True
+        ).remote_changes_since(0)
+
+        def no_payloads(self, i):
+            raise AssertionError("payload dict built")
+
+        monkeypatch.setattr(TableBlock, "data", no_payloads)
+        eng = SyncEngineMT(client_session, "t1", "peer:t1", SCHEMA)
+        eng.apply_remote_changes(ColumnarBatch.from_wire(batch.to_wire()))
+        client_session.commit()
+        names = {c.name for c in client_session.exec(select(SyncCustomer))}
+        assert len(names) == 9 and "c2" not in names
+
+    def test_row_level_tenancy_serializes_own_tenant(self, server_session):
+        """The row-level tenancy engine serializes only its tenant's entries."""
+        from data_shuttle_bridge.sql.tenancy import ChangeLogMT, SyncEngineMT
+
+        first, second = seed_customers(server_session, 2)
+        server_session.add_all(
+            [
+                ChangeLogMT(
+                    tenant="t1", table="sync_customers", pk=first.id, op="I", version=1
+                ),
+                ChangeLogMT(
+                    tenant="t2", table="sync_customers", pk=second.id, op="I", version=1
+                ),
+            ]
+        )
+        server_session.commit()
+        eng = SyncEngineMT(server_session, "t1", "peer:t1", SCHEMA)
+        changes = eng.local_changes_since(0)
+        assert [(c["pk"], c["data"]["name"], c["at"]) for c in changes] == [
+            (first.id, "c0", None)
+        ]
+        assert list(eng.stream_local_changes_since(0)) == list(changes)
+
+
+class TestStreaming:
+    """Tests for streamed NDJSON pulls."""
+
+    def test_stream_matches_batch(self, server_session):
+        """The cursor-backed stream yields the batch's changes and last_id."""
+        seed_customers(server_session, 30)
+        eng = SyncEngine(server_session, "client", SCHEMA)
+        batch = eng.remote_changes_since(0, limit=25)
+        stream = eng.stream_remote_changes_since(0, limit=25, chunk_size=7)
+        assert stream.last_id is None
+        assert list(stream) == list(batch)
+        assert stream.last_id == batch.last_id
+
+    @pytest.mark.parametrize("compression", [None, "gzip"])
+    def test_http_streamed_pull(self, tmp_path, client_session, compression):
+        """A large pull streams as NDJSON and is applied in sub-batches."""
+        server_factory = make_sessionmaker(tmp_path / "server.db")
+        with server_factory() as sess:
+            seed_customers(sess, 250)
+        http = FlaskSession(make_sync_app(server_factory))
+        transport = HttpPeerTransport(
+            "http://server", session=http, compression=compression
+        )
+        acked = []
+        transport.ack = lambda last, node_id=None: acked.append(last)
+        client = SyncEngine(client_session, "server", SCHEMA, node_id="1")
+        pulled, _ = client.pull_then_push(transport, batch=100, stream_limit=10_000)
+        assert pulled == 250
+        first = http.responses[0]
+        assert first.headers["Content-Type"] == "application/x-ndjson"
+        assert first.headers.get("Content-Encoding") == compression
+        assert json.loads(first.content.splitlines()[-1]) == {"last_id": acked[-1]}
+        assert len(acked) == 3
+        assert len(client_session.exec(select(SyncCustomer)).all()) == 250
+
+    def test_stream_falls_back_to_batches(self, server_session, client_session):
+        """Transports without streaming serve stream_limit pulls as one batch."""
+        seed_customers(server_session, 12)
+        transport = EnginePeerTransport(SyncEngine(server_session, "client", SCHEMA))
+        client = SyncEngine(client_session, "server", SCHEMA, node_id="1")
+        assert client.pull_then_push(transport, batch=5, stream_limit=100) == (12, 0)
+        assert client._ensure_state().last_pulled_change_id == transport.acked[-1]
+
+
+class TestStreamingPush:
+    """Tests for streamed NDJSON pushes."""
+
+    def _spy_applies(self, monkeypatch) -> list:
+        sizes: list = []
+        original = SyncEngine.apply_remote_changes
+
+        def spy(self, changes):
+            sizes.append(len(changes))
+            return original(self, changes)
+
+        monkeypatch.setattr(SyncEngine, "apply_remote_changes", spy)
+        return sizes
+
+    @pytest.mark.parametrize("compression", [None, "gzip"])
+    def test_http_streamed_push(
+        self, tmp_path, client_session, monkeypatch, compression
+    ):
+        """A long backlog is pushed in one request and applied in sub-batches."""
+        server_factory = make_sessionmaker(tmp_path / "server.db")
+        http = FlaskSession(make_sync_app(server_factory, apply_batch=100))
+        transport = HttpPeerTransport(
+            "http://server", session=http, compression=compression
+        )
+        seed_customers(client_session, 250)
+        sizes = self._spy_applies(monkeypatch)
+        client = SyncEngine(client_session, "server", SCHEMA)
+        assert client.pull_then_push(transport, batch=40, stream_limit=10_000) == (
+            0,
+            250,
+        )
+        assert sizes == [100, 100, 50]
+        pushes = [(h, body) for m, h, body in http.requests if m == "POST" and body]
+        assert len(pushes) == 1
+        headers, body = pushes[0]
+        assert headers["Content-Type"] == "application/x-ndjson"
+        assert headers.get("Content-Encoding") == compression
+        assert http.responses[-1].json()["applied"] == 250
+        assert client._ensure_state().last_pushed_change_id > 0
+        with server_factory() as sess:
+            assert len(sess.exec(select(SyncCustomer)).all()) == 250
+
+    def test_checkpoint_commits_survive_a_broken_stream(self, tmp_path):
+        """With commit_every, sub-batches before a failure stay committed."""
+        server_factory = make_sessionmaker(tmp_path / "server.db")
+        app = make_sync_app(server_factory, apply_batch=50, commit_every=100)
+        lines = [
+            json.dumps(
+                {
+                    "id": i,
+                    "table": "sync_customers",
+                    "pk": 1000 + i,
+                    "op": "I",
+                    "version": 1,
+                    "data": {"name": f"s{i}"},
+                    "at": None,
+                }
+            )
+            for i in range(1, 231)
+        ]
+        lines[220] = "{not json"
+        resp = app.test_client().post(
+            "/sync/apply",
+            data="\n".join(lines).encode(),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert resp.status_code == 400
+        with server_factory() as sess:
+            assert len(sess.exec(select(SyncCustomer)).all()) == 200
+
+
+class TestLongPoll:
+    def test_notifier_fires_on_commit_not_flush(self, server_session):
+        """Change-log writes wake waiters only once their transaction commits."""
+        notifier = get_change_notifier()
+        seq = notifier.sequence
+        server_session.add(SyncCustomer(name="a"))
+        server_session.flush()
+        assert notifier.sequence == seq
+        server_session.rollback()
+        server_session.add(SyncCustomer(name="b"))
+        server_session.commit()
+        assert notifier.sequence != seq
+        assert notifier.wait(seq, timeout=0)
+
+    def test_core_commit_notifies(self, tmp_path):
+        """Change-log writes committed on a plain Core connection wake waiters too."""
+        from sqlalchemy import insert
+
+        from data_shuttle_bridge.sql import notify
+
+        engine = make_sessionmaker(tmp_path / "server.db").kw["bind"]
+        notifier = get_change_notifier()
+        seq = notifier.sequence
+        with engine.begin() as conn:
+            conn.execute(insert(SyncBin.__table__), [{"label": "core"}])
+        assert notifier.sequence != seq
+        assert not getattr(notify._committing, "pending", False)
+
+    def test_trigger_captured_commit_notifies(self, tmp_path):
+        """Writes to trigger-captured tables wake waiters once committed."""
+        from sqlalchemy import text
+
+        engine = make_sessionmaker(tmp_path / "server.db").kw["bind"]
+        install_change_triggers(engine, [SyncPart])
+        notifier = get_change_notifier()
+        seq = notifier.sequence
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO sync_parts (id, sku, qty, version) VALUES (1, 'a', 0, 1)"
+                )
+            )
+        assert notifier.sequence != seq
+
+    def test_wait_returns_at_once_when_changes_exist(self, tmp_path):
+        """A client behind the server's log gets an immediate answer."""
+        server_factory = make_sessionmaker(tmp_path / "server.db")
+        with server_factory() as sess:
+            seed_customers(sess, 2)
+        transport = HttpPeerTransport(
+            "http://server", session=FlaskSession(make_sync_app(server_factory))
+        )
+        assert transport.wait_for_changes(0, timeout=5) is True
+        assert transport.wait_for_changes(2, timeout=0.05) is False
+
+    def test_commit_wakes_a_waiting_client(self, tmp_path):
+        """A commit in another thread ends the long-poll well before its timeout."""
+        import threading
+        import time
+
+        server_factory = make_sessionmaker(tmp_path / "server.db")
+        transport = HttpPeerTransport(
+            "http://server",
+            session=FlaskSession(make_sync_app(server_factory, wait_poll_interval=30)),
+        )
+
+        def write():
+            set_id_generator(2)  # generators are per thread
+            time.sleep(0.2)
+            with server_factory() as sess:
+                seed_customers(sess, 1)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        started = time.monotonic()
+        assert transport.wait_for_changes(0, timeout=20) is True
+        assert time.monotonic() - started < 10
+        writer.join()
+
+    def test_wait_ignores_own_changes(self, tmp_path, client_session):
+        """Changes logged under the waiting node's id don't end the wait."""
+        server_factory = make_sessionmaker(tmp_path / "server.db")
+        transport = HttpPeerTransport(
+            "http://server", session=FlaskSession(make_sync_app(server_factory))
+        )
+        seed_customers(client_session, 3)
+        client = SyncEngine(client_session, "server", SCHEMA, node_id="client-1")
+        client.pull_then_push(transport)
+        assert client.wait_for_changes(transport, timeout=0.05) is False
+
+
+class TestRowCodecs:
+    def _codec(self):
+        import enum
+
+        from sqlalchemy import (
+            JSON,
+            Column,
+            Date,
+            DateTime,
+            Enum,
+            LargeBinary,
+            MetaData,
+            Numeric,
+            Table,
+            Time,
+        )
+
+        class Color(enum.Enum):
+            RED = "r"
+            BLUE = "b"
+
+        table = Table(
+            "codec_rows",
+            MetaData(),
+            Column("id", Integer, primary_key=True),
+            Column("note", String),
+            Column("seen", DateTime),
+            Column("day", Date),
+            Column("at", Time),
+            Column("price", Numeric(10, 2)),
+            Column("blob", LargeBinary),
+            Column("doc", JSON),
+            Column("color", Enum(Color)),
+        )
+        return RowCodec.for_table(table), Color
+
+    def test_round_trip_through_wire_codecs(self):
+        """Each column type survives the JSON and msgpack codecs with its Python type."""
+        codec, Color = self._codec()
+
+        class Row:
+            id = 1
+            note = "2024-01-02"
+            seen = datetime(2024, 1, 2, 3, 4, 5)
+            day = date(2024, 1, 2)
+            at = time(3, 4, 5)
+            price = Decimal("9.99")
+            blob = b"\x00\xff"
+            doc = {"at": "2024-01-02"}
+            color = Color.BLUE
+
+        fields = ["id", "note", "seen", "day", "at", "price", "blob", "doc", "color"]
+        for media_type in ("application/json", "application/msgpack"):
+            wire = codecs.get_codec(media_type)
+            data = wire.decode(wire.encode(codec.encode(Row, fields)))
+            decoded = codec.decode(data)
+            assert decoded == {f: getattr(Row, f) for f in fields}
+        # Date-like strings outside date columns stay strings
+        assert decoded["note"] == "2024-01-02"
+        assert decoded["doc"] == {"at": "2024-01-02"}
+
+    def test_native_values_and_nulls_pass_through(self):
+        """Values a binary codec already decoded, and NULLs, are not reparsed."""
+        codec, Color = self._codec()
+        data = {
+            "seen": datetime(2024, 1, 2),
+            "price": Decimal("1.5"),
+            "blob": b"x",
+            "day": None,
+            "color": "r",
+            "extra": 1,
+        }
+        decoded = codec.decode(
+            data, include_fields={"seen", "price", "blob", "day", "color"}
+        )
+        assert decoded == {
+            "seen": datetime(2024, 1, 2),
+            "price": Decimal("1.5"),
+            "blob": b"x",
+            "day": None,
+            "color": Color.RED,
+        }
+
+    def test_build_schema_compiles_codecs(self):
+        """build_schema gives every table a codec for its date columns."""
+        codec = SCHEMA["sync_customers"].codec
+        assert "updated_at" in codec.decoders
+        assert "name" not in codec.decoders
+
+    def test_legacy_row_helpers(self):
+        """serialize_row/apply_row still work, backed by RowCodec."""
+        row = SyncCustomer(id=1, name="2024-01-02", updated_at=datetime(2024, 1, 2))
+        data = serialize_row(row, ["name", "updated_at"])
+        wire = codecs.get_codec("application/json")
+        data = wire.decode(wire.encode(data))
+
+        target = SyncCustomer(id=2, name="x")
+        apply_row(target, data, exclude=["updated_at"])
+        assert target.name == "2024-01-02"
+        apply_row(target, data)
+        assert target.updated_at == datetime(2024, 1, 2)
+        assert isinstance(SCHEMA["sync_customers"].fields, list)
+
+
+class TestCompiledSchema:
+    def _tables(self, parents: dict) -> dict:
+        return {
+            name: TableSchema(model=object, fields=["id"], parents=ps)
+            for name, ps in parents.items()
+        }
+
+    def test_parents_first_and_self_references_ignored(self):
+        """Order puts parents first; a self-referencing table is not a cycle."""
+        schema = CompiledSchema(
+            self._tables(
+                {
+                    "lines": {"orders"},
+                    "orders": {"customers"},
+                    "customers": {"customers"},
+                }
+            )
+        )
+        assert schema.order == ("customers", "orders", "lines")
+        assert schema.cycles == ()
+
+    def test_cycle_reported(self):
+        """A foreign key cycle is warned about (or raised) with its path."""
+        tables = self._tables({"a": {"c"}, "b": {"a"}, "c": {"b"}, "root": set()})
+        with pytest.warns(UserWarning, match="foreign key cycle"):
+            schema = CompiledSchema(tables)
+        assert schema.order[0] == "root"
+        assert set(schema.order) == {"a", "b", "c", "root"}
+        cycle = schema.cycles[0]
+        assert cycle[0] == cycle[-1] and set(cycle) == {"a", "b", "c"}
+        with pytest.raises(SchemaCycleError):
+            CompiledSchema(tables, strict=True)
+
+    def test_engines_share_the_compiled_schema(self, server_session):
+        """Engines reuse build_schema's order and tables instead of recomputing."""
+        eng = SyncEngine(server_session, "peer", SCHEMA)
+        assert eng.schema is SCHEMA
+        assert list(eng.order) == ["sync_customers", "sync_orders"]
+        with pytest.raises(TypeError):
+            SCHEMA["other"] = SCHEMA["sync_customers"]  # type: ignore
+
+
+class TestChangeHooks:
+    def test_dirty_check_runs_once_per_modified_attribute(
+        self, server_session, monkeypatch
+    ):
+        """Only touched attributes are checked, and after_update reuses the result."""
+        from data_shuttle_bridge.sql import wiring
+
+        customers = seed_customers(server_session, 20)
+        calls: list = []
+        original = wiring.get_history
+        monkeypatch.setattr(
+            wiring,
+            "get_history",
+            lambda obj, key: calls.append(key) or original(obj, key),
+        )
+        for c in customers:
+            c.name = c.name + "!"
+        server_session.commit()
+        assert calls == ["name"] * 20
+        versions = {c.version for c in customers}
+        assert versions == {2}
+
+    def test_same_value_assignment_is_not_logged(self, server_session):
+        """Setting an attribute to its current value neither bumps nor logs."""
+        (customer,) = seed_customers(server_session, 1)
+        customer.name = customer.name
+        server_session.commit()
+        assert customer.version == 1
+        ops = server_session.exec(select(ChangeLog.op)).all()
+        assert ops == ["I"]
+
+
+class TestBufferedCapture:
+    def _log(self, sess: Session) -> list:
+        entries = sess.exec(
+            select(ChangeLog)
+            .where(ChangeLog.table == "sync_notes")
+            .order_by(ChangeLog.id)
+        )
+        return [(e.pk, e.op, (e.summary or {}).get("fields")) for e in entries]
+
+    def test_one_insert_per_flush(self, server_session):
+        """A flush of many rows writes their change_log entries in one executemany."""
+        statements = count_statements(server_session)
+        notes = [SyncNote(text=f"n{i}") for i in range(50)]
+        server_session.add_all(notes)
+        server_session.commit()
+        log_inserts = [s for s in statements if "INSERT INTO change_log" in s]
+        assert len(log_inserts) == 1
+        assert [pk for pk, _, _ in self._log(server_session)] == [n.id for n in notes]
+
+    def test_deferred_coalesced_entries(self, server_session):
+        """Deferred to commit, a row's entries collapse to its net change."""
+        configure_change_buffer(server_session, defer_to_commit=True, coalesce=True)
+        kept, gone = SyncNote(text="a"), SyncNote(text="b")
+        server_session.add_all([kept, gone])
+        server_session.commit()
+        server_session.add(fresh := SyncNote(text="c"))
+        server_session.flush()
+        fresh.text = "c2"
+        kept.text = "a2"
+        server_session.flush()
+        kept.pinned = True
+        server_session.delete(gone)
+        server_session.commit()
+        log = self._log(server_session)
+        assert [(pk, op) for pk, op, _ in log] == [
+            (kept.id, "I"),
+            (gone.id, "I"),
+            (fresh.id, "I"),
+            (kept.id, "U"),
+            (gone.id, "D"),
+        ]
+        assert log[2][2] is None
+        assert set(log[3][2]) == {"text", "pinned", "version"}
+        assert kept.version == 3
+
+    def test_rollback_discards_buffer(self, server_session):
+        """Entries buffered in a rolled-back transaction are never written."""
+        configure_change_buffer(server_session, defer_to_commit=True)
+        server_session.add(SyncNote(text="x"))
+        server_session.flush()
+        server_session.rollback()
+        server_session.add(SyncNote(text="y"))
+        server_session.commit()
+        assert len(self._log(server_session)) == 1
+
+    def test_savepoint_rollback_keeps_outer_entries(self, server_session):
+        """A savepoint rollback discards only the entries buffered inside it."""
+        configure_change_buffer(server_session, defer_to_commit=True)
+        committed = SyncNote(text="committed")
+        server_session.add(committed)
+        server_session.flush()
+        savepoint = server_session.begin_nested()
+        server_session.add(SyncNote(text="rolled back"))
+        server_session.flush()
+        inner = server_session.begin_nested()
+        server_session.add(SyncNote(text="inner"))
+        server_session.flush()
+        inner.commit()
+        savepoint.rollback()
+        server_session.commit()
+        notes = server_session.exec(select(SyncNote.text)).all()
+        assert notes == ["committed"]
+        assert [(pk, op) for pk, op, _ in self._log(server_session)] == [
+            (committed.id, "I")
+        ]
+
+
+class TestTriggerCapture:
+    @pytest.fixture
+    def factory(self, tmp_path):
+        factory = make_sessionmaker(tmp_path / "server.db")
+        install_change_triggers(factory.kw["bind"], [SyncPart])
+        return factory
+
+    def _log(self, sess: Session) -> list:
+        entries = sess.exec(
+            select(ChangeLog)
+            .where(ChangeLog.table == "sync_parts")
+            .order_by(ChangeLog.id)
+        )
+        return [(e.pk, e.op, e.version, e.node_id) for e in entries]
+
+    def test_core_and_raw_sql_writes_are_logged(self, factory):
+        """Bulk Core statements and raw SQL are captured with the current node id."""
+        from sqlalchemy import delete, insert, text, update
+
+        set_current_node_id("n1")
+        try:
+            with factory() as sess:
+                sess.execute(
+                    insert(SyncPart), [{"id": i, "sku": f"s{i}"} for i in (1, 2, 3)]
+                )
+                sess.execute(update(SyncPart).where(SyncPart.id <= 2).values(qty=5))
+                # Same values again: nothing changed, nothing logged
+                sess.execute(update(SyncPart).where(SyncPart.id == 1).values(qty=5))
+                sess.execute(delete(SyncPart).where(SyncPart.id == 3))
+                sess.execute(
+                    text(
+                        "INSERT INTO sync_parts (id, sku, qty, version) VALUES (4, 'raw', 0, 1)"
+                    )
+                )
+                sess.commit()
+        finally:
+            set_current_node_id(None)
+        with factory() as sess:
+            assert self._log(sess) == [
+                (1, "I", 1, "n1"),
+                (2, "I", 1, "n1"),
+                (3, "I", 1, "n1"),
+                (1, "U", 2, "n1"),
+                (2, "U", 2, "n1"),
+                (3, "D", 1, "n1"),
+                (4, "I", 1, "n1"),
+            ]
+            assert sess.get(SyncPart, 1).version == 2
+            summary = sess.exec(
+                select(ChangeLog.summary).where(ChangeLog.op == "U")
+            ).first()
+            assert summary["version"] == 2 and "updated_at" in summary
+
+    def test_explicit_version_is_kept(self, factory):
+        """An update that sets the version itself (as sync apply does) isn't bumped."""
+        with factory() as sess:
+            sess.add(SyncPart(id=1, sku="a"))
+            sess.commit()
+            part = sess.get(SyncPart, 1)
+            part.sku, part.version = "b", 7
+            sess.commit()
+            assert self._log(sess)[-1][1:3] == ("U", 7)
+            assert sess.get(SyncPart, 1).version == 7
+
+    def test_pull_from_trigger_captured_server(self, factory, client_session):
+        """Changes captured by triggers sync like hook-captured ones."""
+        from sqlalchemy import insert
+
+        with factory() as sess:
+            sess.execute(insert(SyncPart), [{"id": i, "sku": "x"} for i in range(1, 6)])
+            sess.commit()
+        schema = build_schema([SyncPart])
+        client = SyncEngine(client_session, "server", schema)
+        with factory() as sess:
+            client.apply_remote_changes(
+                SyncEngine(sess, "c", schema).remote_changes_since(0)
+            )
+        client_session.commit()
+        assert len(client_session.exec(select(SyncPart)).all()) == 5
+
+    def test_uninstall(self, factory):
+        """After uninstalling, writes are no longer logged."""
+        uninstall_change_triggers(factory.kw["bind"], [SyncPart])
+        with factory() as sess:
+            sess.add(SyncPart(id=1))
+            sess.commit()
+            assert self._log(sess) == []
+
+    def test_refuses_tables_with_orm_hooks(self, factory):
+        """Trigger and hook capture can't both log a table."""
+        with pytest.raises(ValueError):
+            install_change_triggers(factory.kw["bind"], [SyncCustomer])
+
+    def test_postgresql_ddl(self):
+        """PostgreSQL DDL bumps versions in a BEFORE trigger and logs AFTER."""
+        ddl = "\n".join(trigger_ddl(SyncPart, "postgresql"))
+        assert "BEFORE UPDATE ON sync_parts" in ddl
+        assert "AFTER INSERT OR DELETE ON sync_parts" in ddl
+        assert "IS DISTINCT FROM" in ddl and "data_shuttle_bridge.node_id" in ddl
+        assert all(
+            s.startswith("DROP TRIGGER IF EXISTS")
+            for s in drop_trigger_ddl(SyncPart, "postgresql")
+        )
+
+    def test_other_engines_get_the_node_function(self, factory, tmp_path):
+        """Writers through an engine without enable_trigger_capture still log."""
+        other = create_engine(f"sqlite:///{tmp_path}/server.db")
+        set_current_node_id("n2")
+        try:
+            with Session(other) as sess:
+                sess.add(SyncPart(id=1, sku="a"))
+                sess.commit()
+        finally:
+            set_current_node_id(None)
+        with factory() as sess:
+            assert self._log(sess) == [(1, "I", 1, "n2")]
+
+    def test_postgresql_node_setting_is_bound(self):
+        """The node id reaches set_config as a bound parameter, never as SQL."""
+        from types import SimpleNamespace
+
+        from data_shuttle_bridge.sql.triggers import PG_NODE_SETTING, _set_pg_node
+
+        executed = []
+        cursor = SimpleNamespace(execute=lambda *args: executed.append(args))
+        for paramstyle, sql in [
+            ("pyformat", "SELECT set_config(%s, %s, true)"),
+            ("numeric_dollar", "SELECT set_config($1, $2, true)"),
+        ]:
+            conn = SimpleNamespace(
+                info={}, dialect=SimpleNamespace(paramstyle=paramstyle)
+            )
+            set_current_node_id("o'brien")
+            try:
+                _set_pg_node(conn, cursor, "UPDATE x", {}, None, False)
+                # Unchanged node id: not re-sent within the transaction
+                _set_pg_node(conn, cursor, "UPDATE x", {}, None, False)
+            finally:
+                set_current_node_id(None)
+            assert executed.pop() == (sql, (PG_NODE_SETTING, "o'brien"))
+            assert executed == []
+
+    def test_postgresql_triggers_execute(self):
+        """Against a live server (DSB_TEST_POSTGRES_URL), triggers log writes."""
+        import os
+
+        from sqlalchemy import insert, update
+
+        url = os.environ.get("DSB_TEST_POSTGRES_URL")
+        if not url:
+            pytest.skip("DSB_TEST_POSTGRES_URL is not set")
+        engine = create_engine(url)
+        tables = [ChangeLog.__table__, SyncPart.__table__]
+        SQLModel.metadata.drop_all(engine, tables=tables)
+        SQLModel.metadata.create_all(engine, tables=tables)
+        try:
+            install_change_triggers(engine, [SyncPart])
+            set_current_node_id("pg")
+            try:
+                with Session(engine) as sess:
+                    sess.execute(insert(SyncPart), [{"id": 1, "sku": "a"}])
+                    sess.execute(update(SyncPart).values(qty=3))
+                    sess.commit()
+            finally:
+                set_current_node_id(None)
+            with Session(engine) as sess:
+                assert self._log(sess) == [(1, "I", 1, "pg"), (1, "U", 2, "pg")]
+        finally:
+            SQLModel.metadata.drop_all(engine, tables=tables)
+
+
+class TestStatementCapture:
+    def _log(self, sess: Session) -> list:
+        entries = sess.exec(
+            select(ChangeLog)
+            .where(ChangeLog.table == "sync_bins")
+            .order_by(ChangeLog.id)
+        )
+        return [(e.pk, e.op, e.version) for e in entries]
+
+    def test_bulk_inserts_are_logged(self, server_session):
+        """Core, multi-VALUES and bulk_insert_mappings inserts are logged once per row."""
+        from sqlalchemy import insert
+
+        server_session.execute(insert(SyncBin), [{"label": "a"}, {"label": "b"}])
+        server_session.execute(
+            insert(SyncBin).values([{"label": "c"}, {"label": "d", "qty": 2}])
+        )
+        server_session.bulk_insert_mappings(SyncBin, [{"label": "e"}])
+        server_session.commit()
+        ids = [b.id for b in server_session.exec(select(SyncBin).order_by(SyncBin.id))]
+        assert len(ids) == 5
+        assert self._log(server_session) == [(pk, "I", 1) for pk in ids]
+
+    def test_database_generated_ids_are_returned(self, server_session):
+        """Ids the database assigns are read back with RETURNING and logged."""
+        from sqlalchemy import insert
+
+        server_session.execute(insert(SyncBin).values(id=None, label="db"))
+        server_session.commit()
+        (row,) = server_session.exec(select(SyncBin)).all()
+        assert self._log(server_session) == [(row.id, "I", 1)]
+
+    def test_unreadable_inserts_raise(self, server_session, monkeypatch):
+        """Without RETURNING, inserts whose ids can't be read fail loudly."""
+        from sqlalchemy import insert
+
+        from data_shuttle_bridge.sql.statement_capture import InsertCaptureError
+
+        dialect = server_session.get_bind().dialect
+        monkeypatch.setattr(dialect, "insert_returning", False)
+        monkeypatch.setattr(dialect, "insert_executemany_returning", False)
+        server_session.execute(insert(SyncBin), [{"label": "a"}, {"label": "b"}])
+        assert len(self._log(server_session)) == 2
+        for stmt in (
+            insert(SyncBin).values(id=None, label="db"),
+            insert(SyncBin).values([{"label": "c"}, {"label": "d"}]),
+        ):
+            with pytest.raises(InsertCaptureError):
+                server_session.execute(stmt)
+            server_session.rollback()
+
+    def test_flushed_inserts_are_not_logged_twice(self, server_session):
+        """Unit-of-work inserts stay with the mapper hooks."""
+        server_session.add_all([SyncBin(label="a"), SyncBin(label="b")])
+        server_session.commit()
+        assert [op for _, op, _ in self._log(server_session)] == ["I", "I"]
+
+    def test_flush_without_work_keeps_capture_on(self, server_session):
+        """A targeted flush that writes nothing doesn't disable insert capture."""
+        a, b = SyncBin(label="a"), SyncBin(label="b")
+        server_session.add_all([a, b])
+        server_session.commit()
+        a.label = "a2"
+        server_session.flush([b])
+        server_session.execute(SyncBin.__table__.insert(), [{"label": "c"}])
+        server_session.commit()
+        assert [op for _, op, _ in self._log(server_session)] == ["I", "I", "I", "U"]
+
+    def test_orm_update_bumps_and_logs(self, server_session):
+        """update(Model) bumps versions and logs affected rows with their fields."""
+        from sqlalchemy import update
+
+        server_session.add_all([SyncBin(label=f"b{i}", qty=i) for i in range(4)])
+        server_session.commit()
+        loaded = server_session.exec(select(SyncBin).where(SyncBin.qty == 0)).one()
+        server_session.execute(update(SyncBin).where(SyncBin.qty < 2).values(label="x"))
+        server_session.commit()
+        assert loaded.label == "x" and loaded.version == 2
+        updates = server_session.exec(
+            select(ChangeLog).where(ChangeLog.table == "sync_bins", ChangeLog.op == "U")
+        ).all()
+        assert sorted(e.version for e in updates) == [2, 2]
+        assert set(updates[0].summary["fields"]) == {"label", "version"}
+
+    def test_bulk_update_by_primary_key(self, server_session):
+        """Bulk UPDATE by primary key bumps and logs each row."""
+        from sqlalchemy import update
+
+        bins = [SyncBin(label="a"), SyncBin(label="b")]
+        server_session.add_all(bins)
+        server_session.commit()
+        ids = [b.id for b in bins]
+        server_session.execute(update(SyncBin), [{"id": pk, "qty": 9} for pk in ids])
+        server_session.commit()
+        assert self._log(server_session)[2:] == [(ids[0], "U", 2), (ids[1], "U", 2)]
+
+    def test_orm_delete_is_logged(self, server_session):
+        """delete(Model) logs a D entry per deleted row."""
+        from sqlalchemy import delete
+
+        server_session.add_all([SyncBin(label="a"), SyncBin(label="b")])
+        server_session.commit()
+        server_session.execute(delete(SyncBin).where(SyncBin.label == "a"))
+        server_session.commit()
+        assert [op for _, op, _ in self._log(server_session)] == ["I", "I", "D"]
+
+    def test_rolled_back_statement_leaves_no_entries(self, server_session):
+        """Entries share the statement's transaction."""
+        from sqlalchemy import insert
+
+        server_session.execute(insert(SyncBin), [{"label": "a"}])
+        server_session.rollback()
+        assert self._log(server_session) == []
+
+    def test_bulk_apply_is_not_logged_twice(self, server_session, client_session):
+        """The sync engine's own upserts are logged once, by the engine."""
+        schema = build_schema([SyncBin])
+        client_session.add_all([SyncBin(label=f"b{i}") for i in range(3)])
+        client_session.commit()
+        changes = SyncEngine(client_session, "c", schema).remote_changes_since(0)
+        SyncEngine(server_session, "s", schema, bulk_apply=True).apply_remote_changes(
+            changes
+        )
+        server_session.commit()
+        assert len(self._log(server_session)) == 3
+
+
+class FakeClock:
+    """Millisecond clock that only moves when the generator sleeps."""
+
+    def __init__(self, ms: int):
+        self.ms = ms
+        self.sleeps: list[float] = []
+
+    def now(self) -> int:
+        return self.ms
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.ms += max(1, round(seconds * 1000))
+
+
+class TestKSortedID:
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        clock = FakeClock(EPOCH_MS + 1000)
+        monkeypatch.setattr(KSortedID, "_now_ms", lambda self: clock.now())
+        monkeypatch.setattr("data_shuttle_bridge.sql.ids.time.sleep", clock.sleep)
+        return clock
+
+    def test_reserve_is_contiguous_and_monotone(self, clock):
+        """Blocks are consecutive ids within one millisecond, increasing across calls."""
+        gen = KSortedID(node_id=3)
+        first = gen.reserve(100)
+        assert len(first) == 100 and list(first) == list(range(first.start, first.stop))
+        second = gen.reserve(5000)
+        # Capped at the millisecond's remaining sequence numbers
+        assert len(second) == 4096 - 100 and second.start == first.stop
+        third = gen.reserve(10)
+        assert third.start > second[-1] and gen() > third[-1]
+
+    def test_exhausted_sequence_sleeps(self, clock):
+        """Running out of sequence numbers sleeps into the next millisecond."""
+        gen = KSortedID(node_id=1)
+        ids = [gen() for _ in range(4097)]
+        assert len(set(ids)) == 4097 and ids == sorted(ids)
+        assert clock.sleeps == [0.001]
+
+    def test_clock_stepping_back_never_reuses_ids(self, clock):
+        """A clock that goes backwards keeps issuing from the last millisecond."""
+        gen = KSortedID(node_id=1)
+        before = gen()
+        clock.ms -= 50
+        assert gen() > before
+
+    def test_thread_blocks_are_unique(self):
+        """Threads serving ids from their own blocks never hand out duplicates."""
+        import threading
+
+        gen = KSortedID(node_id=7, block_size=64)
+        results: list[list[int]] = [[] for _ in range(4)]
+
+        def work(out):
+            out.extend(gen() for _ in range(5000))
+
+        threads = [threading.Thread(target=work, args=(r,)) for r in results]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert all(r == sorted(r) for r in results)
+        assert len({i for r in results for i in r}) == 20000
+
+
+class TestIdLayout:
+    WIDE = IdLayout(node_bits=16, sequence_bits=6)
+
+    def test_layout_validation(self):
+        """Layouts must fill exactly 63 bits with non-empty fields."""
+        with pytest.raises(ValueError):
+            IdLayout(node_bits=16)
+        with pytest.raises(ValueError):
+            IdLayout(timestamp_bits=51, node_bits=12, sequence_bits=0)
+        assert IdLayout.parse("41:16:6") == self.WIDE
+        assert IdLayout.from_dict(self.WIDE.to_dict()) == self.WIDE
+        with pytest.raises(IdLayoutMismatch):
+            IdLayout().check_compatible(self.WIDE)
+
+    def test_generator_uses_layout(self):
+        """Wide layouts allow large node ids and pack them into the id."""
+        gen = KSortedID(node_id=40000, layout=self.WIDE)
+        block = gen.reserve(1000)
+        assert len(block) == 64
+        ms, node, seq = self.WIDE.decompose(block[5])
+        assert (node, seq) == (40000, 5) and ms > 0
+        with pytest.raises(ValueError):
+            KSortedID(node_id=40000)
+
+    def test_registry_persists_layout(self, server_session):
+        """The registry stores the layout once and leases node ids within it."""
+        from data_shuttle_bridge.sql.registry import allocate_node_id, ensure_id_layout
+
+        assert ensure_id_layout(server_session, self.WIDE) == self.WIDE
+        assert ensure_id_layout(server_session) == self.WIDE
+        with pytest.raises(IdLayoutMismatch):
+            ensure_id_layout(server_session, IdLayout())
+        assert allocate_node_id(server_session, "dev-1", layout=self.WIDE) == 1
+
+    def test_registry_refuses_layout_too_narrow_for_leases(self, server_session):
+        """A layout can't be adopted if already leased node ids don't fit it."""
+        from data_shuttle_bridge.sql.registry import NodeRegistry, ensure_id_layout
+
+        server_session.add(NodeRegistry(device_key="big", node_id=5000))
+        server_session.commit()
+        with pytest.raises(ValueError):
+            ensure_id_layout(server_session)
+
+    def test_client_stores_leased_layout(self, tmp_path):
+        """ClientNodeManager persists the server's layout with its node id."""
+        from flask import Flask
+
+        from data_shuttle_bridge.sql.nodeid import ClientNodeManager
+        from data_shuttle_bridge.sql.registry import node_registry_blueprint
+
+        factory = make_sessionmaker(tmp_path / "server.db")
+        app = Flask(__name__)
+        app.register_blueprint(node_registry_blueprint(factory, layout=self.WIDE))
+        http = FlaskSession(app)
+        config = str(tmp_path / "client" / "config.json")
+        mgr = ClientNodeManager(config_path=config)
+        assert mgr.ensure_node_id("http://server", session=http) == 1
+        assert ClientNodeManager(config_path=config).id_layout == self.WIDE
+        assert http.get("http://server/node/layout").json() == self.WIDE.to_dict()
+
+
+class TestIdGeneratorRegistry:
+    def test_requests_share_the_node_generator(self):
+        """Repeated set_id_generator calls, from any thread, bind one generator."""
+        import threading
+
+        set_id_generator(42)
+        first = get_id_generator()
+        seen = []
+
+        def request():
+            set_id_generator(42)
+            seen.append(get_id_generator())
+            clear_id_generator()
+
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        set_id_generator(42)
+        assert all(g is first for g in seen) and get_id_generator() is first
+
+    def test_idle_generators_are_evicted(self):
+        """Only the most recently used unreferenced generators are kept."""
+        registry = IdGeneratorRegistry(max_idle=2)
+        held = registry.get(1)
+        for node_id in (2, 3, 4):
+            registry.get(node_id)
+        # Node 2 was evicted; node 1 too, but it is still referenced
+        assert len(registry) == 3
+        assert registry.get(1) is held
+        registry.clear()
+        assert len(registry) == 1
+
+    def test_recreated_generator_skips_current_millisecond(self, monkeypatch):
+        """A node's new generator never reissues ids from the old one's millisecond."""
+        clock = FakeClock(EPOCH_MS + 1000)
+        monkeypatch.setattr(KSortedID, "_now_ms", lambda self: clock.now())
+        monkeypatch.setattr("data_shuttle_bridge.sql.ids.time.sleep", clock.sleep)
+        registry = IdGeneratorRegistry(max_idle=0)
+        last = registry.get(5)()
+        # Dropped as soon as unreferenced; the next one starts a millisecond later
+        assert registry.get(5)() > last
+        assert len(clock.sleeps) == 2
+
+
+class TestNodeIdAllocator:
+    # Node ids 1..3 only
+    TINY = IdLayout(timestamp_bits=59, node_bits=2, sequence_bits=2)
+
+    def test_leases_and_renews(self, server_session):
+        """Devices get the lowest free id; registering again keeps and renews it."""
+        from data_shuttle_bridge.sql.registry import NodeIdAllocator, NodeRegistry
+
+        allocator = NodeIdAllocator()
+        assert [allocator.allocate(server_session, f"d{i}") for i in range(3)] == [
+            1,
+            2,
+            3,
+        ]
+        entry = server_session.exec(
+            select(NodeRegistry).where(NodeRegistry.device_key == "d0")
+        ).one()
+        entry.last_seen_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        server_session.commit()
+        assert allocator.allocate(server_session, "d0") == 1
+        assert server_session.get(NodeRegistry, entry.id).last_seen_at.year > 2020
+
+    def test_stale_map_retries_on_unique_violation(self, server_session):
+        """An id leased by another process is skipped via the unique constraint."""
+        from data_shuttle_bridge.sql.registry import NodeIdAllocator
+
+        first, second = NodeIdAllocator(), NodeIdAllocator()
+        assert second.allocate(server_session, "a") == 1
+        assert first.allocate(server_session, "b") == 2
+        # second's map still has 2 free
+        assert second.allocate(server_session, "c") == 3
+
+    def test_expired_leases_are_reclaimed_when_full(self, server_session):
+        """With a TTL, ids of devices idle past it are reused once none is free."""
+        from data_shuttle_bridge.sql.registry import NodeIdAllocator, NodeRegistry
+
+        allocator = NodeIdAllocator(self.TINY, lease_ttl=timedelta(days=30))
+        for i in range(3):
+            allocator.allocate(server_session, f"d{i}")
+        with pytest.raises(RuntimeError):
+            NodeIdAllocator(self.TINY).allocate(server_session, "new")
+        entry = server_session.exec(
+            select(NodeRegistry).where(NodeRegistry.node_id == 2)
+        ).one()
+        entry.last_seen_at = datetime.now(timezone.utc) - timedelta(days=31)
+        server_session.commit()
+        assert allocator.allocate(server_session, "new") == 2
+
+    def test_syncing_nodes_keep_their_lease(self, tmp_path):
+        """A node that keeps pulling is renewed, not reclaimed, past its TTL."""
+        from data_shuttle_bridge.sql.registry import NodeIdAllocator, NodeRegistry
+
+        factory = make_sessionmaker(tmp_path / "server.db")
+        client = make_sync_app(factory).test_client()
+        allocator = NodeIdAllocator(self.TINY, lease_ttl=timedelta(days=30))
+        long_ago = datetime.now(timezone.utc) - timedelta(days=31)
+        with factory() as sess:
+            for i in range(3):
+                allocator.allocate(sess, f"d{i}")
+            for entry in sess.exec(select(NodeRegistry)):
+                entry.last_seen_at = long_ago
+            sess.commit()
+        assert (
+            client.post("/sync/ack", json={"last_seen": 0, "node_id": "2"}).status_code
+            == 200
+        )
+        with factory() as sess:
+            sess.get(SyncAck, "2").acked_at = long_ago
+            sess.commit()
+        # An empty pull still counts as activity
+        assert (
+            client.get("/sync/changes?since_id=0&exclude_node_id=2").status_code == 200
+        )
+        with factory() as sess:
+            assert allocator.allocate(sess, "new") == 1
+            entry = sess.exec(
+                select(NodeRegistry).where(NodeRegistry.node_id == 2)
+            ).one()
+            assert entry.device_key == "d1"
+            assert entry.last_seen_at.replace(tzinfo=timezone.utc) > long_ago
+
+    def test_upgrades_baseline_registry_table(self, tmp_path, capsys):
+        """A node_registry created before leases gains last_seen_at on first use."""
+        from sqlalchemy import inspect, text
+
+        from data_shuttle_bridge.sql.registry import NodeIdAllocator, NodeRegistry
+
+        engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "CREATE TABLE node_registry ("
+                    " id INTEGER NOT NULL PRIMARY KEY,"
+                    " device_key VARCHAR(64) NOT NULL,"
+                    " node_id INTEGER NOT NULL,"
+                    " CONSTRAINT uq_node_registry_device_key UNIQUE (device_key),"
+                    " CONSTRAINT uq_node_registry_node_id UNIQUE (node_id))"
+                )
+            )
+            conn.execute(
+                text(
+                    "INSERT INTO node_registry (device_key, node_id) VALUES ('old', 1)"
+                )
+            )
+        with Session(engine) as sess:
+            allocator = NodeIdAllocator(lease_ttl=timedelta(days=30))
+            assert allocator.allocate(sess, "old") == 1
+            assert allocator.allocate(sess, "new") == 2
+            assert (
+                sess.exec(select(NodeRegistry).where(NodeRegistry.device_key == "new"))
+                .one()
+                .last_seen_at
+                is not None
+            )
+        columns = {c["name"] for c in inspect(engine).get_columns("node_registry")}
+        assert "last_seen_at" in columns
+        assert any(
+            i["column_names"] == ["last_seen_at"]
+            for i in inspect(engine).get_indexes("node_registry")
+        )
+        # Idempotent, also from the command line
+        assert main(["node", "upgrade-registry", "--db", str(engine.url)]) == 0
+        assert "added=-" in capsys.readouterr().out
+
+    def test_client_renewal(self, tmp_path):
+        """Clients renew over HTTP and drop a lease the server reclaimed."""
+        from flask import Flask
+
+        from data_shuttle_bridge.sql.nodeid import ClientNodeManager
+        from data_shuttle_bridge.sql.registry import (
+            NodeRegistry,
+            node_registry_blueprint,
+        )
+
+        factory = make_sessionmaker(tmp_path / "server.db")
+        app = Flask(__name__)
+        app.register_blueprint(
+            node_registry_blueprint(factory, lease_ttl=timedelta(days=30))
+        )
+        http = FlaskSession(app)
+        mgr = ClientNodeManager(config_path=str(tmp_path / "client.json"))
+        assert mgr.ensure_node_id("http://server", session=http) == 1
+        assert mgr.renew_lease("http://server", session=http)
+        with factory() as sess:
+            sess.delete(sess.exec(select(NodeRegistry)).one())
+            sess.commit()
+        assert not mgr.renew_lease("http://server", session=http)
+        assert mgr.node_id is None
+
+    def test_ensure_node_id_renews_and_releases(self, tmp_path):
+        """A saved node id is renewed on start and replaced once reclaimed."""
+        from flask import Flask
+
+        from data_shuttle_bridge.sql.nodeid import ClientNodeManager
+        from data_shuttle_bridge.sql.registry import (
+            NodeRegistry,
+            node_registry_blueprint,
+        )
+
+        factory = make_sessionmaker(tmp_path / "server.db")
+        app = Flask(__name__)
+        app.register_blueprint(
+            node_registry_blueprint(factory, lease_ttl=timedelta(days=30))
+        )
+        http = FlaskSession(app)
+        config = str(tmp_path / "client.json")
+        assert ClientNodeManager(config).ensure_node_id("http://s", session=http) == 1
+        with factory() as sess:
+            entry = sess.exec(select(NodeRegistry)).one()
+            entry.last_seen_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+            sess.commit()
+        # Restart: the saved id is renewed, not silently reused
+        assert ClientNodeManager(config).ensure_node_id("http://s", session=http) == 1
+        with factory() as sess:
+            assert sess.exec(select(NodeRegistry)).one().last_seen_at.year > 2020
+            # The lease is lost (reclaimed and handed to another device)
+            sess.exec(select(NodeRegistry)).one().device_key = "someone-else"
+            sess.commit()
+        mgr = ClientNodeManager(config)
+        assert mgr.ensure_node_id("http://s", session=http) == 2
+        assert ClientNodeManager(config).node_id == 2